@@ -1,10 +1,11 @@
 from openpharmacophore.utils.alignment import align_set_of_ligands
-from openpharmacophore.utils.centroid import feature_centroid
-from openpharmacophore.utils.ligand_features import rdkit_to_point
+from openpharmacophore.utils.ligand_features import rdkit_to_point, compile_feature_patterns, feature_sites
 import numpy as np
 from sklearn.cluster import DBSCAN
-from rdkit import Chem, RDConfig
+from rdkit import RDConfig
 from rdkit.Chem import ChemicalFeatures
+from concurrent.futures import ProcessPoolExecutor
+from itertools import product
 import os
 
 def get_feature_clusters(feat_coords, eps, min_samples):
@@ -57,7 +58,7 @@ def get_feature_clusters(feat_coords, eps, min_samples):
         
     return clusters
 
-def dbscan_pharmacophore(ligands, radius=1, eps=2, min_samples=0.75, feat_list=None, feat_def=None):
+def dbscan_pharmacophore(ligands, radius=1, eps=2, min_samples=0.75, feat_list=None, feat_def=None, use_cache=True):
     """
     Compute a ligand based pharmacophore from a list of ligands, using a density based 
     clustering algorithm.
@@ -86,6 +87,10 @@ def dbscan_pharmacophore(ligands, radius=1, eps=2, min_samples=0.75, feat_list=N
             Definitions of the pharmacophoric points. 
             Dictionary which keys are SMARTS strings and values are feature names.
 
+    use_cache: bool
+            If true the conformers of the ligands are taken from the default conformer cache
+            when they have already been embedded. (Default: True)
+
     Returns
     ----------
 
@@ -99,58 +104,12 @@ def dbscan_pharmacophore(ligands, radius=1, eps=2, min_samples=0.75, feat_list=N
     if min_samples < 0 or min_samples > 1:
         raise ValueError("min_samples must be a value between 0 and 1")
     
-    aligned_ligands, _ = align_set_of_ligands(ligands)
-
-    if feat_def is None: # If no feature definition is given use rdkit one
-        fdefName = os.path.join(RDConfig.RDDataDir,'BaseFeatures.fdef')
-        factory = ChemicalFeatures.BuildFeatureFactory(fdefName)
-    else:
-        reverse_feat_dict = {}
-        for smarts, feat_name in feat_def.items():
-            if feat_name not in reverse_feat_dict:
-                reverse_feat_dict[feat_name] = []
-            reverse_feat_dict[feat_name].append(smarts)
+    aligned_ligands, _ = align_set_of_ligands(ligands, use_cache=use_cache)
     
     if not feat_list:
         feat_list = ['Acceptor', 'Aromatic', 'Donor', 'Hydrophobe', 'PosIonizable', 'NegIonizable']
-    
-    feat_coords = {}
-    for feature in feat_list:
-        feat_coords[feature] = []
-
-        for ligand in aligned_ligands:
-            if feat_def is None:
-                feats = factory.GetFeaturesForMol(ligand, includeOnly=feature)
-                for f in feats:
-                    atom_idxs = f.GetAtomIds()
-                    if len(atom_idxs) > 1: # Aromatic, hydrophobic, positive or negative feature
-                        coords = feature_centroid(ligand, atom_idxs, 0)
-                    else: # Donor or acceptor feature
-                        position = ligand.GetConformer(0).GetAtomPosition(atom_idxs[0])
-                        coords = np.zeros((3,))
-                        coords[0] = position.x
-                        coords[1] = position.y
-                        coords[2] = position.z
-                feat_coords[feature].append((coords.tolist()))
-            else:
-                for f in reverse_feat_dict[feature]:
-                    pattern = Chem.MolFromSmarts(f)  
-                    atom_idxs = ligand.GetSubstructMatch(pattern)
-                    if len(atom_idxs) == 0:
-                        continue
-                    elif len(atom_idxs) == 1: # Donor or acceptor feature
-                        position = ligand.GetConformer(0).GetAtomPosition(atom_idxs[0])
-                        coords = np.zeros((3,))
-                        coords[0] = position.x
-                        coords[1] = position.y
-                        coords[2] = position.z
-                    elif len(atom_idxs) > 1: # Aromatic, hydrophobic, positive or negative feature
-                        coords = feature_centroid(ligand, atom_idxs, 0)      
-                 
-                    feat_coords[feature].append((coords.tolist()))
-        feat_coords[feature] = np.array(feat_coords[feature])
-
-    feat_coords = {feature: coords for feature, coords in feat_coords.items() if len(coords) > 0} # remove features with no coordinates
+
+    feat_coords = ligands_feature_coordinates(aligned_ligands, feat_list, feat_def)
     
     min_samples = int(min_samples * len(ligands)) 
     feature_clusters = get_feature_clusters(feat_coords, eps=eps, min_samples=min_samples)
@@ -161,4 +120,172 @@ def dbscan_pharmacophore(ligands, radius=1, eps=2, min_samples=0.75, feat_list=N
             point = rdkit_to_point(feature_type, center, radius=radius, direction=None)
             pharmacophoric_points.append(point)
 
-    return pharmacophoric_points, aligned_ligands
\ No newline at end of file
+    return pharmacophoric_points, aligned_ligands
+
+def ligands_feature_coordinates(ligands, feat_list, feat_def=None):
+    """
+    Get the 3D coordinates of the chemical features of a set of aligned ligands, grouped by
+    feature type. Coordinates are taken from the first conformer of each ligand.
+
+    Parameters
+    ----------
+
+    ligands: list of rdkit.Chem.Mol
+        List of aligned ligands.
+
+    feat_list: list of str
+        List of features which coordinates will be computed.
+            
+    feat_def: dict (optional)
+        Definitions of the pharmacophoric points. 
+        Dictionary which keys are SMARTS strings and values are feature names.
+        If None the rdkit feature definition will be used.
+
+    Returns
+    ----------
+
+    feat_coords: dict
+        Dictionary which keys are feature names and values are numpy arrays with the coordinates
+        of the features. Features with no coordinates are not included.
+
+    """
+    if feat_def is None: # If no feature definition is given use rdkit one
+        fdefName = os.path.join(RDConfig.RDDataDir,'BaseFeatures.fdef')
+        factory = ChemicalFeatures.BuildFeatureFactory(fdefName)
+    else:
+        # Find the feature sites of each ligand only once, evaluating all the patterns together
+        patterns = compile_feature_patterns(feat_def, feat_list)
+
+    feat_coords = {feature: [] for feature in feat_list}
+    for ligand in ligands:
+        if feat_def is None:
+            sites = [(f.GetFamily(), f.GetAtomIds()) for f in factory.GetFeaturesForMol(ligand)]
+        else:
+            sites = feature_sites(ligand, patterns)
+        
+        positions = ligand.GetConformer(0).GetPositions()
+        for feat_name, atom_idxs in sites:
+            if feat_name not in feat_coords:
+                continue
+            # Centroid of the feature. For donors and acceptors this is the atom position
+            coords = positions[list(atom_idxs)].mean(axis=0)
+            feat_coords[feat_name].append(coords)
+    
+    # Remove features with no coordinates
+    feat_coords = {feature: np.array(coords) for feature, coords in feat_coords.items() if len(coords) > 0}
+    return feat_coords
+
+def _cluster_feature(job):
+    """ Cluster the coordinates of a single feature type. Used as the task of the
+        worker processes of dbscan_parameter_sweep.
+    """
+    feature, coords, eps, min_samples = job
+    clusters = get_feature_clusters({feature: coords}, eps=eps, min_samples=min_samples)
+    return clusters[feature]
+
+def dbscan_parameter_sweep(ligands, eps=(2,), min_samples=(0.75,), radius=(1,), feat_lists=None, 
+                           feat_def=None, n_workers=None, use_cache=True):
+    """
+    Compute ligand based pharmacophores for every combination of a grid of parameters of
+    the density based clustering algorithm.
+
+    The ligands are aligned and their feature coordinates extracted only once. Then each
+    feature type is clustered for every combination of eps and min_samples in a pool of
+    processes, and the resulting clusters are combined into a pharmacophore for every 
+    combination of parameters.
+    
+    Parameters
+    ----------
+
+    ligands: :obj: list of rdkit.Chem.rdchem.Mol rdkit.Chem.SmilesMolSupplier or rdkit.Chem.SDMolSupplier
+            List of ligands.
+
+    eps: list of float
+        Values of the maximum distance between two pharmacophoric points for one to be considered 
+        as in the neighborhood of the other. (Default: (2,))
+
+    min_samples: list of float between 0 and 1
+        Values of the percentage of ligands that must contain a pharmacophoric point to be 
+        considered as a core point. (Default (0.75,))
+
+    radius: list of float
+        Values of the radius of the parmacohporic points (Default: (1,))
+    
+    feat_lists: list of list of str (optional)
+            Lists of features that will be used to compute the pharmacophores. If None, a single
+            list with all the default features is used.
+            
+    feat_def: dict
+            Definitions of the pharmacophoric points. 
+            Dictionary which keys are SMARTS strings and values are feature names.
+
+    n_workers: int (optional)
+            Number of processes used for clustering. If None the number of processors of the 
+            machine is used. If 1 clustering is done in the current process.
+
+    use_cache: bool
+            If true the conformers of the ligands are taken from the default conformer cache
+            when they have already been embedded. (Default: True)
+
+    Returns
+    ----------
+
+    results: list of 2-tuples (dict, list of openpharmacophore.PharmacophoricPoint)
+        The parameters (eps, min_samples, radius and feat_list) and the pharmacophoric points
+        of each combination of parameters.
+
+    aligned_ligands: list of rdkit.Chem.Mol
+        A list containing the aligned ligands.
+
+    """
+    for value in min_samples:
+        if value < 0 or value > 1:
+            raise ValueError("min_samples must be a value between 0 and 1")
+
+    all_features = ['Acceptor', 'Aromatic', 'Donor', 'Hydrophobe', 'PosIonizable', 'NegIonizable']
+    if not feat_lists:
+        feat_lists = [all_features]
+    feat_lists = [list(feat_list) if feat_list else all_features for feat_list in feat_lists]
+    
+    if not isinstance(ligands, list):
+        ligands = list(ligands)
+    aligned_ligands, _ = align_set_of_ligands(ligands, use_cache=use_cache)
+
+    features = sorted(set(feat for feat_list in feat_lists for feat in feat_list))
+    feat_coords = ligands_feature_coordinates(aligned_ligands, features, feat_def)
+
+    # Each feature type is clustered independently, so every (feature, eps, min_samples)
+    # combination needs to be clustered only once regardless of radius and feature list.
+    jobs = []
+    for feature, coords in feat_coords.items():
+        for eps_value in eps:
+            for min_samples_value in min_samples:
+                jobs.append((feature, coords, eps_value, int(min_samples_value * len(ligands))))
+    
+    if n_workers == 1 or len(jobs) <= 1:
+        centroids = list(map(_cluster_feature, jobs))
+    else:
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            centroids = list(executor.map(_cluster_feature, jobs))
+    clusters = {job[:1] + job[2:]: centers for job, centers in zip(jobs, centroids)}
+
+    results = []
+    for eps_value, min_samples_value, radius_value, feat_list in product(eps, min_samples, radius, feat_lists):
+        n_samples = int(min_samples_value * len(ligands))
+        pharmacophoric_points = []
+        for feature_type in feat_list:
+            if feature_type not in feat_coords:
+                continue
+            for center in clusters[(feature_type, eps_value, n_samples)]:
+                point = rdkit_to_point(feature_type, center, radius=radius_value, direction=None)
+                pharmacophoric_points.append(point)
+        
+        parameters = {
+            "eps": eps_value, 
+            "min_samples": min_samples_value, 
+            "radius": radius_value,
+            "feat_list": feat_list,
+        }
+        results.append((parameters, pharmacophoric_points))
+    
+    return results, aligned_ligands
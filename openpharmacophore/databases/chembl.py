@@ -1,8 +1,270 @@
-from chembl_webresource_client.new_client import new_client
+from openpharmacophore.databases.rest_client import RestClient, TokenBucket
+from openpharmacophore.utils.cache import cache_root_dir
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
 import numpy as np
 import pandas as pd
 from tqdm.auto import tqdm
+from urllib.parse import urlencode
+import json
 import os
+import sqlite3
+import threading
+import time
+
+CHEMBL_API_URL = "https://www.ebi.ac.uk/chembl/api/data"
+
+# Maximum number of records per page allowed by the ChEMBL API
+_PAGE_SIZE = 1000
+# Number of molecules whose smiles are requested at a time
+_MOLECULES_PER_REQUEST = 100
+
+_client = None
+_client_lock = threading.Lock()
+
+class BioactivityCache():
+    """ Local SQLite cache of ChEMBL IC50 bioactivities and of the smiles of the
+        molecules, so targets are downloaded only once.
+
+        The id of the last activity downloaded for each target is stored, so refreshing
+        a target only downloads the activities that were added to ChEMBL afterwards.
+
+    Parameters
+    ----------
+    file_name: str (optional)
+        Name of the SQLite file. If None the file bioactivities.sqlite in the chembl 
+        subdirectory of the openpharmacophore cache directory is used.
+
+    """
+    _schema = """
+        CREATE TABLE IF NOT EXISTS activities (
+            activity_id INTEGER PRIMARY KEY,
+            target_chembl_id TEXT NOT NULL,
+            molecule_chembl_id TEXT,
+            standard_value REAL,
+            standard_units TEXT
+        );
+        CREATE INDEX IF NOT EXISTS activities_target ON activities (target_chembl_id);
+        CREATE TABLE IF NOT EXISTS molecules (
+            molecule_chembl_id TEXT PRIMARY KEY,
+            smiles TEXT
+        );
+        CREATE TABLE IF NOT EXISTS targets (
+            target_chembl_id TEXT PRIMARY KEY,
+            last_activity_id INTEGER,
+            updated_at REAL NOT NULL
+        );
+    """
+
+    def __init__(self, file_name=None):
+        if file_name is None:
+            file_name = os.path.join(cache_root_dir(), "chembl", "bioactivities.sqlite")
+        directory = os.path.dirname(file_name)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.file_name = file_name
+        with closing(self._connect()) as connection, connection:
+            connection.executescript(self._schema)
+
+    def activities(self, target_chembl_id):
+        """ Get the cached activities of a target.
+
+            Parameters
+            ----------
+            target_chembl_id: str
+                The target chembl id.
+
+            Returns
+            -------
+            pandas.DataFrame
+                A dataframe with the columns ChemblID, IC50, Units and Smiles.
+        """
+        query = """
+            SELECT a.molecule_chembl_id AS ChemblID, a.standard_value AS IC50, 
+                a.standard_units AS Units, m.smiles AS Smiles
+            FROM activities a LEFT JOIN molecules m ON a.molecule_chembl_id = m.molecule_chembl_id
+            WHERE a.target_chembl_id = ?
+            ORDER BY a.activity_id
+        """
+        with closing(self._connect()) as connection:
+            return pd.read_sql_query(query, connection, params=(target_chembl_id,))
+
+    def add_activities(self, target_chembl_id, activities):
+        """ Store activities of a target and mark the target as updated.
+
+            Parameters
+            ----------
+            target_chembl_id: str
+                The target chembl id.
+
+            activities: list of dict
+                Activity records of the ChEMBL API.
+        """
+        rows = [
+            (int(activity["activity_id"]), target_chembl_id, activity["molecule_chembl_id"],
+             _to_float(activity["standard_value"]), activity["standard_units"])
+            for activity in activities
+        ]
+        with closing(self._connect()) as connection, connection:
+            connection.executemany("INSERT OR REPLACE INTO activities VALUES (?, ?, ?, ?, ?)", rows)
+            last_activity_id = connection.execute(
+                "SELECT MAX(activity_id) FROM activities WHERE target_chembl_id = ?", (target_chembl_id,)
+            ).fetchone()[0]
+            connection.execute("INSERT OR REPLACE INTO targets VALUES (?, ?, ?)", 
+                               (target_chembl_id, last_activity_id, time.time()))
+
+    def add_molecules(self, smiles):
+        """ Store the smiles of molecules.
+
+            Parameters
+            ----------
+            smiles: dict
+                The smiles of each molecule chembl id. None for molecules without structure.
+        """
+        with closing(self._connect()) as connection, connection:
+            connection.executemany("INSERT OR REPLACE INTO molecules VALUES (?, ?)", smiles.items())
+
+    def last_activity_id(self, target_chembl_id):
+        """ Get the id of the last activity downloaded for a target.
+
+            Returns
+            -------
+            int or None
+                None if the target has never been downloaded or has no activities.
+        """
+        row = self._target_row(target_chembl_id)
+        return None if row is None else row[0]
+
+    def missing_molecules(self, molecule_chembl_ids):
+        """ Get the molecules whose smiles aren't in the cache.
+
+            Parameters
+            ----------
+            molecule_chembl_ids: list of str
+                The molecule chembl ids.
+
+            Returns
+            -------
+            list of str
+        """
+        with closing(self._connect()) as connection:
+            cached = {row[0] for row in connection.execute("SELECT molecule_chembl_id FROM molecules")}
+        return [chembl_id for chembl_id in dict.fromkeys(molecule_chembl_ids) if chembl_id not in cached]
+
+    def updated_at(self, target_chembl_id):
+        """ Get the last time a target was downloaded.
+
+            Returns
+            -------
+            float or None
+                Time in seconds since the epoch. None if the target has never been downloaded.
+        """
+        row = self._target_row(target_chembl_id)
+        return None if row is None else row[1]
+
+    def _connect(self):
+        """ Open a connection to the database. Each call opens a new connection, so the 
+            cache can be used from several threads.
+        """
+        return sqlite3.connect(self.file_name, timeout=60)
+
+    def _target_row(self, target_chembl_id):
+        """ Get the last activity id and update time of a target.
+        """
+        with closing(self._connect()) as connection:
+            return connection.execute(
+                "SELECT last_activity_id, updated_at FROM targets WHERE target_chembl_id = ?", 
+                (target_chembl_id,)
+            ).fetchone()
+
+
+class ChEMBLDump():
+    """ Offline backend that queries a local SQLite dump of the ChEMBL database, 
+        as distributed in the ChEMBL downloads page (chembl_XX_sqlite). 
+
+        It gives the same bioactivities as the ChEMBL web API without network access.
+
+    Parameters
+    ----------
+    file_name: str
+        Name of the SQLite file of the dump.
+
+    """
+    _bioactivities_query = """
+        SELECT t.chembl_id AS target_chembl_id, md.chembl_id AS ChemblID, a.standard_value AS IC50,
+            a.standard_units AS Units, cs.canonical_smiles AS Smiles
+        FROM target_dictionary t
+        JOIN assays s ON s.tid = t.tid
+        JOIN activities a ON a.assay_id = s.assay_id
+        JOIN molecule_dictionary md ON md.molregno = a.molregno
+        LEFT JOIN compound_structures cs ON cs.molregno = a.molregno
+        WHERE t.chembl_id IN ({}) AND a.type = 'IC50' AND a.relation = '=' AND s.assay_type = 'B'
+        ORDER BY a.activity_id
+    """
+    # Indices used by the bioactivities query
+    _indices = {
+        "target_dictionary_chembl_id": "target_dictionary (chembl_id)",
+        "assays_tid": "assays (tid)",
+        "activities_assay_id": "activities (assay_id)",
+        "compound_structures_molregno": "compound_structures (molregno)",
+    }
+
+    def __init__(self, file_name):
+        if not os.path.isfile(file_name):
+            raise FileNotFoundError(f"ChEMBL dump {file_name} does not exist")
+        self.file_name = file_name
+
+    def create_indices(self):
+        """ Create the indices used by the bioactivity queries if the dump doesn't have 
+            them. It only has to be done once and requires write access to the file.
+        """
+        with closing(sqlite3.connect(self.file_name)) as connection, connection:
+            for name, columns in self._indices.items():
+                connection.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {columns}")
+
+    def get_bioactivity_dataframe(self, target_chembl_id):
+        """Get bioactivity data for a given target.
+    
+            Parameters
+            ----------
+            target_chembl_id: str
+                The target chembl id.
+            
+            Returns
+            -------
+            bioactivities_df: pandas.DataFrame
+                A dataframe with the following columns: ChemblID, Smiles,
+                and pIC50.
+        """
+        return self.get_bioactivity_dataframes([target_chembl_id])[target_chembl_id]
+
+    def get_bioactivity_dataframes(self, target_chembl_ids):
+        """Get bioactivity data for several targets with a single query.
+    
+            Parameters
+            ----------
+            target_chembl_ids: list of str
+                The targets chembl ids.
+            
+            Returns
+            -------
+            dict of pandas.DataFrame
+                The bioactivities dataframe of each target.
+        """
+        target_chembl_ids = list(dict.fromkeys(target_chembl_ids))
+        query = self._bioactivities_query.format(",".join("?" * len(target_chembl_ids)))
+        # The dump is opened read only
+        uri = "file:{}?mode=ro".format(os.path.abspath(self.file_name))
+        with closing(sqlite3.connect(uri, uri=True)) as connection:
+            activities = pd.read_sql_query(query, connection, params=target_chembl_ids)
+        
+        groups = dict(tuple(activities.groupby("target_chembl_id", sort=False)))
+        empty = activities.iloc[:0]
+        return {
+            target: _clean_bioactivities(groups.get(target, empty).drop(columns="target_chembl_id"))
+            for target in target_chembl_ids
+        }
+
 
 def get_ro5_dataset( download_dir):
     """Download subset of molecules that do not violate Lipinky's rule of five.
@@ -18,6 +280,8 @@ def get_ro5_dataset( download_dir):
         Nothing is returned. New files are written.
 
     """
+    # The client connects to ChEMBL when it's imported
+    from chembl_webresource_client.new_client import new_client
     molecules_api = new_client.molecule
     no_violations = molecules_api.filter(molecule_properties__num_ro5_violations=0).only(
         "molecule_chembl_id",
@@ -52,13 +316,33 @@ def get_ro5_dataset( download_dir):
     file.close()
 
 
-def get_bioactivity_dataframe(target_chembl_id):
+def get_bioactivity_dataframe(target_chembl_id, use_cache=True, max_age=7 * 24 * 3600, n_workers=4, dump=None):
     """Get bioactivity data for a given target.
+
+        Pages of activities are downloaded concurrently. When the cache is used, targets
+        downloaded less than max_age seconds ago are read from the cache and older ones
+        are refreshed by downloading only the activities added since.
+
+        If a ChEMBL dump is passed, or the environment variable OPENPHARMACOPHORE_CHEMBL_DUMP
+        gives the path to one, the bioactivities are read from it instead and no requests
+        are sent.
     
         Parameters
         ----------
         target_chembl_id: str
             The target chembl id.
+
+        use_cache: bool
+            If true the bioactivities are stored in the default BioactivityCache. (Default: True)
+
+        max_age: float
+            Time in seconds after which a cached target is refreshed. (Default: one week)
+
+        n_workers: int
+            Maximum number of concurrent requests. (Default: 4)
+
+        dump: str or ChEMBLDump (optional)
+            A local ChEMBL SQLite dump.
         
         Returns
         -------
@@ -66,79 +350,53 @@ def get_bioactivity_dataframe(target_chembl_id):
             A dataframe with the following columns: ChemblID, Smiles,
             and pIC50.
     """
-    activity_api = new_client.activity
-    compounds_api = new_client.molecule
+    dump = _get_dump(dump)
+    if dump is not None:
+        return dump.get_bioactivity_dataframe(target_chembl_id)
 
-    bioactivities = activity_api.filter(
-        target_chembl_id=target_chembl_id,
-        type="IC50",
-        relation="=",
-        assay_type="B"
-    ).only(
-        "molecule_chembl_id",
-        "standard_units",
-        "standard_value",
-    )
+    cache = BioactivityCache() if use_cache else None
+    activities = _fetch_target_activities(target_chembl_id, cache, max_age, _get_client(n_workers))
+    return _clean_bioactivities(activities)
 
-    n_records = len(bioactivities)
-
-    mol_chembl_id = np.empty(n_records, dtype=object)
-    IC50 = np.zeros(n_records)
-    units = np.empty(n_records, dtype=object)
-
-    print("Downloading bioactivity data...")
-    for i, bioact in enumerate(tqdm(bioactivities)):
-        mol_chembl_id[i] = bioact["molecule_chembl_id"]
-        IC50[i] = bioact["standard_value"]
-        units[i] = bioact["standard_units"]
+def get_bioactivity_dataframes(target_chembl_ids, use_cache=True, max_age=7 * 24 * 3600, n_workers=4, dump=None):
+    """Get bioactivity data for several targets. Targets are downloaded concurrently, or 
+        read from a local ChEMBL dump as in get_bioactivity_dataframe.
+    
+        Parameters
+        ----------
+        target_chembl_ids: list of str
+            The targets chembl ids.
 
-    bioactivities_dict = {
-        "ChemblID": mol_chembl_id,
-        "IC50": IC50,
-        "Units": units 
-    }
+        use_cache: bool
+            If true the bioactivities are stored in the default BioactivityCache. (Default: True)
 
-    bioactivities_df = pd.DataFrame().from_dict(bioactivities_dict)
+        max_age: float
+            Time in seconds after which a cached target is refreshed. (Default: one week)
 
-    # Clean bioactivities_df
-    bioactivities_df = bioactivities_df.dropna(axis=0, how="any")
-    bioactivities_df = bioactivities_df[bioactivities_df["Units"] == "nM"]
-    # Remove duplicate elements. Keep the mean of the IC50
-    bioactivities_df = bioactivities_df.groupby("ChemblID").mean().reset_index()
-
-    # Get compounds smiles
-    compounds = compounds_api.filter(
-            molecule_chembl_id__in=list(bioactivities_df["ChemblID"])
-        ).only("molecule_chembl_id", 
-            "molecule_structures")
-
-    comp_id = []
-    smiles = []
-    print("Downloading compounds smiles...")
-    for comp in tqdm(compounds):
-        if comp["molecule_structures"] is not None:
-            comp_id.append(comp["molecule_chembl_id"])
-            smiles.append(comp["molecule_structures"]["canonical_smiles"])
-
-    compounds_dict = {
-        "ChemblID": comp_id,
-        "Smiles": smiles
-    }
+        n_workers: int
+            Maximum number of concurrent requests. (Default: 4)
 
-    compounds_df = pd.DataFrame.from_dict(compounds_dict)
-    bioactivities_df = pd.merge(
-                bioactivities_df,
-                compounds_df,
-                on="ChemblID",
-            )
-    bioactivities_df["pIC50"] = bioactivities_df.apply(
-        lambda x: 9 - np.log10(x.IC50), 
-        axis=1)
-    bioactivities_df = bioactivities_df.drop("IC50", axis=1)
+        dump: str or ChEMBLDump (optional)
+            A local ChEMBL SQLite dump.
+        
+        Returns
+        -------
+        dict of pandas.DataFrame
+            The bioactivities dataframe of each target, as returned by get_bioactivity_dataframe.
+    """
+    dump = _get_dump(dump)
+    if dump is not None:
+        return dump.get_bioactivity_dataframes(target_chembl_ids)
 
-    return bioactivities_df
+    cache = BioactivityCache() if use_cache else None
+    client = _get_client(n_workers)
+    target_chembl_ids = list(dict.fromkeys(target_chembl_ids))
+    with ThreadPoolExecutor(max_workers=max(1, n_workers)) as executor:
+        activities = executor.map(
+            lambda target: _fetch_target_activities(target, cache, max_age, client), target_chembl_ids)
+        return {target: _clean_bioactivities(df) for target, df in zip(target_chembl_ids, activities)}
 
-def get_assay_bioactivity_data(target_chembl_id, pIC50_threshold=6.3):
+def get_assay_bioactivity_data(target_chembl_id, pIC50_threshold=6.3, **kwargs):
     """ Get bioactivity data and the compounds in an assay. 
         
             Parameters
@@ -155,7 +413,7 @@ def get_assay_bioactivity_data(target_chembl_id, pIC50_threshold=6.3):
                     An array where each element corresponds to the index of the compounds list.
                     An entry is either one if the compound is active or zero if the compund is inactive.
     """
-    bioactivities_df = get_bioactivity_dataframe(target_chembl_id=target_chembl_id)
+    bioactivities_df = get_bioactivity_dataframe(target_chembl_id=target_chembl_id, **kwargs)
     bioactivities_df["activity"] = bioactivities_df["pIC50"].apply(
         lambda x: 1 if x >=  pIC50_threshold else 0)
     
@@ -164,7 +422,7 @@ def get_assay_bioactivity_data(target_chembl_id, pIC50_threshold=6.3):
 
     return molecules, bioactivity
 
-def get_actives_and_inactives(target_chembl_id, pIC50_threshold=6.3):
+def get_actives_and_inactives(target_chembl_id, pIC50_threshold=6.3, **kwargs):
     """Get a list of active and inactive compounds for a given target.
 
         Parameters
@@ -174,6 +432,9 @@ def get_actives_and_inactives(target_chembl_id, pIC50_threshold=6.3):
 
         pIC50_threshold: float
             The cuttoff value from which a molecule is considered active.
+
+        kwargs:
+            Arguments passed to get_bioactivity_dataframe.
         
         Returns
         -------
@@ -185,7 +446,7 @@ def get_actives_and_inactives(target_chembl_id, pIC50_threshold=6.3):
             First element of the tuple is a list of Chembl ids. Second element
             is a list of smiles for the inactive compounds
     """
-    bioactivities_df = get_bioactivity_dataframe(target_chembl_id=target_chembl_id)
+    bioactivities_df = get_bioactivity_dataframe(target_chembl_id=target_chembl_id, **kwargs)
 
     actives_df = bioactivities_df[bioactivities_df["pIC50"] >= pIC50_threshold]
     inactives_df = bioactivities_df[bioactivities_df["pIC50"] < pIC50_threshold]
@@ -194,3 +455,134 @@ def get_actives_and_inactives(target_chembl_id, pIC50_threshold=6.3):
     inactives = (inactives_df["ChemblID"].tolist(), inactives_df["Smiles"].tolist())
 
     return actives, inactives
+
+def _clean_bioactivities(activities):
+    """ Keep the IC50 values in nM, average the values of repeated molecules and 
+        convert them to pIC50.
+
+        Parameters
+        ----------
+        activities: pandas.DataFrame
+            A dataframe with the columns ChemblID, IC50, Units and Smiles.
+
+        Returns
+        -------
+        pandas.DataFrame
+            A dataframe with the columns ChemblID, Smiles and pIC50.
+    """
+    activities = activities.dropna(subset=["ChemblID", "IC50", "Units"])
+    activities = activities[activities["Units"] == "nM"]
+    # Remove duplicate elements. Keep the mean of the IC50
+    bioactivities_df = activities.groupby("ChemblID").agg(
+        IC50=("IC50", "mean"), Smiles=("Smiles", "first")).reset_index()
+    # Molecules without structure are removed
+    bioactivities_df = bioactivities_df.dropna(subset=["Smiles"])
+    bioactivities_df["pIC50"] = 9 - np.log10(bioactivities_df["IC50"].to_numpy(dtype=float))
+    return bioactivities_df[["ChemblID", "Smiles", "pIC50"]].reset_index(drop=True)
+
+def _fetch_activities(client, target_chembl_id, last_activity_id=None):
+    """ Download the IC50 activities of a target. The first page gives the number of 
+        records and the remaining pages are downloaded concurrently.
+
+        Returns
+        -------
+        list of dict
+            The activity records.
+    """
+    params = {
+        "target_chembl_id": target_chembl_id,
+        "type": "IC50",
+        "relation": "=",
+        "assay_type": "B",
+        "only": "activity_id,molecule_chembl_id,standard_units,standard_value",
+        "order_by": "activity_id",
+        "limit": _PAGE_SIZE,
+    }
+    if last_activity_id is not None:
+        params["activity_id__gt"] = last_activity_id
+    url = CHEMBL_API_URL + "/activity.json?" + urlencode(params)
+
+    first_page = json.loads(client.get(url + "&offset=0"))
+    total_count = first_page["page_meta"]["total_count"]
+    urls = [url + "&offset={}".format(offset) for offset in range(_PAGE_SIZE, total_count, _PAGE_SIZE)]
+    pages = [first_page] + [json.loads(data) for data in client.get_many(urls)]
+    return [activity for page in pages for activity in page["activities"]]
+
+def _fetch_smiles(client, molecule_chembl_ids):
+    """ Download the smiles of a list of molecules.
+
+        Returns
+        -------
+        dict
+            The smiles of each molecule chembl id. None for molecules without structure.
+    """
+    urls = []
+    for i in range(0, len(molecule_chembl_ids), _MOLECULES_PER_REQUEST):
+        params = {
+            "molecule_chembl_id__in": ",".join(molecule_chembl_ids[i:i + _MOLECULES_PER_REQUEST]),
+            "only": "molecule_chembl_id,molecule_structures",
+            "limit": _PAGE_SIZE,
+        }
+        urls.append(CHEMBL_API_URL + "/molecule.json?" + urlencode(params))
+
+    smiles = {chembl_id: None for chembl_id in molecule_chembl_ids}
+    for data in client.get_many(urls):
+        for molecule in json.loads(data)["molecules"]:
+            if molecule["molecule_structures"] is not None:
+                smiles[molecule["molecule_chembl_id"]] = molecule["molecule_structures"]["canonical_smiles"]
+    return smiles
+
+def _fetch_target_activities(target_chembl_id, cache, max_age, client):
+    """ Get the activities of a target from the cache, downloading the ones that 
+        aren't there yet.
+
+        Returns
+        -------
+        pandas.DataFrame
+            A dataframe with the columns ChemblID, IC50, Units and Smiles.
+    """
+    if cache is None:
+        activities = _fetch_activities(client, target_chembl_id)
+        molecule_ids = [activity["molecule_chembl_id"] for activity in activities]
+        smiles = _fetch_smiles(client, list(dict.fromkeys(molecule_ids)))
+        return pd.DataFrame({
+            "ChemblID": molecule_ids,
+            "IC50": [_to_float(activity["standard_value"]) for activity in activities],
+            "Units": [activity["standard_units"] for activity in activities],
+            "Smiles": [smiles[molecule_id] for molecule_id in molecule_ids],
+        })
+
+    updated_at = cache.updated_at(target_chembl_id)
+    if updated_at is None or time.time() - updated_at > max_age:
+        activities = _fetch_activities(client, target_chembl_id, cache.last_activity_id(target_chembl_id))
+        missing = cache.missing_molecules([activity["molecule_chembl_id"] for activity in activities])
+        cache.add_molecules(_fetch_smiles(client, missing))
+        # Activities are added last, so an interrupted download is resumed
+        cache.add_activities(target_chembl_id, activities)
+    return cache.activities(target_chembl_id)
+
+def _get_dump(dump):
+    """ Get the ChEMBL dump that will be queried, if any.
+    """
+    if dump is None:
+        dump = os.environ.get("OPENPHARMACOPHORE_CHEMBL_DUMP")
+    if dump is None or isinstance(dump, ChEMBLDump):
+        return dump
+    return ChEMBLDump(dump)
+
+def _get_client(n_workers=4):
+    """ Get the client used to send requests to ChEMBL. It is created once, so 
+        connections are reused. Its pool holds a connection for each worker.
+    """
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = RestClient(rate_limits=[TokenBucket(rate=10, capacity=10)], max_workers=n_workers)
+        else:
+            _client.set_max_workers(n_workers)
+        return _client
+
+def _to_float(value):
+    """ Convert a value of the ChEMBL API to float. None if it's missing.
+    """
+    return None if value is None else float(value)
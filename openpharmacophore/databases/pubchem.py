@@ -1,20 +1,48 @@
-from openpharmacophore._private_tools.exceptions import FetchError
+from openpharmacophore.databases.rest_client import RestClient, TokenBucket
+from openpharmacophore.utils.cache import cache_root_dir
+from openpharmacophore.utils.response_cache import ResponseCache
 import pandas as pd
-from tqdm.auto import tqdm
-from io import StringIO
+from io import BytesIO, StringIO
 import json
-import requests
+import os
 import time
 
 class PubChem():
     """ Class to interact with PubChem database, download bioassays
         and perform similarity searches.
+
+        Requests share a pool of connections and are rate limited to the limits of 
+        PUG-REST (5 requests per second and 400 per minute). Requests that fail because 
+        the service is busy are retried with exponential backoff. 
+
+    Parameters
+    ----------
+    use_cache: bool
+        If true responses are cached on disk in the pubchem subdirectory of the openpharmacophore
+        cache directory. (Default: True)
+
+    cache_ttl: float (optional)
+        Time in seconds after which cached responses are downloaded again. If None they
+        never expire. (Default: one week)
+
+    n_workers: int
+        Maximum number of concurrent requests. (Default: 4)
+
+    base_url: str
+        Url of the PUG-REST service. (Default: "https://pubchem.ncbi.nlm.nih.gov/rest/pug")
+
     """
 
-    def __init__(self):
-        self.base_url = "https://pubchem.ncbi.nlm.nih.gov/rest/pug"
+    def __init__(self, use_cache=True, cache_ttl=7 * 24 * 3600, n_workers=4, 
+                 base_url="https://pubchem.ncbi.nlm.nih.gov/rest/pug"):
+        self.base_url = base_url
+        cache = None
+        if use_cache:
+            cache = ResponseCache(cache_dir=os.path.join(cache_root_dir(), "pubchem"), ttl=cache_ttl)
+        rate_limits = [TokenBucket(rate=5, capacity=5), TokenBucket(rate=400 / 60, capacity=400)]
+        self._client = RestClient(rate_limits, cache, max_workers=n_workers)
 
-    def _get_data(self, url, attempts=5):
+    def _get_data(self, url, attempts=5, use_cache=True):
         """ Downloads data from a given url
              Parameters
             ----------
@@ -24,26 +52,35 @@ class PubChem():
             attempts: int
                 number of times to try to download the data in case of failure
 
+            use_cache: bool
+                If true the data is taken from the cache if it was downloaded before.
+
             Returns
             ----------
-            A request.resonse.content object. The content of the response
+            bytes
+                The content of the response
         """
-        if attempts <= 0:
-            raise ValueError("Number of attempts must be greater than 0")
-
-        while (attempts > 0):
-            res = requests.get(url)
-            if res.status_code == requests.codes.ok:
-                break
-            else:
-                attempts -= 1
-                time.sleep(2)
-        
-        if res.status_code != requests.codes.ok:
-            raise FetchError("Failed to get data from {}".format(url))
-        
-        return res.content
-        
+        return self._client.get(url, attempts, use_cache)
+
+    @staticmethod
+    def _cid_chunks(compounds_ids, chunk_size):
+        """ Split a list of compound ids into request bodies of at most chunk_size ids.
+        """
+        if chunk_size < 1:
+            raise ValueError("chunk_size must be greater than 0")
+        # Duplicated ids are sent only once
+        compounds_ids = list(dict.fromkeys(int(compound_id) for compound_id in compounds_ids))
+        return [
+            {"cid": ",".join(str(compound_id) for compound_id in compounds_ids[i:i + chunk_size])}
+            for i in range(0, len(compounds_ids), chunk_size)
+        ]
+
+    @staticmethod
+    def _drop_missing(compounds_ids, smiles):
+        """ Drop the compounds without smiles, keeping ids and smiles aligned.
+        """
+        found = [(compound_id, s) for compound_id, s in zip(compounds_ids, smiles) if s is not None]
+        return [compound_id for compound_id, _ in found], [s for _, s in found]
 
     def get_assay_compounds_id(self, assay_id, attempts=10):
         """ Get compounds id for tested compounds in an assay
@@ -129,7 +166,7 @@ class PubChem():
             csv_string = StringIO(data.decode("utf-8"))
             return pd.read_csv(csv_string)
         elif format == "JSON":
-            return json.loads(data.content)
+            return json.loads(data)
         
     def get_assay_target_info(self, assay_id, attempts=10):
         """ Get target information of an assay.
@@ -179,11 +216,8 @@ class PubChem():
         molecules_ids = df["PUBCHEM_CID"].tolist()
         bioactivity = df["activity"].to_numpy() 
 
-        molecules = []
         print("Fetching molecules smiles...")
-        for mol_id in tqdm(molecules_ids):
-            smiles = self.get_compound_smiles(mol_id)
-            molecules.append((mol_id, smiles))
+        molecules = list(zip(molecules_ids, self.get_compounds_smiles(molecules_ids)))
 
         return molecules, bioactivity
 
@@ -203,6 +237,9 @@ class PubChem():
                 inactives: 2-tuple
                     The first element is a list of the inactive compounds PubChem ids, and
                     the second elment is a list of smiles for the inactive compounds.
+
+                Compounds whose smiles PubChem doesn't return, such as deprecated ones,
+                are left out.
         """
         assay_results = self.get_assay_results(assay_id=assay_id, form="dataframe")
         # Keep only cid and activity columns
@@ -221,20 +258,13 @@ class PubChem():
         actives_list = actives["PUBCHEM_CID"].tolist()
         inactives_list = inactives["PUBCHEM_CID"].tolist()
         
-        actives_smiles = []
-        inactives_smiles = []
-
         print("Fetching active compound smiles...")
-        for compound in tqdm(actives_list):
-            smiles = self.get_compound_smiles(compound)
-            actives_smiles.append(smiles)
+        actives_smiles = self.get_compounds_smiles(actives_list)
         
         print("Fetching inactive compound smiles...")
-        for compound in tqdm(inactives_list):
-            smiles = self.get_compound_smiles(compound)
-            inactives_smiles.append(smiles)
+        inactives_smiles = self.get_compounds_smiles(inactives_list)
                 
-        return (actives_list, actives_smiles), (inactives_list, inactives_smiles)
+        return self._drop_missing(actives_list, actives_smiles), self._drop_missing(inactives_list, inactives_smiles)
 
     def get_compound_assay_summary(self, compound_id, form="dataframe", attempts=10):
         """ Get summary of biological test results for a given compound.
@@ -268,7 +298,7 @@ class PubChem():
             csv_string = StringIO(data.decode("utf-8"))
             return pd.read_csv(csv_string)
         elif format == "JSON":
-            return json.loads(data.content)
+            return json.loads(data)
     
     def get_compound_id(self, name, attempts=10):
         """ Get pubchem compound id for a given compound name.
@@ -316,6 +346,92 @@ class PubChem():
         data = self._get_data(compound_url, attempts)
         return json.loads(data)
 
+    def get_compounds_description(self, compounds_ids, chunk_size=500, attempts=10):
+        """ Get the descriptions of a list of compounds. The ids are sent in chunks, so 
+            only a few requests are needed. 
+
+            Parameters
+            ----------
+                compounds_ids: list of int
+                    The PubChem ids of the compounds.
+
+                chunk_size: int
+                    Number of compounds per request. (Default: 500)
+                
+                attempts: int
+                    number of times to try to download the data in case of failure. 
+
+            Returns
+            ----------
+                A pandas.DataFrame with a row for each description. Compounds may have
+                several descriptions from different sources.
+        """
+        url = self.base_url + "/compound/cid/description/JSON"
+        data = self._client.post_many(url, self._cid_chunks(compounds_ids, chunk_size), attempts)
+        information = []
+        for chunk_data in data:
+            information.extend(json.loads(chunk_data)["InformationList"]["Information"])
+        return pd.DataFrame(information)
+
+    def get_compounds_properties(self, compounds_ids, properties=("CanonicalSMILES",), chunk_size=500, attempts=10):
+        """ Get properties of a list of compounds. The ids are sent in chunks, so only 
+            a few requests are needed. 
+
+            Parameters
+            ----------
+                compounds_ids: list of int
+                    The PubChem ids of the compounds.
+
+                properties: tuple of str
+                    Names of the PUG-REST properties, such as CanonicalSMILES, MolecularWeight
+                    or XLogP. (Default: ("CanonicalSMILES",))
+
+                chunk_size: int
+                    Number of compounds per request. (Default: 500)
+                
+                attempts: int
+                    number of times to try to download the data in case of failure. 
+
+            Returns
+            ----------
+                A pandas.DataFrame with a CID column and a column for each property. Rows are in 
+                the same order as the ids, properties of compounds that aren't found are NaN.
+        """
+        if len(compounds_ids) == 0:
+            return pd.DataFrame(columns=["CID"] + list(properties))
+
+        url = self.base_url + "/compound/cid/property/{}/CSV".format(",".join(properties))
+        data = self._client.post_many(url, self._cid_chunks(compounds_ids, chunk_size), attempts)
+        columns = ["CID"] + list(properties)
+        # Responses are parsed directly from bytes, and the columns are named as requested
+        # in case PubChem returns a property under another name
+        frames = [pd.read_csv(BytesIO(chunk_data), header=0, names=columns) for chunk_data in data]
+        df = pd.concat(frames, ignore_index=True).drop_duplicates("CID").set_index("CID")
+        df = df.reindex([int(compound_id) for compound_id in compounds_ids])
+        return df.reset_index()
+
+    def get_compounds_smiles(self, compounds_ids, chunk_size=500, attempts=10):
+        """ Get the smiles of a list of compounds. The ids are sent in chunks, so only 
+            a few requests are needed. 
+
+            Parameters
+            ----------
+                compounds_ids: list of int
+                    The PubChem ids of the compounds.
+
+                chunk_size: int
+                    Number of compounds per request. (Default: 500)
+                
+                attempts: int
+                    number of times to try to download the data in case of failure. 
+
+            Returns
+            ----------
+                A list with the smiles of the compounds. None for compounds that aren't found.
+        """
+        df = self.get_compounds_properties(compounds_ids, ("CanonicalSMILES",), chunk_size, attempts)
+        return [smiles if isinstance(smiles, str) else None for smiles in df["CanonicalSMILES"]]
+
     def get_compound_smiles(self, compound_id, attempts=10):
         """ Get smiles for a given compound 
 
@@ -408,7 +524,8 @@ class PubChem():
         elif max_records:
             url += "?MaxRecords={}".format(max_records)
 
-        data = self._get_data(url, attempts)
+        # Search results are stored temporarily by PubChem, so they are never cached
+        data = self._get_data(url, attempts, use_cache=False)
         # Data returns a listkey that can be used to retrieve the results from another url
         content = json.loads(data)
         listkey = content["Waiting"]["ListKey"]
@@ -416,7 +533,7 @@ class PubChem():
         results_url = self.base_url + "/compound/listkey/{}/cids/JSON".format(listkey)
         # Wait a little as similarity searches take more time to complete
         time.sleep(5)
-        data = self._get_data(results_url, attempts)
+        data = self._get_data(results_url, attempts, use_cache=False)
         data_dict = json.loads(data)
 
         return data_dict["IdentifierList"]["CID"]
@@ -0,0 +1,304 @@
+from openpharmacophore._private_tools.exceptions import FetchError
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from requests.adapters import HTTPAdapter
+import threading
+import time
+
+# Status codes of responses that may succeed if the request is repeated
+_RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+
+class TokenBucket():
+    """ Token bucket rate limiter. Tokens are added at a constant rate up to the
+        capacity of the bucket and every request consumes one token.
+
+        The bucket can be shared between threads.
+
+    Parameters
+    ----------
+    rate: float
+        Number of tokens added per second.
+
+    capacity: int
+        Maximum number of tokens, that is, the largest burst of requests.
+
+    clock: callable
+        Function that returns the current time in seconds. (Default: time.monotonic)
+
+    sleep: callable
+        Function used to wait for new tokens. (Default: time.sleep)
+
+    """
+    def __init__(self, rate, capacity, clock=time.monotonic, sleep=time.sleep):
+        if rate <= 0 or capacity < 1:
+            raise ValueError("rate and capacity must be greater than 0")
+        self.rate = rate
+        self.capacity = capacity
+        self._clock = clock
+        self._sleep = sleep
+        self._tokens = float(capacity)
+        self._last_update = clock()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """ Take a token from the bucket, waiting until one is available.
+
+            Returns
+            -------
+            float
+                The time waited in seconds.
+        """
+        with self._lock:
+            now = self._clock()
+            self._tokens = min(self.capacity, self._tokens + (now - self._last_update) * self.rate)
+            self._last_update = now
+            # The token is reserved even if it isn't available yet, so threads waiting
+            # at the same time are spaced out
+            self._tokens -= 1
+            wait = 0.0 if self._tokens >= 0 else -self._tokens / self.rate
+        if wait > 0:
+            self._sleep(wait)
+        return wait
+
+
+class RestClient():
+    """ Client for REST web services.
+
+        Requests share a pool of connections, are rate limited, retried with exponential
+        backoff when the service is busy and their responses can be cached on disk.
+
+    Parameters
+    ----------
+    rate_limits: list of TokenBucket (optional)
+        Rate limiters. A request waits until it gets a token from all of them.
+
+    cache: openpharmacophore.utils.response_cache.ResponseCache (optional)
+        Cache of the responses. If None responses are not cached.
+
+    max_workers: int
+        Maximum number of concurrent requests. (Default: 4)
+
+    backoff_factor: float
+        Time in seconds waited before the first retry. It is doubled after each
+        failed attempt. (Default: 0.5)
+
+    max_backoff: float
+        Maximum time in seconds waited between attempts. (Default: 60)
+
+    timeout: float
+        Timeout of the requests in seconds. (Default: 60)
+
+    """
+    def __init__(self, rate_limits=None, cache=None, max_workers=4, backoff_factor=0.5,
+                 max_backoff=60, timeout=60):
+        self.rate_limits = [] if rate_limits is None else rate_limits
+        self.cache = cache
+        self.max_workers = max_workers
+        self.backoff_factor = backoff_factor
+        self.max_backoff = max_backoff
+        self.timeout = timeout
+        self.n_requests = 0
+
+        self.session = requests.Session()
+        self._pool_size = 0
+        self._mount_adapter(max_workers)
+        self._sleep = time.sleep
+        self._lock = threading.Lock()
+
+    def set_max_workers(self, max_workers):
+        """ Change the maximum number of concurrent requests. The pool of connections is
+            enlarged if it can't hold a connection for each worker.
+
+            Parameters
+            ----------
+            max_workers: int
+                Maximum number of concurrent requests.
+        """
+        self.max_workers = max_workers
+        if max_workers > self._pool_size:
+            self._mount_adapter(max_workers)
+
+    def get(self, url, attempts=5, use_cache=True):
+        """ Send a GET request.
+
+            Parameters
+            ----------
+            url: str
+                The url.
+
+            attempts: int
+                Number of times to try to download the data in case of failure. (Default: 5)
+
+            use_cache: bool
+                If true the response is taken from the cache if it is there. (Default: True)
+
+            Returns
+            -------
+            bytes
+                The content of the response.
+        """
+        return self.request("GET", url, attempts=attempts, use_cache=use_cache)
+
+    def get_many(self, urls, attempts=5, use_cache=True):
+        """ Send GET requests concurrently.
+
+            Parameters
+            ----------
+            urls: list of str
+                The urls.
+
+            attempts: int
+                Number of times to try to download each url in case of failure. (Default: 5)
+
+            use_cache: bool
+                If true the responses are taken from the cache if they are there. (Default: True)
+
+            Returns
+            -------
+            list of bytes
+                The content of the responses in the same order as the urls.
+        """
+        return self._map(lambda url: self.get(url, attempts, use_cache), urls)
+
+    def post(self, url, data, attempts=5, use_cache=True):
+        """ Send a POST request.
+
+            Parameters
+            ----------
+            url: str
+                The url.
+
+            data: dict or str
+                The body of the request.
+
+            attempts: int
+                Number of times to try to download the data in case of failure. (Default: 5)
+
+            use_cache: bool
+                If true the response is taken from the cache if it is there. (Default: True)
+
+            Returns
+            -------
+            bytes
+                The content of the response.
+        """
+        return self.request("POST", url, data=data, attempts=attempts, use_cache=use_cache)
+
+    def post_many(self, url, data_list, attempts=5, use_cache=True):
+        """ Send POST requests to the same url concurrently.
+
+            Parameters
+            ----------
+            url: str
+                The url.
+
+            data_list: list of dict or str
+                The body of each request.
+
+            attempts: int
+                Number of times to try to download each request in case of failure. (Default: 5)
+
+            use_cache: bool
+                If true the responses are taken from the cache if they are there. (Default: True)
+
+            Returns
+            -------
+            list of bytes
+                The content of the responses in the same order as the bodies.
+        """
+        return self._map(lambda data: self.post(url, data, attempts, use_cache), data_list)
+
+    def request(self, method, url, data=None, attempts=5, use_cache=True):
+        """ Send a request. Requests that fail because the service is busy or can't
+            be reached are retried.
+
+            Parameters
+            ----------
+            method: str
+                The HTTP method.
+
+            url: str
+                The url.
+
+            data: dict or str (optional)
+                The body of the request.
+
+            attempts: int
+                Number of times to try to download the data in case of failure. (Default: 5)
+
+            use_cache: bool
+                If true the response is taken from the cache if it is there. (Default: True)
+
+            Returns
+            -------
+            bytes
+                The content of the response.
+        """
+        if attempts <= 0:
+            raise ValueError("Number of attempts must be greater than 0")
+
+        key = None
+        if use_cache and self.cache is not None:
+            key = self.cache.key(method, url, data)
+            content = self.cache.get(key)
+            if content is not None:
+                return content
+
+        for attempt in range(attempts):
+            response = None
+            try:
+                response = self._send(method, url, data)
+            except (requests.ConnectionError, requests.Timeout):
+                pass
+            else:
+                if response.status_code == requests.codes.ok:
+                    if key is not None:
+                        self.cache.put(key, response.content)
+                    return response.content
+                if response.status_code not in _RETRY_STATUS_CODES:
+                    break
+            if attempt < attempts - 1:
+                self._sleep(self._backoff(attempt, response))
+
+        raise FetchError("Failed to get data from {}".format(url))
+
+    def _backoff(self, attempt, response=None):
+        """ Get the time to wait before retrying a request. The Retry-After header of the
+            response is respected if it's present.
+        """
+        wait = self.backoff_factor * 2 ** attempt
+        if response is not None:
+            try:
+                wait = max(wait, float(response.headers.get("Retry-After", 0)))
+            except ValueError:
+                pass
+        return min(wait, self.max_backoff)
+
+    def _map(self, function, items):
+        """ Apply a function that sends a request to each item, concurrently if more
+            than one worker is used.
+        """
+        if self.max_workers <= 1 or len(items) <= 1:
+            return [function(item) for item in items]
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            return list(executor.map(function, items))
+
+    def _mount_adapter(self, pool_size):
+        """ Mount an adapter with a pool of connections of the given size. Requests wait
+            for a free connection when the pool is full instead of opening connections that
+            are thrown away.
+        """
+        pool_size = max(1, pool_size)
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, pool_block=True)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self._pool_size = pool_size
+
+    def _send(self, method, url, data):
+        """ Send a request once the rate limiters allow it.
+        """
+        for bucket in self.rate_limits:
+            bucket.acquire()
+        with self._lock:
+            self.n_requests += 1
+        return self.session.request(method, url, data=data, timeout=self.timeout)
@@ -1,9 +1,218 @@
-from openpharmacophore._private_tools.exceptions import MissingParameters
+from openpharmacophore._private_tools.exceptions import FetchError, MissingParameters
+from openpharmacophore.databases.rest_client import RestClient
+import pandas as pd
 from tqdm.auto import tqdm
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+import functools
+import gzip
+import hashlib
+import json
 import os
 import pkg_resources
 import requests
 import string
+import tempfile
+
+ZINC_FILES_URL = "http://files.docking.org/"
+
+class ZINCMirror():
+    """ Local mirror of ZINC tranches. 
+
+        Files are downloaded once into a directory that keeps the layout of the ZINC
+        server. An index stores the tranche, size, sha256 checksum and number of molecules
+        of each file, so later screens read the mirror without network access.
+
+    Parameters
+    ----------
+    directory: str
+        Directory of the mirror. It is created if it doesn't exist.
+
+    Attributes
+    ----------
+    index: dict
+        Information of each file in the mirror, keyed by its path relative to the directory.
+
+    """
+    index_file_name = "index.json"
+
+    def __init__(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.index = {}
+        index_file = os.path.join(directory, self.index_file_name)
+        if os.path.isfile(index_file):
+            with open(index_file, "r") as f:
+                self.index = json.load(f)
+
+    def files(self, subset="Lead-Like", mw_range=None, logp_range=None, file_format="smi"):
+        """ Get the files of the mirror that belong to a selection of ZINC, grouped 
+            by tranche.
+
+            Parameters
+            ----------
+            subset: str
+                Name of the ZINC subset. See get_zinc_urls.
+
+            mw_range: 2-tuple of float
+                Range of molecular weight of the molecules.
+
+            logp_range: 2-tuple of float
+                Range of logP of the molecules.
+
+            file_format: str
+                Format of the files. Can be smi or sdf.
+
+            Returns
+            -------
+            dict
+                The absolute path of the files of each tranche. Files that haven't been 
+                synchronized or have no molecules are not included.
+        """
+        tranches = defaultdict(list)
+        for url in get_zinc_urls(subset, mw_range=mw_range, logp_range=logp_range, file_format=file_format):
+            path = self._relative_path(url)
+            # Empty files are skipped
+            if path in self.index and self.index[path]["n_molecules"] > 0:
+                tranches[self.index[path]["tranche"]].append(os.path.join(self.directory, path))
+        return dict(tranches)
+
+    def summary(self):
+        """ Get a summary of the mirror.
+
+            Returns
+            -------
+            pandas.DataFrame
+                The number of files, molecules and bytes of each tranche.
+        """
+        df = pd.DataFrame([
+            {"Tranche": info["tranche"], "Files": 1, "Molecules": info["n_molecules"], "Size": info["size"]}
+            for info in self.index.values()
+        ], columns=["Tranche", "Files", "Molecules", "Size"])
+        return df.groupby("Tranche").sum().reset_index()
+
+    def sync(self, subset="Lead-Like", mw_range=None, logp_range=None, file_format="smi", 
+             n_workers=4, verify=False):
+        """ Download the files of a selection of ZINC that aren't in the mirror yet.
+
+            Parameters
+            ----------
+            subset: str
+                Name of the ZINC subset. See get_zinc_urls.
+
+            mw_range: 2-tuple of float
+                Range of molecular weight of the molecules.
+
+            logp_range: 2-tuple of float
+                Range of logP of the molecules.
+
+            file_format: str
+                Format of the files. Can be smi or sdf.
+
+            n_workers: int
+                Number of concurrent downloads. (Default: 4)
+
+            verify: bool
+                If true the checksum of the files already in the mirror is verified and 
+                corrupted files are downloaded again. Otherwise only their size is checked. 
+                (Default: False)
+
+            Returns
+            -------
+            failed: list of str
+                Urls of the files that couldn't be downloaded.
+        """
+        urls = get_zinc_urls(subset, mw_range=mw_range, logp_range=logp_range, file_format=file_format)
+        missing = [url for url in urls if not self._is_valid(self._relative_path(url), verify)]
+        if len(missing) == 0:
+            return []
+
+        client = RestClient(max_workers=n_workers)
+        print("Downloading from ZINC...")
+        with ThreadPoolExecutor(max_workers=max(1, n_workers)) as executor:
+            results = list(tqdm(executor.map(lambda url: self._download(client, url), missing), total=len(missing)))
+
+        failed = []
+        for url, info in zip(missing, results):
+            if info is None:
+                failed.append(url)
+            else:
+                self.index[self._relative_path(url)] = info
+        self._save_index()
+        return failed
+
+    def verify(self):
+        """ Verify the checksums of all the files of the mirror.
+
+            Returns
+            -------
+            list of str
+                Relative paths of the files that are missing or corrupted.
+        """
+        return [path for path in self.index if not self._is_valid(path, checksum=True)]
+
+    def _download(self, client, url):
+        """ Download a file to the mirror.
+
+            Returns
+            -------
+            dict or None
+                Information of the file. None if it couldn't be downloaded.
+        """
+        try:
+            content = client.get(url, attempts=3)
+        except FetchError:
+            print("Could not fetch file from {}".format(url))
+            return None
+
+        path = self._relative_path(url)
+        file_name = os.path.join(self.directory, path)
+        os.makedirs(os.path.dirname(file_name), exist_ok=True)
+        # Write to a temporary file first so an interrupted download never leaves a partial file
+        fd, temp_name = tempfile.mkstemp(dir=os.path.dirname(file_name), suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(content)
+        os.replace(temp_name, file_name)
+
+        return {
+            "url": url,
+            "tranche": _url_tranche(url),
+            "size": len(content),
+            "sha256": hashlib.sha256(content).hexdigest(),
+            "n_molecules": _count_molecules(file_name, content),
+        }
+
+    def _is_valid(self, path, checksum=False):
+        """ Check that a file of the index is in the mirror and is not corrupted.
+        """
+        if path not in self.index:
+            return False
+        file_name = os.path.join(self.directory, path)
+        if not os.path.isfile(file_name) or os.path.getsize(file_name) != self.index[path]["size"]:
+            return False
+        if checksum:
+            with open(file_name, "rb") as f:
+                return hashlib.sha256(f.read()).hexdigest() == self.index[path]["sha256"]
+        return True
+
+    @staticmethod
+    def _relative_path(url):
+        """ Get the path of the file of a url relative to the mirror directory.
+        """
+        return url[len(ZINC_FILES_URL):] if url.startswith(ZINC_FILES_URL) else url.split("://")[-1]
+
+    def _save_index(self):
+        """ Write the index of the mirror.
+        """
+        fd, temp_name = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            json.dump(self.index, f, indent=1)
+        os.replace(temp_name, os.path.join(self.directory, self.index_file_name))
+
+    def __repr__(self):
+        n_molecules = sum(info["n_molecules"] for info in self.index.values())
+        return f"{self.__class__.__name__}(n_files: {len(self.index)}; n_molecules: {n_molecules})"
+
 
 def get_zinc_urls(subset="Lead-Like", 
                   mw_range=None, logp_range=None,
@@ -94,7 +303,7 @@ def get_zinc_urls(subset="Lead-Like",
     url_list = []
     
     if file_format == "smi":
-        base_url = "http://files.docking.org/2D/"
+        base_url = ZINC_FILES_URL + "2D/"
         # Get urls for smi files
         for col in col_list:
             for row in row_list:
@@ -161,18 +370,50 @@ def get_ZINC3D_url_list(tranches):
        molecular weight and logp range for ZINC 3D. URLS are read 
        from a file. 
     """
+    urls, index = _zinc3d_index()
+    # Urls are returned in the same order as in the file
+    positions = sorted(i for tranch in set(tranches) for i in index.get(tranch, []))
+    return [urls[i] for i in positions]
+
+@functools.lru_cache(maxsize=None)
+def _zinc3d_index():
+    """ Read the file of ZINC 3D urls once and index the urls by tranche.
+
+        Returns
+        -------
+        urls: tuple of str
+            All the urls.
+
+        index: dict
+            Positions of the urls of each tranche.
+    """
     zinc_urls_file = pkg_resources.resource_filename('openpharmacophore',
                     "./data/zinc3d.uri")
-
-    url_list = []
     with open(zinc_urls_file, "r") as f:
-        for url in f.readlines():
-            # Extract the column-row from the url
-            tranch = url.split("/")[4]
-            if tranch in tranches:
-                url_list.append(url.rstrip())
+        urls = tuple(url.rstrip() for url in f if url.strip())
 
-    return url_list
+    index = defaultdict(list)
+    for i, url in enumerate(urls):
+        index[_url_tranche(url)].append(i)
+    return urls, dict(index)
+
+def _url_tranche(url):
+    """ Get the tranche, that is the column and row, of a ZINC url.
+    """
+    if url.startswith(ZINC_FILES_URL):
+        url = url[len(ZINC_FILES_URL):]
+    # Urls are of the form 2D/BA/BAAA.smi or 3D/AA/AAML/AAAAML.xaa.sdf.gz
+    return url.split("/")[1]
+
+def _count_molecules(file_name, content):
+    """ Count the molecules of a ZINC file.
+    """
+    if file_name.endswith(".gz"):
+        content = gzip.decompress(content)
+    if ".sdf" in file_name:
+        return content.count(b"$$$$")
+    # Smiles files have a header line
+    return max(len(content.splitlines()) - 1, 0)
 
 
 def download_ZINC(download_path, subset, mw_range=None, logp_range=None, file_format="smi"):
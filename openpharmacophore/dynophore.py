@@ -1,22 +1,26 @@
-from openpharmacophore._private_tools.exceptions import InvalidFileFormat
-from openpharmacophore.pharmacophoric_point import UniquePharmacophoricPoint
+from openpharmacophore._private_tools.exceptions import InvalidFileFormat, MissingParameters, OpenPharmacophoreException
+from openpharmacophore.pharmacophoric_point import PharmacophoricPoint, UniquePharmacophoricPoint
 from openpharmacophore.structured_based import StructuredBasedPharmacophore
 from openpharmacophore import Pharmacophore
-from openpharmacophore.utils.random_string import random_string
-from openpharmacophore.utils.conformers import conformer_energy
+from openpharmacophore.screening.batch_screening import labelled_molecules, screen_pharmacophores
+from openpharmacophore.utils.conformers import conformers_energies
+from openpharmacophore.utils.frame_writer import PDBFrameWriter
+from openpharmacophore.utils.trajectory import (check_trajectory_file, iterload_coordinates, 
+    load_trajectory_frames, trajectory_n_frames)
 from openpharmacophore.color_palettes import get_color_from_palette_for_feature
 import matplotlib.pyplot as plt
 import MDAnalysis as mda
-from MDAnalysis.lib.util import NamedStream
 import mdtraj as mdt
 import numpy as np
 import pandas as pd
+import pyunitwizard as puw
+from rdkit import Chem
 from rdkit.Chem.Draw import rdMolDraw2D
+from rdkit.Geometry import Point3D
 from tqdm.auto import tqdm
 import copy
-from collections import defaultdict
-import bisect
-from io import StringIO
+from collections import Counter, defaultdict
+from concurrent.futures import ProcessPoolExecutor
 import os
 
 class Dynophore():
@@ -27,7 +31,13 @@ class Dynophore():
 
     trajectory : 
         A str with the file path containing the trajectory, an mdtraj trajectory object, 
-        or an MDAnalysis universe.
+        or an MDAnalysis universe. Trajectory files are not loaded into memory, their frames
+        are read in chunks when needed. Can be None for dynophores restored with 
+        Dynophore.load, which can be analyzed but not updated.
+
+    topology : str (optional)
+        File with the topology of the trajectory, such as a pdb. Required for trajectory
+        files that don't store the topology (dcd, xtc, trr, netcdf).
 
     Attributes
     ----------
@@ -44,28 +54,75 @@ class Dynophore():
         Number of different pharmacophores in the trajectory.
 
     """
-    def __init__(self, trajectory):
+    def __init__(self, trajectory, topology=None):
         self.pharmacophores = []
         self.pharmacophore_indices = []
         self.n_pharmacophores = 0
-        self.unique_pharmacophoric_points = []
+        self._set_trajectory(trajectory, topology)
+        self._saved_ligand = False
+        self._averaged_coords = False
+        self._frame_writer = None
+        self._reset_unique_points()
 
-        if isinstance(trajectory, str):
-            self._trajectory = self._load_trajectory_file(trajectory)
+    def _set_trajectory(self, trajectory, topology=None):
+        """ Set the trajectory from which the pharmacophores are derived.
+        """
+        self._topology = topology
+        if trajectory is None:
+            self._trajectory_type = None
+            self._trajectory = None
+            self._n_frames = 0
+        elif isinstance(trajectory, str):
+            check_trajectory_file(trajectory, topology)
+            self._trajectory_type = "file"
+            self._trajectory = trajectory
+            self._n_frames = trajectory_n_frames(trajectory)
         elif isinstance(trajectory, mdt.Trajectory):
             self._trajectory_type = "mdt"
             self._trajectory = trajectory
+            self._n_frames = trajectory.n_frames
         elif isinstance(trajectory, mda.Universe):
             self._trajectory_type = "mda"
             self._trajectory = trajectory
+            self._n_frames = trajectory.trajectory.n_frames
         else:
             raise TypeError("Trajectory must be of type string, mdtraj.Trajectory or MdAnalysis.Universe")
-        
-        self._n_frames = trajectory.n_frames
-        self._saved_ligand = False
-        self._averaged_coords = False
 
-    def common_hits_approach(self, frame_list=None):
+    def _check_trajectory(self):
+        """ Raise an error if the dynophore has no trajectory.
+        """
+        if self._trajectory_type is None:
+            raise MissingParameters("The dynophore has no trajectory. Pass one to Dynophore.update"
+                                    " or Dynophore.load")
+
+    def add_frames(self, frames, load_ligand=True, n_workers=1, chunk=100):
+        """ Derive the pharmacophores of more frames of the trajectory and add them to the 
+            dynophore. 
+            
+            The unique pharmacophoric points and the groups of representative pharmacophore 
+            models are updated in place, in time proportional to the number of new frames.
+
+            Parameters
+            ----------
+            frames: list of int
+                Indices of the new frames.
+
+            load_ligand: bool
+                If true the ligand will be stored in the pharmacophore objects. (Default: True)
+
+            n_workers: int (optional)
+                Number of processes used to derive the pharmacophores. If None the number of 
+                processors of the machine is used. (Default: 1)
+
+            chunk: int
+                Maximum number of frames whose coordinates are kept in memory at a time. (Default: 100)
+        """
+        frames = [int(frame) for frame in frames]
+        pharmacophores, frames = self._pharmacophores_from_chunks(
+            self._frame_chunks(frames, chunk), len(frames), load_ligand, n_workers)
+        self._append_pharmacophores(pharmacophores, frames)
+
+    def common_hits_approach(self, actives, inactives, frame_list=None, n_workers=1):
         """ Get a list of pharmacophore models from a trajectory using the common hits approach
             method.
 
@@ -73,19 +130,98 @@ class Dynophore():
             trajectory and then validate and score them using virtual screening. The best performant
             pharmacophore models are then returned.
 
+            The set of actives and inactives is screened once against all the representative 
+            models. Each molecule is prepared a single time and aligned to every model. Models 
+            are ranked by their enrichment factor and then by their sensitivity, and molecules 
+            by the number of models that hit them and then by their mean SSD.
+
             See: Wieder, Marcus, Arthur Garon, Ugo Perricone, Stefan Boresch, Thomas Seidel, Anna Maria Almerico, 
             and Thierry Langer. "Common hits approach: combining pharmacophore modeling and molecular dynamics 
             simulations." Journal of chemical information and modeling 57, no. 2 (2017): 365-385      
 
-        """
-        if frame_list is None:
-            frame_list = list(range(0, self._n_frames))
+            Parameters
+            ----------
+            actives: 2-tuple
+                The first element is a list of the active compounds ids, and
+                the second elment is a list of smiles for the active compounds.
+
+            inactives: 2-tuple
+                The first element is a list of the inactive compounds ids, and
+                the second elment is a list of smiles for the inactive compounds.
 
-        self.pharmacophores_from_frames(frame_list, load_ligand=True)
-        self._get_unique_pharmacophoric_points(avg_coordinates=False)
-        rpms = self.representative_pharmacophore_models()
+            frame_list: list of int (optional)
+                Frames from which the pharmacophores are derived. If None, the pharmacophores
+                already in the dynophore are used, or all the frames of the trajectory if there 
+                are none.
+
+            n_workers: int (optional)
+                Number of processes used to derive the pharmacophores and to screen the molecules.
+                If None the number of processors of the machine is used. (Default: 1)
+
+            Returns
+            -------
+            models: pandas.DataFrame
+                The representative pharmacophore models sorted by rank. Has the following columns:
+                pharmacophore, frame, actives hit, inactives hit, sensitivity, specificity and
+                enrichment factor.
+
+            molecules: pandas.DataFrame
+                The screened molecules sorted by rank. Has the following columns: id, active, 
+                number of models that hit the molecule, hit pattern, with a 1 for each model, in 
+                the order of the models dataframe, that hits the molecule, and mean SSD.
+        """
+        if frame_list is not None:
+            self.pharmacophores_from_frames(frame_list, load_ligand=True, n_workers=n_workers)
+        elif self.n_pharmacophores == 0:
+            self.pharmacophores_from_trajectory(load_ligand=True, n_workers=n_workers)
+        
+        rpms = self.representative_pharmacophore_models(n_workers=n_workers)
+        if len(rpms) == 0:
+            raise OpenPharmacophoreException("No representative pharmacophore models were found")
+        pharmacophore_frames = {id(pharmacophore): frame for pharmacophore, frame 
+                                in zip(self.pharmacophores, self.pharmacophore_indices)}
+
+        molecules, ids, labels = labelled_molecules(actives, inactives)
+        scores = screen_pharmacophores(rpms, molecules, n_workers=n_workers)
+        # Hit pattern of each molecule across models
+        hits = ~np.isnan(scores)
+        
+        n_actives = np.count_nonzero(labels)
+        n_inactives = labels.shape[0] - n_actives
+        actives_hit = np.count_nonzero(hits & labels, axis=1)
+        inactives_hit = np.count_nonzero(hits & ~labels, axis=1)
+        n_hits = actives_hit + inactives_hit
+        with np.errstate(divide="ignore", invalid="ignore"):
+            sensitivity = actives_hit / n_actives
+            specificity = (n_inactives - inactives_hit) / n_inactives
+            enrichment_factor = np.where(
+                n_hits > 0, (actives_hit / n_hits) / (n_actives / labels.shape[0]), 0.0)
+        
+        model_order = np.lexsort((-sensitivity, -enrichment_factor))
+        models = pd.DataFrame().from_dict({
+            "Pharmacophore": [rpms[i] for i in model_order],
+            "Frame": [pharmacophore_frames[id(rpms[i])] for i in model_order],
+            "Actives Hit": actives_hit[model_order],
+            "Inactives Hit": inactives_hit[model_order],
+            "Sensitivity": sensitivity[model_order],
+            "Specificity": specificity[model_order],
+            "Enrichment Factor": enrichment_factor[model_order],
+        })
 
-        pass
+        hits = hits[model_order]
+        molecule_hits = np.count_nonzero(hits, axis=0)
+        with np.errstate(invalid="ignore"):
+            mean_ssd = np.where(molecule_hits > 0, np.nansum(scores, axis=0) / np.maximum(molecule_hits, 1), np.nan)
+        molecule_order = np.lexsort((np.nan_to_num(mean_ssd, nan=np.inf), -molecule_hits))
+        molecules = pd.DataFrame().from_dict({
+            "ID": [ids[i] for i in molecule_order],
+            "Active": labels[molecule_order],
+            "N Hits": molecule_hits[molecule_order],
+            "Hit Pattern": ["".join("1" if hit else "0" for hit in hits[:, i]) for i in molecule_order],
+            "Mean SSD": mean_ssd[molecule_order],
+        })
+        
+        return models, molecules
 
     def draw(self, file_name, img_size=(500,500), legend="", freq_threshold=0.2):
         """ Draw a 2d representation of the dynamic pharmacophore. This is a drawing of the
@@ -174,20 +310,101 @@ class Dynophore():
                  dynamics simulations." Monatshefte für Chemie-Chemical Monthly 147, no. 3 (2016): 
                  553-563.
         """
-        if self._trajectory_type == "mdt":
-            get_pharmacophore = self._pharmacophore_from_mdtraj
-        elif self._trajectory_type == "mda":
-            get_pharmacophore = self._pharmacohore_from_mdanalysis
-
-        initial_pharmacophore = get_pharmacophore(0, True, True)
-        end_pharmacophore = get_pharmacophore(-1, True, True)
-        last_frame_index = self._trajectory.n_frames
+        initial_pharmacophore = self._pharmacophore_from_frame(0, True, True)
+        end_pharmacophore = self._pharmacophore_from_frame(-1, True, True)
+        last_frame_index = self._n_frames - 1
         self.pharmacophores = [
             initial_pharmacophore,
             end_pharmacophore
         ]
         self.pharmacophore_indices = [0, last_frame_index]
         self.n_pharmacophores = 2
+        self._reset_unique_points()
+
+    @classmethod
+    def load(cls, file_name, trajectory=None, topology=None):
+        """ Load a dynophore saved with Dynophore.save. 
+        
+            The pharmacophores, the unique pharmacophoric points and the frames in which
+            each one appears are restored from the file, so the dynophore can be analyzed 
+            without the trajectory. If the trajectory is passed the dynophore can also be 
+            updated with new frames.
+
+            Parameters
+            ----------
+            file_name: str
+                Name of the npz file.
+
+            trajectory: str, mdtraj.Trajectory or MDAnalysis.Universe (optional)
+                The trajectory from which the dynophore was derived.
+
+            topology: str (optional)
+                Name of a file with the topology of the trajectory.
+
+            Returns
+            -------
+            Dynophore
+                The dynophore. Its pharmacophores store the ligand only if it was saved.
+        """
+        if not file_name.endswith(".npz"):
+            raise InvalidFileFormat("File must be an npz file.")
+
+        dynophore = cls(trajectory, topology)
+        with np.load(file_name, allow_pickle=False) as data:
+            data = dict(data)
+        
+        if trajectory is None:
+            dynophore._n_frames = int(data["n_frames"])
+        
+        frames = data["frames"].tolist()
+        points = _points_from_arrays(data["feature_types"], data["centers"], data["radii"], 
+            data["directions"], data["atoms"], data["atom_offsets"], data["has_atoms"])
+        point_offsets = data["point_offsets"]
+        if "ligand_template" in data:
+            ligands = _ligands_from_arrays(data["ligand_template"], data["ligand_coordinates"])
+            dynophore._saved_ligand = True
+        else:
+            ligands = [None] * len(frames)
+        
+        dynophore.pharmacophores = [
+            _pharmacophore_from_records(points[point_offsets[i]:point_offsets[i + 1]], ligands[i])
+            for i in range(len(frames))
+        ]
+        dynophore.pharmacophore_indices = frames
+        dynophore.n_pharmacophores = len(frames)
+        dynophore._averaged_coords = bool(data["averaged_coords"])
+        
+        # Unique pharmacophoric points
+        unique_points = _points_from_arrays(data["unique_feature_types"], data["unique_first_centers"], 
+            data["unique_radii"], np.full((len(data["unique_radii"]), 3), np.nan), data["unique_atoms"],
+            data["unique_atom_offsets"], data["unique_has_atoms"])
+        for index, (record, name) in enumerate(zip(unique_points, data["unique_feature_names"].tolist())):
+            unique_point = UniquePharmacophoricPoint(_pharmacophore_from_records([record], None).elements[0])
+            unique_point.feature_name = name
+            dynophore._unique_point_index[_point_signature(unique_point)] = index
+            dynophore.unique_pharmacophoric_points.append(unique_point)
+        dynophore._feature_count = defaultdict(int, Counter(data["unique_feature_types"].tolist()))
+        dynophore._center_sums = data["unique_center_sums"]
+        dynophore._first_centers = data["unique_first_centers"]
+        dynophore._n_occurrences = data["unique_n_occurrences"]
+        
+        # Frames in which each unique point appears
+        n_unique = len(dynophore.unique_pharmacophoric_points)
+        occupancy = np.unpackbits(data["occupancy_bits"], axis=1, count=len(frames)).astype(bool)
+        occupancy = occupancy.reshape(n_unique, len(frames))
+        dynophore._occupancy_bits = data["occupancy_bits"]
+        dynophore._occupancy_shape = occupancy.shape
+        dynophore._counts = occupancy.sum(axis=1).astype(np.int64)
+        frames_array = np.array(frames, dtype=np.int64)
+        for index, unique_point in enumerate(dynophore.unique_pharmacophoric_points):
+            unique_point.timesteps = frames_array[occupancy[index]].tolist()
+        for index in range(len(frames)):
+            frame_unique = np.flatnonzero(occupancy[:, index]).astype(np.int64)
+            dynophore._frame_unique_indices.append(frame_unique)
+            dynophore._pharmacophore_groups.setdefault(frame_unique.tobytes(), []).append(index)
+        dynophore._refresh_unique_points()
+        
+        return dynophore
 
     def pharmacophore_by_frequency(self, threshold):
         """ Derive a unique pharmacophore model with the pharmacophoric points
@@ -231,12 +448,11 @@ class Dynophore():
             openpharmcophore.Pharmacophore
                 Pharmacophore model with the specified points.
         """
-        if len(self.unique_pharmacophoric_points) == 0 or not self._averaged_coords:
-            self._get_unique_pharmacophoric_points(avg_coordinates=True)
+        self._ensure_unique_points(avg_coordinates=True)
         points = [point for point in self.unique_pharmacophoric_points if point.feature_name in unique_points]
         return Pharmacophore(elements=points)
 
-    def pharmacophores_from_frames(self, frames, load_ligand=True):
+    def pharmacophores_from_frames(self, frames, load_ligand=True, n_workers=1, chunk=100):
         """ Get pharmacophores for the specified frames in a trajectory
 
             Parameters
@@ -244,17 +460,183 @@ class Dynophore():
             frames: list of int
                 Indices of the frames for which pharmacophores will be derived.
 
+            load_ligand: bool
+                If true the ligand will be stored in the pharmacophore objects. (Default: True)
+
+            n_workers: int (optional)
+                Number of processes used to derive the pharmacophores. If greater than one, the 
+                frames are split into shards and each process receives only the topology and the 
+                coordinates of the frames of its shards. If None the number of processors of the
+                machine is used. (Default: 1)
+
+            chunk: int
+                Maximum number of frames whose coordinates are kept in memory at a time. (Default: 100)
+
         """
-        if self._trajectory_type == "mdt":
-            get_pharmacophore = self._pharmacophore_from_mdtraj
-        elif self._trajectory_type == "mda":
-            get_pharmacophore = self._pharmacohore_from_mdanalysis
+        frames = [int(frame) for frame in frames]
+        self.pharmacophores, self.pharmacophore_indices = self._pharmacophores_from_chunks(
+            self._frame_chunks(frames, chunk), len(frames), load_ligand, n_workers)
+        self.n_pharmacophores = len(self.pharmacophores)
+        self._reset_unique_points()
+
+    def pharmacophores_from_trajectory(self, start=0, stop=None, stride=1, load_ligand=True, n_workers=1, chunk=100):
+        """ Get pharmacophores for a range of frames of the trajectory. 
         
-        self.pharmacophores = []
-        for i in tqdm(frames):
-            self.pharmacophores.append(get_pharmacophore(i, load_ligand=load_ligand))
-            self.pharmacophore_indices.append(i)
+            The frames are read in chunks, so trajectory files are never fully loaded into memory.
+
+            Parameters
+            ----------
+            start: int
+                Index of the first frame. (Default: 0)
+
+            stop: int (optional)
+                Frames from this index onwards are not used. If None the range continues until 
+                the end of the trajectory.
+
+            stride: int
+                Use every stride-th frame. (Default: 1)
+
+            load_ligand: bool
+                If true the ligand will be stored in the pharmacophore objects. (Default: True)
+
+            n_workers: int (optional)
+                Number of processes used to derive the pharmacophores. If None the number of 
+                processors of the machine is used. (Default: 1)
+
+            chunk: int
+                Maximum number of frames whose coordinates are kept in memory at a time. (Default: 100)
+
+        """
+        stop = self._n_frames if stop is None else min(stop, self._n_frames)
+        n_frames = len(range(start, stop, stride))
+        self.pharmacophores, self.pharmacophore_indices = self._pharmacophores_from_chunks(
+            self._range_chunks(start, stop, stride, chunk), n_frames, load_ligand, n_workers)
         self.n_pharmacophores = len(self.pharmacophores)
+        self._reset_unique_points()
+
+    def _append_pharmacophores(self, pharmacophores, frames):
+        """ Add pharmacophores to the dynophore and update the unique pharmacophoric points.
+        """
+        start = self.n_pharmacophores
+        if start > 0 and len(self._frame_unique_indices) != start:
+            self._get_unique_pharmacophoric_points(avg_coordinates=self._averaged_coords)
+        self.pharmacophores.extend(pharmacophores)
+        self.pharmacophore_indices.extend(frames)
+        self.n_pharmacophores = len(self.pharmacophores)
+        self._update_unique_pharmacophoric_points(start)
+
+    def _frame_chunks(self, frames, chunk):
+        """ Iterate over a list of frames of the trajectory in chunks. 
+
+            Yields
+            ------
+            frames: list of int
+                The indices of the frames of the chunk.
+
+            coordinates: numpy.ndarray of shape (n_frames, n_atoms, 3)
+                The coordinates of the frames of the chunk in angstroms.
+        """
+        for i in range(0, len(frames), chunk):
+            yield frames[i:i + chunk], self._frame_coordinates(frames[i:i + chunk])
+
+    def _range_chunks(self, start, stop, stride, chunk):
+        """ Iterate over a range of frames of the trajectory in chunks. Trajectory files are 
+            read sequentially.
+        """
+        self._check_trajectory()
+        if self._trajectory_type == "file":
+            return iterload_coordinates(self._trajectory, self._topology, chunk=chunk, 
+                                        start=start, stop=stop, stride=stride)
+        return self._frame_chunks(list(range(start, stop, stride)), chunk)
+
+    def _pharmacophores_from_chunks(self, chunks, n_frames, load_ligand, n_workers):
+        """ Get pharmacophores for the frames of an iterable of chunks of a trajectory. 
+
+            Parameters
+            ----------
+            chunks: iterable of tuple
+                Each chunk is a tuple with a list of frame indices and an array with the 
+                coordinates of those frames in angstroms.
+            
+            n_frames: int
+                Total number of frames. Used to show the progress.
+
+            Returns
+            -------
+            pharmacophores: list of openpharmacophore.StructuredBasedPharmacophore
+                The pharmacophores in the same order as the frames.
+            
+            frames: list of int
+                The indices of the frames.
+        """
+        pharmacophores = []
+        all_frames = []
+        progress_bar = tqdm(total=n_frames)
+
+        if n_workers == 1:
+            for frames, coordinates in chunks:
+                for frame_coordinates in coordinates:
+                    pharmacophores.append(self._pharmacophore_from_coordinates(
+                        frame_coordinates, load_ligand=load_ligand))
+                    progress_bar.update(1)
+                all_frames.extend(frames)
+            progress_bar.close()
+            return pharmacophores, all_frames
+
+        if n_workers is None:
+            n_workers = os.cpu_count() or 1
+        writer = self._get_frame_writer()
+
+        def collect(futures):
+            # Results are collected in submission order so they match the order of the frames
+            for future in futures:
+                records = future.result()
+                pharmacophores.extend(_pharmacophore_from_records(*r) for r in records)
+                progress_bar.update(len(records))
+
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            pending = []
+            for frames, coordinates in chunks:
+                shards = np.array_split(np.arange(len(frames)), min(len(frames), n_workers))
+                futures = [
+                    executor.submit(_pharmacophores_from_coordinates, writer, coordinates[shard], load_ligand)
+                    for shard in shards
+                ]
+                all_frames.extend(frames)
+                # The next chunk is read while the workers process the current one, so at most
+                # two chunks are kept in memory
+                collect(pending)
+                pending = futures
+            collect(pending)
+        
+        progress_bar.close()
+        return pharmacophores, all_frames
+
+    def _frame_coordinates(self, frames):
+        """ Get the coordinates of some frames of the trajectory.
+
+            Parameters
+            ----------
+            frames: list of int
+                Indices of the frames.
+
+            Returns
+            -------
+            numpy.ndarray of shape (n_frames, n_atoms, 3)
+                The coordinates in angstroms.
+        """
+        self._check_trajectory()
+        if self._trajectory_type == "file":
+            return load_trajectory_frames(self._trajectory, frames, self._topology)
+        elif self._trajectory_type == "mdt":
+            # mdtraj coordinates are in nanometers
+            return self._trajectory.xyz[frames] * 10
+        
+        coordinates = []
+        for frame in frames:
+            self._trajectory.trajectory[frame]
+            coordinates.append(self._trajectory.atoms.positions.copy())
+        return np.array(coordinates)
     
     def pharmacophoric_point_frequency(self):
         """ Get a dataframe with all unique pharmacophoric points and its frequency.
@@ -265,21 +647,12 @@ class Dynophore():
                 Dataframe with the following columns: feature name, frequency and atom
                 indices.
         """
-        if len(self.unique_pharmacophoric_points) == 0 or not self._averaged_coords:
-            self._get_unique_pharmacophoric_points(avg_coordinates=True)
+        self._ensure_unique_points(avg_coordinates=True)
         
-        names = []
-        frequencies = []
-        indices = []
-        for point in self.unique_pharmacophoric_points:
-            names.append(point.feature_name)
-            frequencies.append(point.frequency)
-            indices.append(point.atoms_inxs)
-
         frequency = pd.DataFrame().from_dict({
-            "Feature Name": names,
-            "Frequency": frequencies,
-            "Atoms Indices": indices
+            "Feature Name": [point.feature_name for point in self.unique_pharmacophoric_points],
+            "Frequency": self._counts / self.n_pharmacophores,
+            "Atoms Indices": [point.atoms_inxs for point in self.unique_pharmacophoric_points]
         })
         frequency.sort_values(by=["Frequency"], ascending=False, inplace=True)
         frequency.reset_index(inplace=True)
@@ -302,8 +675,7 @@ class Dynophore():
             n_bins: int (Default = 10)
                 Number of bins to discretize the timesteps.            
         """
-        if len(self.unique_pharmacophoric_points) == 0 or not self._averaged_coords:
-            self._get_unique_pharmacophoric_points(avg_coordinates=True)
+        self._ensure_unique_points(avg_coordinates=True)
 
         if threshold < 0 or threshold > 1:
             raise ValueError("Threshold must be a number between 0 and 1")
@@ -313,19 +685,16 @@ class Dynophore():
         n_timesteps = self._n_frames
         bins = np.arange(0, n_timesteps + 1, n_timesteps/n_bins)
 
-        for point in self.unique_pharmacophoric_points:
-            if point.frequency < threshold:
-                continue
-            point_timesteps = np.array(point.timesteps)
-            discretized_timesteps = np.digitize(point_timesteps, bins)
+        # Count the frames of each bin in which each point appears with a single product
+        # of the occupancy matrix and a matrix that assigns each frame to its bin
+        discretized_timesteps = np.digitize(self.pharmacophore_indices, bins)
+        in_range = discretized_timesteps < bins.shape[0]
+        frame_bins = np.zeros((self.n_pharmacophores, bins.shape[0]))
+        frame_bins[np.flatnonzero(in_range), discretized_timesteps[in_range]] = 1
+        counts = self.occupancy_matrix() @ frame_bins
 
-            counts = np.zeros_like(bins)
-
-            for i in range(bins.shape[0]):
-                c = np.count_nonzero(discretized_timesteps == i)
-                counts[i] = c
-            
-            ax.plot(bins, counts, label=point.feature_name)
+        for index in np.flatnonzero(self._counts / self.n_pharmacophores >= threshold):
+            ax.plot(bins, counts[index], label=self.unique_pharmacophoric_points[index].feature_name)
 
         ax.legend()
         ax.set_xlabel("Timesteps")
@@ -333,8 +702,76 @@ class Dynophore():
         plt.show()
 
         return ax
+
+    def occupancy_matrix(self):
+        """ Get a matrix with the frames in which each unique pharmacophoric point appears.
+
+            The matrix is computed once and stored as packed bits, it is only recomputed 
+            when frames are added to the dynophore.
+
+            Returns
+            -------
+            numpy.ndarray of shape (n_unique_points, n_pharmacophores)
+                Boolean array where element (i, j) is true if the i-th unique point appears 
+                in the j-th pharmacophore.
+        """
+        self._ensure_unique_points(avg_coordinates=self._averaged_coords)
+        n_unique = len(self.unique_pharmacophoric_points)
+        if self._occupancy_bits is None or self._occupancy_shape != (n_unique, self.n_pharmacophores):
+            occupancy = np.zeros((n_unique, self.n_pharmacophores), dtype=bool)
+            if n_unique > 0:
+                columns = np.repeat(np.arange(self.n_pharmacophores), 
+                                    [len(indices) for indices in self._frame_unique_indices])
+                occupancy[np.concatenate(self._frame_unique_indices), columns] = True
+            self._occupancy_bits = np.packbits(occupancy, axis=1)
+            self._occupancy_shape = occupancy.shape
+        return np.unpackbits(self._occupancy_bits, axis=1, count=self.n_pharmacophores).astype(bool)
+
+    def point_cooccurrence(self):
+        """ Get the fraction of frames in which each pair of unique pharmacophoric points 
+            appear together.
+
+            Returns
+            -------
+            pandas.DataFrame
+                Symmetric dataframe indexed by the names of the unique points in both axes. 
+                The diagonal holds the frequency of each point.
+        """
+        occupancy = self.occupancy_matrix().astype(np.int64)
+        cooccurrence = (occupancy @ occupancy.T) / self.n_pharmacophores
+        names = [point.feature_name for point in self.unique_pharmacophoric_points]
+        return pd.DataFrame(cooccurrence, index=names, columns=names)
+
+    def point_occupancy_moving_average(self, window=10):
+        """ Get the occupancy of each unique pharmacophoric point averaged over a moving 
+            window of frames.
+
+            Parameters
+            ----------
+            window: int
+                Number of consecutive pharmacophores, sorted by frame, in each window. (Default: 10)
+
+            Returns
+            -------
+            pandas.DataFrame
+                Dataframe with a column per unique point, indexed by the last frame of each 
+                window.
+        """
+        occupancy = self.occupancy_matrix()
+        if window < 1 or window > self.n_pharmacophores:
+            raise ValueError("Window must be a number between 1 and the number of pharmacophores")
+        
+        order = np.argsort(self.pharmacophore_indices, kind="stable")
+        occupancy = occupancy[:, order]
+        cumulative = np.zeros((occupancy.shape[0], occupancy.shape[1] + 1), dtype=np.int64)
+        np.cumsum(occupancy, axis=1, out=cumulative[:, 1:])
+        moving_average = (cumulative[:, window:] - cumulative[:, :-window]) / window
+
+        frames = np.array(self.pharmacophore_indices)[order]
+        return pd.DataFrame(moving_average.T, index=frames[window - 1:], 
+                            columns=[point.feature_name for point in self.unique_pharmacophoric_points])
     
-    def representative_pharmacophore_models(self):
+    def representative_pharmacophore_models(self, n_workers=1):
         """ Get all representative pharmacophore models in a trajectory. That is the pharmacophore
             models that have the same pharmacophoric points, considering only feature type and the 
             atoms to which this points belong to. Coordinates are not taken into account.
@@ -342,44 +779,146 @@ class Dynophore():
             The coordinates of the pharmacophoric points are those that belong to the median energy of
             the ligand.
 
+            Parameters
+            ----------
+            n_workers: int (optional)
+                Number of processes used to compute the energies of the ligand. If None the number
+                of processors of the machine is used. (Default: 1)
+
             Returns
             -------
             rpms: list of openpharmacophore.StructuredBasedPharmacophore
                 The representative pharmacophore models
         """
-        if len(self.unique_pharmacophoric_points) == 0 or self._averaged_coords:
-            self._get_unique_pharmacophoric_points(avg_coordinates=False)
-            self._averaged_coords = False
+        # The groups don't depend on the coordinates of the unique points, so they are 
+        # only computed if they are missing or out of date
+        self._ensure_unique_points(avg_coordinates=self._averaged_coords)
+        
+        rpms_indices = self._representative_pharmacophore_indices(min_count=3)
+        return self._pharmacophores_from_ligand_median_energy(rpms_indices, n_workers)
+
+    def save(self, file_name, save_ligand=True):
+        """ Save the dynophore to an npz file, so that it can be restored with Dynophore.load 
+            without processing the trajectory again.
+
+            The file stores the points of the pharmacophore of each frame, the table of unique 
+            pharmacophoric points, the occupancy matrix of the unique points as packed bits
+            and optionally the coordinates of the ligand in each frame. The molecular systems 
+            are not saved.
+
+            Parameters
+            ----------
+            file_name: str
+                Name of the file. Must be an npz file.
+
+            save_ligand: bool
+                If true the ligand of each pharmacophore is saved, if all the pharmacophores 
+                store it. (Default: True)
+        """
+        if not file_name.endswith(".npz"):
+            raise InvalidFileFormat("File must be an npz file.")
+        
+        if self.n_pharmacophores > 0:
+            occupancy_bits = np.packbits(self.occupancy_matrix(), axis=1)
+        else:
+            occupancy_bits = np.zeros((0, 0), dtype=np.uint8)
+
+        point_offsets = [0]
+        points = []
+        for pharmacophore in self.pharmacophores:
+            points.extend(_pharmacophore_to_records(pharmacophore)[0])
+            point_offsets.append(len(points))
         
-        # Compute a matrix where each row represents a feature vector of a pharmacophore
-        n_pharmacophores = self.n_pharmacophores
-        n_features = len(self.unique_pharmacophoric_points) 
-        feature_matrix = np.zeros((n_pharmacophores, n_features), dtype=np.int32)
-        for ii, pharmacophore in enumerate(self.pharmacophores):
-            for point in pharmacophore.elements:
-                for jj, unique_point in enumerate(self.unique_pharmacophoric_points):
-                    if point.is_equal(unique_point):
-                        feature_matrix[ii, jj] = 1
-                        break
+        unique_points = [
+            (point.feature_name.rsplit(" ", 1)[0], None, puw.get_value(point.radius, "angstroms"), 
+             None, None if point.atoms_inxs is None else sorted(point.atoms_inxs))
+            for point in self.unique_pharmacophoric_points
+        ]
+
+        arrays = dict(
+            n_frames=self._n_frames,
+            averaged_coords=self._averaged_coords,
+            frames=np.array(self.pharmacophore_indices, dtype=np.int64),
+            point_offsets=np.array(point_offsets, dtype=np.int64),
+            occupancy_bits=occupancy_bits,
+            unique_feature_names=np.array([p.feature_name for p in self.unique_pharmacophoric_points], dtype=str),
+            unique_center_sums=self._center_sums,
+            unique_first_centers=self._first_centers,
+            unique_n_occurrences=self._n_occurrences,
+        )
+        arrays.update(_points_to_arrays(points))
+        arrays.update({"unique_" + key: value for key, value in _points_to_arrays(unique_points).items() 
+                       if key in ("feature_types", "radii", "atoms", "atom_offsets", "has_atoms")})
         
-        # Find similar pharmacophores in the matrix
-        rpms_indices = []
-        skip = []
-        for ii in range(n_pharmacophores):
-            rpm = [ii]
-            for jj in range(ii + 1, n_pharmacophores):
-                if jj in skip:
-                    continue
-                if np.all(feature_matrix[ii, :] == feature_matrix[jj, :]):
-                    rpm.append(jj)
-                    skip.append(jj)
-            # Keep only models that have a frequency higher than 2
-            if len(rpm) > 2:
-                rpms_indices.append(rpm)
+        if save_ligand and self.n_pharmacophores > 0 and all(
+                pharmacophore.ligand is not None for pharmacophore in self.pharmacophores):
+            arrays.update(_ligands_to_arrays([pharmacophore.ligand for pharmacophore in self.pharmacophores]))
         
-        return self._pharmacophores_from_ligand_median_energy(rpms_indices)
+        np.savez_compressed(file_name, **arrays)
+
+    def update(self, trajectory=None, load_ligand=True, n_workers=1, chunk=100):
+        """ Add to the dynophore the frames appended to the trajectory since the last frame 
+            that was processed. Useful to follow a simulation that is still running.
 
-    def _pharmacophores_from_ligand_median_energy(self, rpms_indices):
+            Parameters
+            ----------
+            trajectory: str, mdtraj.Trajectory or MDAnalysis.Universe (optional)
+                The trajectory with the new frames. It must have the same topology as the
+                current one. If None the current trajectory file is checked for new frames.
+
+            load_ligand: bool
+                If true the ligand will be stored in the pharmacophore objects. (Default: True)
+
+            n_workers: int (optional)
+                Number of processes used to derive the pharmacophores. If None the number of 
+                processors of the machine is used. (Default: 1)
+
+            chunk: int
+                Maximum number of frames whose coordinates are kept in memory at a time. (Default: 100)
+
+            Returns
+            -------
+            int
+                The number of frames that were added.
+        """
+        if trajectory is not None:
+            self._set_trajectory(trajectory, self._topology)
+            self._frame_writer = None
+        else:
+            self._check_trajectory()
+            if self._trajectory_type == "file":
+                self._n_frames = trajectory_n_frames(self._trajectory)
+        
+        start = max(self.pharmacophore_indices) + 1 if self.n_pharmacophores > 0 else 0
+        n_frames = max(self._n_frames - start, 0)
+        if n_frames == 0:
+            return 0
+        pharmacophores, frames = self._pharmacophores_from_chunks(
+            self._range_chunks(start, self._n_frames, 1, chunk), n_frames, load_ligand, n_workers)
+        self._append_pharmacophores(pharmacophores, frames)
+        return len(frames)
+
+    def _representative_pharmacophore_indices(self, min_count=3):
+        """ Get the groups of pharmacophores that have the same unique pharmacophoric points.
+
+            The groups are kept up to date as pharmacophores are added. Each pharmacophore is 
+            assigned to its group by hashing its row of the feature matrix, that is, the 
+            indices of its unique points.
+
+            Parameters
+            ----------
+            min_count: int
+                Minimum number of pharmacophores of a group. (Default: 3)
+
+            Returns
+            -------
+            rpms_indices: list of list of int
+                The indices of the pharmacophores of each group, sorted by the index of their 
+                first pharmacophore.
+        """
+        return [list(group) for group in self._pharmacophore_groups.values() if len(group) >= min_count]
+
+    def _pharmacophores_from_ligand_median_energy(self, rpms_indices, n_workers=1):
         """ Get the representative pharmacophore models that correspond to the pharmacophore
             with ligand median energy.
 
@@ -389,106 +928,162 @@ class Dynophore():
                 A list where each sublist contains the indices of the representative pharmacophore
                 model. This indices correspond to the attribute pharmacophores of the Dynophore
                 class.
+
+            n_workers: int (optional)
+                Number of processes used to compute the energies of the ligand. (Default: 1)
             
             Returns
             -------
             rpms: list of openpharmacophore.StructuredBasedPharmacophore
                 The representative pharmacophore models
         """
+        # The energies of all the ligands are computed in a single batch
+        indices = sorted({index for rpm_indices in rpms_indices for index in rpm_indices})
+        ligands = [self.pharmacophores[index].ligand for index in indices]
+        energies = dict(zip(indices, conformers_energies(ligands, n_workers=n_workers)))
+
         rpms = []
-        for indices in rpms_indices:
-            energies = []
-            for index in indices:
-                energy = (conformer_energy(self.pharmacophores[index].ligand), index)
-                bisect.insort(energies, energy)
+        for rpm_indices in rpms_indices:
+            rpm_energies = np.array([energies[index] for index in rpm_indices])
             # Take the pharmacophore with median energy
-            median_energy_index = energies[int(len(energies) / 2)][1]
+            median = len(rpm_indices) // 2
+            median_energy_index = rpm_indices[np.argpartition(rpm_energies, median)[median]]
             rpms.append(self.pharmacophores[median_energy_index])
         
         return rpms
 
-            
-    def _load_trajectory_file(self, file_name):
-        """ Load a trajectory file from a MD simulation
-
-            Parameters
-            ----------
-            file_name: str
-                Name of the file containing the trajectory.
-
-            Returns
-            -------
-            traj: 
-                The trajectory object.  
-        """
-        if file_name.endswith("h5"):
-            traj = mdt.load(file_name)
-        else:
-            raise NotImplementedError
-
-        return traj
-    
     def _get_unique_pharmacophoric_points(self, avg_coordinates=True):
         """ Get all unique pharmacophoric points across all the pharmacophore models 
             derived from the trajectory. The coordinates of the unique points will 
             be averaged. 
             
             Two points are considered equal if they have the same feature type and
-            are associated with the same atom in the ligand.
+            are associated with the same atoms in the ligand, so points are grouped 
+            by the signature (short_name, frozenset(atoms_inxs)) in a single pass.
         """
-        if avg_coordinates:
-            self._averaged_coords = True
-
         if self.n_pharmacophores == 0:
-            self.pharmacophores_from_frames(list(range(0, self._n_frames)))
-        all_points = []
-        for i, pharmacophore in enumerate(self.pharmacophores):
-            for pharmacophoric_point in pharmacophore.elements:
-                pharmacophoric_point.pharmacophore_index = i
-                all_points.append(pharmacophoric_point)
+            self.pharmacophores_from_trajectory()
+
+        self._reset_unique_points()
+        self._averaged_coords = avg_coordinates
+        self._update_unique_pharmacophoric_points(0)
+
+    def _ensure_unique_points(self, avg_coordinates=True):
+        """ Compute the unique pharmacophoric points if they are missing or out of date. If
+            they are up to date only their centers are recomputed when needed.
+        """
+        if self.n_pharmacophores == 0 or len(self._frame_unique_indices) != self.n_pharmacophores:
+            self._get_unique_pharmacophoric_points(avg_coordinates=avg_coordinates)
+        elif self._averaged_coords != avg_coordinates:
+            self._averaged_coords = avg_coordinates
+            self._refresh_unique_points()
+
+    def _reset_unique_points(self):
+        """ Clear the unique pharmacophoric points and the state used to update them.
+        """
+        self.unique_pharmacophoric_points = []
+        # Map from point signatures to the index of their unique point
+        self._unique_point_index = {}
+        # Per unique point: sum of the centers, center of its first occurrence, number of 
+        # occurrences and number of frames in which it appears
+        self._center_sums = np.zeros((0, 3))
+        self._first_centers = np.zeros((0, 3))
+        self._n_occurrences = np.zeros(0, dtype=np.int64)
+        self._counts = np.zeros(0, dtype=np.int64)
+        # Sorted indices of the unique points of each pharmacophore
+        self._frame_unique_indices = []
+        # Map from the unique points of a pharmacophore to the pharmacophores with the same points
+        self._pharmacophore_groups = {}
+        self._feature_count = defaultdict(int)
+        # Occupancy matrix of shape (n_unique_points, n_pharmacophores) packed along the 
+        # pharmacophores axis
+        self._occupancy_bits = None
+        self._occupancy_shape = (0, 0)
+
+    def _update_unique_pharmacophoric_points(self, start):
+        """ Add the points of the pharmacophores from index start onwards to the unique
+            pharmacophoric points. 
+        """
+        n_unique = len(self.unique_pharmacophoric_points)
+        new_points = []
+        point_unique_indices = []
+        centers = []
+        frame_unique_indices = []
+        for i in range(start, self.n_pharmacophores):
+            frame_indices = []
+            for point in self.pharmacophores[i].elements:
+                signature = _point_signature(point)
+                index = self._unique_point_index.get(signature)
+                if index is None:
+                    index = n_unique + len(new_points)
+                    self._unique_point_index[signature] = index
+                    unique_point = UniquePharmacophoricPoint(point)
+                    # Get a unique name for each point
+                    self._feature_count[point.feature_name] += 1
+                    unique_point.feature_name = point.feature_name + " " + str(self._feature_count[point.feature_name])
+                    new_points.append(unique_point)
+                frame_indices.append(index)
+                centers.append(puw.get_value(point.center, "angstroms"))
+            point_unique_indices.extend(frame_indices)
+            
+            frame_unique = np.unique(np.array(frame_indices, dtype=np.int64))
+            frame_unique_indices.append(frame_unique)
+            self._frame_unique_indices.append(frame_unique)
+            self._pharmacophore_groups.setdefault(frame_unique.tobytes(), []).append(i)
+        
+        self.unique_pharmacophoric_points.extend(new_points)
+        n_new = len(new_points)
+        if n_new > 0:
+            self._center_sums = np.concatenate([self._center_sums, np.zeros((n_new, 3))])
+            self._first_centers = np.concatenate([
+                self._first_centers, 
+                np.array([puw.get_value(p.center, "angstroms") for p in new_points])
+            ])
+            self._n_occurrences = np.concatenate([self._n_occurrences, np.zeros(n_new, dtype=np.int64)])
+            self._counts = np.concatenate([self._counts, np.zeros(n_new, dtype=np.int64)])
         
-        self.unique_pharmacophoric_points.clear()
-        count = 0
-        # Get all unique parmacophoric points while also updating the count, 
-        # timesteps where they appear and calculatinf the average centroid.
-        for point in all_points:
-            is_unique = True
-            for unique_p in self.unique_pharmacophoric_points:
-                if point.is_equal(unique_p):
-                    count += 1
-                    unique_p.count += 1
-                    unique_p.timesteps.append(point.pharmacophore_index)
-                    if avg_coordinates:
-                        unique_p.center += point.center
-                    is_unique = False
-                    break
-            if is_unique:
-                self.unique_pharmacophoric_points.append(UniquePharmacophoricPoint(point))
+        if len(point_unique_indices) > 0:
+            point_unique_indices = np.array(point_unique_indices, dtype=np.int64)
+            np.add.at(self._center_sums, point_unique_indices, np.array(centers))
+            np.add.at(self._n_occurrences, point_unique_indices, 1)
+            np.add.at(self._counts, np.concatenate(frame_unique_indices), 1)
         
-        names = []
-        for point in self.unique_pharmacophoric_points:
-            if avg_coordinates:
-                # Normalize centroid
-                point.center /= point.count 
-            point.frequency = point.count / self.n_pharmacophores
-            # Get a unique name for each point
-            feat_num = 1
-            full_name = point.feature_name + " " + str(feat_num)
-            if full_name not in names:
-                names.append(full_name)
-                point.feature_name = full_name
+        for offset, frame_unique in enumerate(frame_unique_indices):
+            frame = self.pharmacophore_indices[start + offset]
+            for index in frame_unique:
+                self.unique_pharmacophoric_points[index].timesteps.append(frame)
+        self._refresh_unique_points()
+
+    def _refresh_unique_points(self):
+        """ Update the count, frequency and center of the unique pharmacophoric points. 
+        """
+        # Frequencies change with the number of pharmacophores, and centers with new occurrences
+        if self._averaged_coords and len(self.unique_pharmacophoric_points) > 0:
+            centers = self._center_sums / np.maximum(self._n_occurrences, 1)[:, np.newaxis]
+        else:
+            centers = self._first_centers
+        for index, unique_point in enumerate(self.unique_pharmacophoric_points):
+            unique_point.count = int(self._counts[index])
+            unique_point.frequency = unique_point.count / self.n_pharmacophores
+            unique_point.center = puw.standardize(puw.quantity(centers[index], "angstroms"))
+
+    def _get_frame_writer(self):
+        """ Get the writer that converts the frames of the trajectory to pdb text. It is
+            created the first time it is needed.
+        """
+        if self._frame_writer is None:
+            self._check_trajectory()
+            if self._trajectory_type == "file":
+                first_frame = mdt.load_frame(self._trajectory, 0, top=self._topology)
+                self._frame_writer = PDBFrameWriter.from_mdtraj(first_frame)
+            elif self._trajectory_type == "mdt":
+                self._frame_writer = PDBFrameWriter.from_mdtraj(self._trajectory)
             else:
-                while True:
-                    feat_num += 1
-                    full_name = point.feature_name + " " + str(feat_num)
-                    if full_name not in names:
-                        names.append(full_name)
-                        point.feature_name = full_name
-                        break
+                self._frame_writer = PDBFrameWriter.from_mdanalysis(self._trajectory)
+        return self._frame_writer
 
-        
-    def _pharmacophore_from_mdtraj(self, frame_num, load_mol_system=False, load_ligand=False):
-        """ Derive a pharmacophore for a single frame of an mdtraj Trajectory object.
+    def _pharmacophore_from_frame(self, frame_num, load_mol_system=False, load_ligand=False):
+        """ Derive a pharmacophore for a single frame of the trajectory.
 
             Parameters
             ----------
@@ -498,61 +1093,168 @@ class Dynophore():
             load_mol_system: bool (Default: False)
                 If true the receptor will be stored in the pharmacophore object.
             
-            load_ligand: bool (Default: True)
+            load_ligand: bool (Default: False)
                 If true the ligand will be stored in the pharmacophore object.
         """
-        # mdtraj trajectories cannot be passed to SringIO objects nor saved as string. So with this
-        # method, temporary pdb files will be created thath can be read by the StructuredBasedPharmacophore 
-        # class.
         if not isinstance(frame_num, int):
             raise TypeError("Frame number must be an integer")
-        temp_filename = "./temp" + random_string(10) + ".pdb"
-        frame = self._trajectory[frame_num]
-        frame.save_pdb(temp_filename)
-
-        # The pdb mdtraj generates needs to be edited so that pybel can read it.
-        # The third line that contains "MODEL" needs to be removed for the structured 
-        # based pharmacophore to work.
-        with open(temp_filename, "r+") as f:
-            d = f.readlines()
-            f.seek(0)
-            for i in d:
-                if  not i.startswith("MODEL"):
-                    f.write(i)
-            f.truncate()
-        pharmacophore = StructuredBasedPharmacophore.from_pdb(temp_filename, 
-            radius=1.0, ligand_id=None, hydrophobics="plip", 
-            load_mol_system=load_mol_system, load_ligand=load_ligand)
-        
-        os.remove(temp_filename)
-        return pharmacophore
-    
-    def _pharmacohore_from_mdanalysis(self, frame_num, load_mol_system=False, load_ligand=False):
-        """ Derive a pharmacophore for a single frame of an MdAnalysis Universe object.
+        coordinates = self._frame_coordinates([frame_num])[0]
+        return self._pharmacophore_from_coordinates(coordinates, load_mol_system, load_ligand)
+
+    def _pharmacophore_from_coordinates(self, coordinates, load_mol_system=False, load_ligand=False):
+        """ Derive a pharmacophore for a frame of the trajectory given its coordinates. 
 
             Parameters
-                ----------
-                frame_num: int
-                    The index number of the frame from which the pharmacophore will be derived.
-                
-                load_mol_system: bool (Default: False)
-                    If true the receptor will be stored in the pharmacophore object.
-                
-                load_ligand: bool (Default: True)
-                    If true the ligand will be stored in the pharmacophore object.
+            ----------
+            coordinates: numpy.ndarray of shape (n_atoms, 3)
+                The coordinates of the frame in angstroms.
+            
+            load_mol_system: bool (Default: False)
+                If true the receptor will be stored in the pharmacophore object.
+            
+            load_ligand: bool (Default: False)
+                If true the ligand will be stored in the pharmacophore object.
         """
-        if not isinstance(frame_num, int):
-            raise TypeError("Frame number must be an integer")
-        stream = StringIO()
-        pdb_stream = NamedStream(stream, "output.pdb")
-        atoms = self._trajectory.select_atoms("all")
-        atoms.write(pdb_stream, frames=self._trajectory.trajectory[[frame_num]])
+        pdb_stream = self._get_frame_writer().write_stream(coordinates)
         pharmacophore = StructuredBasedPharmacophore.from_pdb(pdb_stream, 
             radius=1.0, ligand_id=None, hydrophobics="plip", 
-            load_mol_system=load_mol_system, load_ligand=load_ligand)
+            load_mol_system=load_mol_system, load_ligand=load_ligand, use_cache=False)
         
         return pharmacophore
 
 
-    
-    
+def _pharmacophores_from_coordinates(writer, coordinates, load_ligand):
+    """ Derive the pharmacophores of a shard of frames of a trajectory. Used as the task 
+        of the worker processes of Dynophore.pharmacophores_from_frames.
+
+        Parameters
+        ----------
+        writer: openpharmacophore.utils.frame_writer.PDBFrameWriter
+            Writer with the topology of the trajectory.
+
+        coordinates: numpy.ndarray of shape (n_frames, n_atoms, 3)
+            The coordinates of the frames in angstroms.
+
+        load_ligand: bool
+            If true the ligand will be stored in the pharmacophores.
+
+        Returns
+        -------
+        list of tuple
+            The records of the pharmacophore of each frame.
+    """
+    records = []
+    for frame_coordinates in coordinates:
+        pharmacophore = StructuredBasedPharmacophore.from_pdb(writer.write_stream(frame_coordinates),
+            radius=1.0, ligand_id=None, hydrophobics="plip", 
+            load_mol_system=False, load_ligand=load_ligand, use_cache=False)
+        records.append(_pharmacophore_to_records(pharmacophore))
+    return records
+
+def _pharmacophore_to_records(pharmacophore):
+    """ Convert a structured based pharmacophore to plain data that can be sent 
+        between processes.
+    """
+    points = []
+    for point in pharmacophore.elements:
+        points.append((
+            point.feature_name,
+            puw.get_value(point.center, "angstroms"),
+            puw.get_value(point.radius, "angstroms"),
+            point.direction,
+            None if point.atoms_inxs is None else sorted(point.atoms_inxs),
+        ))
+    return points, pharmacophore.ligand
+
+def _pharmacophore_from_records(points, ligand):
+    """ Create a structured based pharmacophore from the plain data returned by
+        _pharmacophore_to_records.
+    """
+    elements = [
+        PharmacophoricPoint(
+            feat_type=feat_type,
+            center=puw.quantity(center, "angstroms"),
+            radius=puw.quantity(radius, "angstroms"),
+            direction=direction,
+            atoms_inxs=atoms_inxs
+        )
+        for feat_type, center, radius, direction, atoms_inxs in points
+    ]
+    return StructuredBasedPharmacophore(elements=elements, molecular_system=None, ligand=ligand)
+
+def _point_signature(point):
+    """ Get a hashable signature of a pharmacophoric point. Points with the same 
+        feature type associated with the same atoms have the same signature.
+    """
+    atoms = frozenset() if point.atoms_inxs is None else frozenset(point.atoms_inxs)
+    return point.short_name, atoms
+
+def _points_to_arrays(points):
+    """ Convert the records of a list of pharmacophoric points to arrays that can be 
+        saved to an npz file. Atom indices are stored as a flat array with offsets.
+    """
+    feature_types = []
+    centers = []
+    radii = []
+    directions = []
+    atoms = []
+    atom_offsets = [0]
+    has_atoms = []
+    for feature_name, center, radius, direction, atoms_inxs in points:
+        feature_types.append(feature_name)
+        centers.append(np.full(3, np.nan) if center is None else center)
+        radii.append(radius)
+        directions.append(np.full(3, np.nan) if direction is None else direction)
+        has_atoms.append(atoms_inxs is not None)
+        if atoms_inxs is not None:
+            atoms.extend(atoms_inxs)
+        atom_offsets.append(len(atoms))
+    return {
+        "feature_types": np.array(feature_types, dtype=str),
+        "centers": np.array(centers, dtype=float).reshape(-1, 3),
+        "radii": np.array(radii, dtype=float),
+        "directions": np.array(directions, dtype=float).reshape(-1, 3),
+        "atoms": np.array(atoms, dtype=np.int64),
+        "atom_offsets": np.array(atom_offsets, dtype=np.int64),
+        "has_atoms": np.array(has_atoms, dtype=bool),
+    }
+
+def _points_from_arrays(feature_types, centers, radii, directions, atoms, atom_offsets, has_atoms):
+    """ Get the records of a list of pharmacophoric points from the arrays returned 
+        by _points_to_arrays.
+    """
+    atoms = atoms.tolist()
+    points = []
+    for i, feature_type in enumerate(feature_types.tolist()):
+        direction = None if np.isnan(directions[i, 0]) else directions[i]
+        atoms_inxs = atoms[atom_offsets[i]:atom_offsets[i + 1]] if has_atoms[i] else None
+        points.append((feature_type, centers[i], float(radii[i]), direction, atoms_inxs))
+    return points
+
+def _ligands_to_arrays(ligands):
+    """ Store the conformations of a ligand as a template molecule without conformers
+        and an array with the coordinates of each conformation.
+    """
+    template = Chem.Mol(ligands[0])
+    template.RemoveAllConformers()
+    n_atoms = template.GetNumAtoms()
+    if any(ligand.GetNumAtoms() != n_atoms for ligand in ligands):
+        raise ValueError("The ligands of all the pharmacophores must have the same atoms")
+    return {
+        "ligand_template": np.frombuffer(template.ToBinary(), dtype=np.uint8),
+        "ligand_coordinates": np.array([ligand.GetConformer().GetPositions() for ligand in ligands]),
+    }
+
+def _ligands_from_arrays(template, coordinates):
+    """ Get the ligands stored by _ligands_to_arrays.
+    """
+    template = template.tobytes()
+    ligands = []
+    for ligand_coordinates in coordinates:
+        ligand = Chem.Mol(template)
+        conformer = Chem.Conformer(ligand.GetNumAtoms())
+        for index, position in enumerate(ligand_coordinates.tolist()):
+            conformer.SetAtomPosition(index, Point3D(*position))
+        ligand.AddConformer(conformer, assignId=True)
+        ligands.append(ligand)
+    return ligands
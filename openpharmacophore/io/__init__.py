@@ -3,4 +3,5 @@ from .pharmer import from_pharmer, to_pharmer
 from .moe import from_moe, to_moe
 from .pharmagist import read_pharmagist, to_pharmagist
 from .mol2 import load_mol2_file
+from .molecules_file import load_molecules_file, load_molecules_files
 
@@ -0,0 +1,185 @@
+from rdkit import Chem
+from concurrent.futures import ProcessPoolExecutor
+import bz2
+import collections
+import gzip
+import itertools
+import lzma
+import os
+
+# Functions that open each type of compressed file
+_openers = {
+    "gz": gzip.open,
+    "bz2": bz2.open,
+    "xz": lzma.open,
+}
+
+def molecules_file_format(file_name):
+    """ Get the format and the compression of a file of molecules.
+
+        Parameters
+        ----------
+        file_name: str
+            Name of the file, such as mols.smi or mols.sdf.gz.
+
+        Returns
+        -------
+        file_format: str
+            The extension of the format of the file.
+
+        compression: str or None
+            The extension of the compression of the file. None if it's not compressed.
+    """
+    extensions = os.path.basename(file_name).split(".")
+    compression = None
+    if len(extensions) > 2 and extensions[-1] in _openers:
+        compression = extensions.pop()
+    return extensions[-1], compression
+
+def open_molecules_file(file_name, mode="rt"):
+    """ Open a file that may be compressed with gzip, bz2 or xz. The file is
+        decompressed on the fly as it's read.
+
+        Parameters
+        ----------
+        file_name: str
+            Name of the file.
+
+        mode: str
+            Mode in which the file is opened, "rt" for text and "rb" for binary. (Default: "rt")
+
+        Returns
+        -------
+        file object
+    """
+    _, compression = molecules_file_format(file_name)
+    if compression is None:
+        return open(file_name, mode)
+    return _openers[compression](file_name, mode)
+
+def iter_molecules(file_name, delimiter=" ", titleLine=True, chunk_size=10000):
+    """ Iterate over the molecules of a file without loading the whole file. Compressed
+        files are decompressed on the fly.
+
+        Parameters
+        ----------
+        file_name: str
+            Name of the file. Format can be smi, mol2 or sdf, optionally compressed with
+            gzip, bz2 or xz.
+
+        delimiter: str
+            Delimiter of the columns of smi files. (Default: " ")
+
+        titleLine: bool
+            Whether the first line of smi files is a header. (Default: True)
+
+        chunk_size: int
+            Number of lines of smi files parsed at a time. (Default: 10000)
+
+        Yields
+        ------
+        rdkit.Chem.Mol or None
+            The molecules. None for molecules that couldn't be parsed.
+    """
+    file_format, _ = molecules_file_format(file_name)
+    if file_format == "smi":
+        with open_molecules_file(file_name, "rt") as f:
+            header = f.readline() if titleLine else ""
+            while True:
+                lines = list(itertools.islice(f, chunk_size))
+                if len(lines) == 0:
+                    break
+                # The header is passed with every chunk so the column names are kept
+                text = header + "".join(lines)
+                yield from Chem.SmilesMolSupplierFromText(text, delimiter=delimiter, titleLine=titleLine)
+    elif file_format == "sdf":
+        with open_molecules_file(file_name, "rb") as f:
+            yield from Chem.ForwardSDMolSupplier(f)
+    elif file_format == "mol2":
+        with open_molecules_file(file_name, "rt") as f:
+            yield from _iter_mol2_blocks(f)
+    else:
+        raise NotImplementedError
+
+def load_molecules_file(file_name, **kwargs):
+    """ Load the molecules of a file. Compressed files are decompressed on the fly.
+
+        Parameters
+        ----------
+        file_name: str
+            Name of the file. Format can be smi, mol2 or sdf, optionally compressed with
+            gzip, bz2 or xz.
+
+        kwargs:
+            Arguments passed to iter_molecules, such as delimiter or titleLine.
+
+        Returns
+        -------
+        list of rdkit.Chem.Mol
+            The molecules that could be parsed.
+    """
+    return [molecule for molecule in iter_molecules(file_name, **kwargs) if molecule is not None]
+
+def load_molecules_files(file_names, n_workers=1, **kwargs):
+    """ Load the molecules of several files. Files can be decompressed and parsed in
+        parallel, with at most n_workers files loaded ahead of the caller.
+
+        Parameters
+        ----------
+        file_names: list of str
+            Names of the files.
+
+        n_workers: int (optional)
+            Number of processes. If None the number of processors of the machine is used.
+            (Default: 1)
+
+        kwargs:
+            Arguments passed to iter_molecules, such as delimiter or titleLine.
+
+        Yields
+        ------
+        file_name: str
+            The name of the file.
+
+        molecules: list of rdkit.Chem.Mol
+            The molecules of the file, in the same order as the files.
+    """
+    if n_workers is None:
+        n_workers = os.cpu_count()
+
+    if n_workers <= 1 or len(file_names) <= 1:
+        for file_name in file_names:
+            yield file_name, load_molecules_file(file_name, **kwargs)
+        return
+
+    with ProcessPoolExecutor(max_workers=n_workers, initializer=_init_worker) as executor:
+        # Only a few files are loaded ahead of the caller, so the molecules of the whole
+        # database are never held in memory at the same time
+        pending = collections.deque()
+        for file_name in file_names:
+            if len(pending) == n_workers:
+                done_name, future = pending.popleft()
+                yield done_name, future.result()
+            pending.append((file_name, executor.submit(load_molecules_file, file_name, **kwargs)))
+        while pending:
+            done_name, future = pending.popleft()
+            yield done_name, future.result()
+
+def _init_worker():
+    """ Keep the properties of the molecules, such as their names, when they are sent
+        back from the worker processes.
+    """
+    Chem.SetDefaultPickleProperties(Chem.PropertyPickleOptions.AllProps)
+
+def _iter_mol2_blocks(f):
+    """ Iterate over the molecules of an open mol2 file.
+    """
+    block = []
+    for line in f:
+        if "@<TRIPOS>MOLECULE" in line and len(block) > 0:
+            yield Chem.MolFromMol2Block("".join(block))
+            block = []
+        if len(block) > 0 or "@<TRIPOS>MOLECULE" in line:
+            block.append(line)
+    if len(block) > 0:
+        yield Chem.MolFromMol2Block("".join(block))
@@ -2,12 +2,13 @@ from openpharmacophore import Pharmacophore
 from openpharmacophore._private_tools.exceptions import InvalidFileFormat, OpenPharmacophoreException
 from openpharmacophore.utils.ligand_features import ligands_pharmacophoric_points
 from openpharmacophore.visualization.view_ligands import view_ligands
-from openpharmacophore.algorithms.dbscan import dbscan_pharmacophore
+from openpharmacophore.algorithms.dbscan import dbscan_pharmacophore, dbscan_parameter_sweep
 from openpharmacophore.io.mol2 import load_mol2_file
 from openpharmacophore.color_palettes import get_color_from_palette_for_feature
 from rdkit import Chem
 from rdkit.Chem.Draw import rdMolDraw2D
 import nglview as nv
+import pandas as pd
 from collections import defaultdict
 import copy
 from io import BytesIO
@@ -193,6 +194,81 @@ class LigandBasedPharmacophore(Pharmacophore):
 
         return cls(elements=points, ligands=ligands, feat_def=feat_def)
 
+    @classmethod
+    def parameter_sweep(cls, ligands, method="dbscan", eps=(2,), min_samples=(0.75,), radius=(1,), 
+                        feat_lists=None, feat_def=None, scoring_fn=None, n_workers=None):
+        """ Class method to derive pharmacophore models from a list of ligands for every combination
+            of a grid of parameters. 
+
+            The ligands are aligned and their features extracted only once, so the cost of the sweep is
+            close to that of a single model plus the clustering time of each combination.
+
+        Parameters
+        ----------
+        ligands: :obj: list of rdkit.Chem.rdchem.Mol
+            List of ligands
+        
+        method: str
+            Name of method or algorithm to derive the ligand based pharmacophore. (Default: "dbscan")
+
+        eps: list of float (optional)
+            Values of the maximum distance between two pharmacophoric points for one to be considered 
+            as in the neighborhood of the other. (Default: (2,))
+
+        min_samples: list of float (optional)
+            Values of the percentage of ligands that must contain a pharmacophoric point to be considered
+            as a core point. (Default: (0.75,))
+
+        radius: list of float (optional)
+            Values of the radius of the parmacohporic points. (Default: (1,))
+        
+        feat_lists: list of list of str (optional)
+            Lists of features that will be used to derive the pharmacophores. If None is passed the
+            default features will be used.
+        
+        feat_def: dict (optional)
+            Definitions of the pharmacophoric points. Dictionary which keys are SMARTS strings and 
+            values are feature names. If None is passed the default rdkit definition will be used.
+
+        scoring_fn: callable (optional)
+            Function that receives a pharmacophore and returns a score, for example a metric of a
+            retrospective screening. If passed the results are sorted by descending score.
+
+        n_workers: int (optional)
+            Number of processes used for clustering. If None the number of processors of the 
+            machine is used.
+
+        Returns
+        -------
+        pandas.DataFrame
+            Dataframe with the columns eps, min_samples, radius, feat_list and pharmacophore, and a
+            score column if a scoring function was passed.
+
+        """
+        if not isinstance(ligands, list):
+            raise TypeError("Ligands must be of type list")
+
+        if method == "dbscan":
+            results, aligned_ligands = dbscan_parameter_sweep(ligands, eps=eps, min_samples=min_samples,
+                                                              radius=radius, feat_lists=feat_lists,
+                                                              feat_def=feat_def, n_workers=n_workers)
+        else:
+            raise NotImplementedError
+
+        rows = []
+        for parameters, points in results:
+            row = dict(parameters)
+            row["pharmacophore"] = cls(elements=points, ligands=aligned_ligands, feat_def=feat_def)
+            if scoring_fn is not None:
+                row["score"] = scoring_fn(row["pharmacophore"])
+            rows.append(row)
+        
+        sweep = pd.DataFrame(rows)
+        if scoring_fn is not None:
+            sweep.sort_values(by=["score"], ascending=False, inplace=True)
+            sweep.reset_index(drop=True, inplace=True)
+        return sweep
+
     @classmethod
     def from_ligand_file(cls, file_name, method, radius=1, feat_list=None, feat_def=None):
         """ Compute pharmacophore from a file of ligands
@@ -2,9 +2,99 @@
 ## model. The functions in this file are called by the VirtualScreening3D and 
 ## RetrospectiveScreening3D classes
 
-from rdkit import Geometry
-from rdkit.Chem import rdMolTransforms
+from openpharmacophore.utils.conformer_cache import copy_conformers, to_canonical_order
+from rdkit import Chem, Geometry, RDConfig
+from rdkit.Chem import ChemicalFeatures, rdDistGeom, rdMolTransforms
+from rdkit.Chem.Pharm3D import EmbedLib
 from rdkit.Numerics import rdAlignment
+from operator import itemgetter
+import os
+
+_feature_factory = None
+
+def get_feature_factory():
+    """ Get the rdkit feature factory with the base feature definitions. It is built 
+        once per process.
+
+        Returns
+        -------
+        rdkit.Chem.rdMolChemicalFeatures.MolChemicalFeatureFactory
+    """
+    global _feature_factory
+    if _feature_factory is None:
+        fdef = os.path.join(RDConfig.RDDataDir, 'BaseFeatures.fdef')
+        _feature_factory = ChemicalFeatures.BuildFeatureFactory(fdef)
+    return _feature_factory
+
+
+class PreparedMolecule():
+    """ A molecule together with the data needed to align it to any pharmacophore. The
+        bounds matrix and the chemical features of the molecule are computed once, so 
+        the molecule can be aligned to many pharmacophores without recomputing them.
+
+    Parameters
+    ----------
+    molecule: rdkit.Chem.Mol
+        The molecule.
+
+    feat_factory: rdkit.Chem.rdMolChemicalFeatures.MolChemicalFeatureFactory (optional)
+        Factory used to find the chemical features. If None the base feature definitions
+        of rdkit are used.
+
+    Attributes
+    ----------
+    molecule: rdkit.Chem.Mol
+        The molecule.
+
+    bounds_matrix: numpy.ndarray
+        The bounds matrix of the molecule.
+
+    features: dict of str to list
+        The chemical features of the molecule grouped by family.
+
+    """
+    def __init__(self, molecule, feat_factory=None):
+        if feat_factory is None:
+            feat_factory = get_feature_factory()
+        self.molecule = molecule
+        self.bounds_matrix = rdDistGeom.GetMoleculeBoundsMatrix(molecule)
+        self.features = {}
+        for feature in feat_factory.GetFeaturesForMol(molecule):
+            self.features.setdefault(feature.GetFamily(), []).append(feature)
+        self._molecule_h = None
+
+    @property
+    def molecule_h(self):
+        """ The molecule with explicit hydrogens. It is created the first time it is needed.
+        """
+        if self._molecule_h is None:
+            self._molecule_h = Chem.AddHs(self.molecule)
+        return self._molecule_h
+
+    def match_features(self, pharmacophore):
+        """ Get the chemical features of the molecule that can match each feature of 
+            a pharmacophore. Equivalent to rdkit.Chem.Pharm3D.EmbedLib.MatchPharmacophoreToMol.
+
+            Parameters
+            ----------
+            pharmacophore: rdkit.Chem.Pharm3D.Pharmacophore
+                The pharmacophore.
+
+            Returns
+            -------
+            can_match: bool
+                Whether the molecule has features of every family of the pharmacophore.
+
+            all_matches: list of list
+                The features of the molecule that match each feature of the pharmacophore.
+        """
+        all_matches = []
+        for feature in pharmacophore.getFeatures():
+            matches = self.features.get(feature.GetFamily(), [])
+            if len(matches) == 0:
+                return False, None
+            all_matches.append(matches)
+        return True, all_matches
 
 def apply_radii_to_bounds(radii, pharmacophore):
     """
@@ -101,3 +191,120 @@ def transform_embeddings(pharmacophore, embeddings, atom_match):
         ssds.append(ssd)
     
     return ssds
+
+
+def embed_pharmacophore(molecule, atom_match, pharmacophore, count=10, cache=None):
+
+    """Embed a molecule onto a pharmacophore, reusing cached embeddings if available.
+
+        Parameters
+        ----------
+        molecule: rdkit.Chem.Mol
+            The molecule with explicit hydrogens.
+
+        atom_match: list of list
+            List of list of atoms ids that match the pharmacophore.
+
+        pharmacophore: rdkit.Chem.Pharm3D.Pharmacophore
+            A pharmacophore object.
+
+        count: int
+            Number of embeddings that will be generated.
+
+        cache: openpharmacophore.utils.conformer_cache.ConformerCache (optional)
+            Cache where embeddings are looked up and stored.
+
+        Returns
+        -------
+        embeddings: list of rdkit.Chem.Mol
+            List of molecules with a single conformer.
+
+        """
+    if cache is None:
+        _, embeddings, _ = EmbedLib.EmbedPharmacophore(molecule, atom_match, pharmacophore, count=count)
+        return embeddings
+
+    ranks = cache.canonical_ranks(molecule)
+    n_features = len(atom_match)
+    bounds = [
+        [round(pharmacophore.getLowerBound(i, j), 4), round(pharmacophore.getUpperBound(i, j), 4)]
+        for i in range(n_features) for j in range(i + 1, n_features)
+    ]
+    # Atom ids are stored as canonical ranks so the key doesn't depend on the atom order
+    canonical_match = [sorted(ranks[idx] for idx in match_ids) for match_ids in atom_match]
+    key = cache.key(molecule, method="EmbedPharmacophore", atom_match=canonical_match, 
+                    bounds=bounds, count=count)
+    ensemble = cache.get(key)
+    if ensemble is None:
+        canonical_molecule = to_canonical_order(molecule, ranks)
+        canonical_atom_match = [[ranks[idx] for idx in match_ids] for match_ids in atom_match]
+        _, canonical_embeddings, _ = EmbedLib.EmbedPharmacophore(canonical_molecule, canonical_atom_match, 
+                                                                 pharmacophore, count=count)
+        ensemble = Chem.Mol(canonical_molecule)
+        ensemble.RemoveAllConformers()
+        for embedding in canonical_embeddings:
+            ensemble.AddConformer(embedding.GetConformer(), assignId=True)
+        cache.put(key, ensemble)
+
+    embeddings = []
+    for conformer in ensemble.GetConformers():
+        single_conformer = Chem.Mol(ensemble, confId=conformer.GetId())
+        embedding = Chem.Mol(molecule)
+        embedding.RemoveAllConformers()
+        copy_conformers(single_conformer, embedding, ranks)
+        embeddings.append(embedding)
+    
+    return embeddings
+
+def align_prepared_molecule(prepared_molecule, pharmacophore, count=10, cache=None):
+    """ Align a molecule to a pharmacophore. 
+
+        Parameters
+        ----------
+        prepared_molecule: PreparedMolecule
+            The molecule.
+
+        pharmacophore: rdkit.Chem.Pharm3D.Pharmacophore
+            A pharmacophore object with the radii already applied to its bounds.
+
+        count: int
+            Number of embeddings that will be generated.
+
+        cache: openpharmacophore.utils.conformer_cache.ConformerCache (optional)
+            Cache where embeddings are looked up and stored.
+
+        Returns
+        -------
+        ssd: float or None
+            SSD value of the best alignment. None if the molecule doesn't match the 
+            pharmacophore.
+
+        embedding: rdkit.Chem.Mol or None
+            The molecule aligned to the pharmacophore, with explicit hydrogens.
+    """
+    # Check if the molecule features can match with the pharmacophore.
+    can_match, all_matches = prepared_molecule.match_features(pharmacophore)
+    if not can_match:
+        return None, None
+    # Match the molecule to the pharmacophore without aligning it
+    failed, _, matched_mols, _ = EmbedLib.MatchPharmacophore(all_matches, 
+                                                             prepared_molecule.bounds_matrix,
+                                                             pharmacophore, 
+                                                             useDownsampling=True)
+    if failed:
+        return None, None
+    atom_match = [list(x.GetAtomIds()) for x in matched_mols]
+    try:
+        # Embed molecule onto the pharmacophore
+        # embeddings is a list of molecules with a single conformer
+        embeddings = embed_pharmacophore(prepared_molecule.molecule_h, atom_match, pharmacophore, 
+                                         count=count, cache=cache)
+    except Exception:
+        # Bounds smoothing failed
+        return None, None
+    if len(embeddings) == 0:
+        return None, None
+    # Align embeddings to the pharmacophore 
+    SSDs = transform_embeddings(pharmacophore, embeddings, atom_match) 
+    best_fit_index = min(enumerate(SSDs), key=itemgetter(1))[0]
+    return SSDs[best_fit_index], embeddings[best_fit_index]
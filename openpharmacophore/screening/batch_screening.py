@@ -0,0 +1,249 @@
+## This file contains functions to screen a set of molecules against several pharmacophores
+## at once. Each molecule is prepared a single time and then aligned to every pharmacophore,
+## or compared with every pharmacophore fingerprint.
+
+from openpharmacophore.screening.alignment import (apply_radii_to_bounds, align_prepared_molecule,
+    get_feature_factory, PreparedMolecule)
+from openpharmacophore.utils.conformer_cache import get_default_cache
+import numpy as np
+from rdkit import Chem, DataStructs, RDLogger
+from rdkit.Chem.Pharm2D import Gobbi_Pharm2D
+from rdkit.Chem.Pharm2D.Generate import Gen2DFingerprint
+from concurrent.futures import ProcessPoolExecutor
+import os
+
+RDLogger.DisableLog('rdApp.*') # Disable rdkit warnings
+
+# Pharmacophores and cache of the worker processes, set once per process by _init_worker
+_worker_pharmacophores = None
+_worker_cache = None
+# Query fingerprints and similarity of the worker processes, set by _init_fingerprint_worker
+_worker_fingerprints = None
+_worker_similarity = None
+
+_similarity_functions = {
+    "tanimoto": DataStructs.BulkTanimotoSimilarity,
+    "dice": DataStructs.BulkDiceSimilarity,
+}
+
+def labelled_molecules(actives, inactives):
+    """ Parse a set of active and inactive molecules. Smiles that can't be parsed are skipped.
+
+        Parameters
+        ----------
+        actives: 2-tuple
+            The first element is a list of the active compounds ids, and
+            the second elment is a list of smiles for the active compounds.
+
+        inactives: 2-tuple
+            The first element is a list of the inactive compounds ids, and
+            the second elment is a list of smiles for the inactive compounds.
+
+        Returns
+        -------
+        molecules: list of rdkit.Chem.Mol
+            The molecules. Their ids are stored in the _Name property.
+
+        ids: list
+            The id of each molecule.
+
+        labels: numpy.ndarray of bool
+            True for active molecules and false for inactive ones.
+    """
+    molecules = []
+    ids = []
+    labels = []
+    for (mol_ids, smiles_list), label in ((actives, True), (inactives, False)):
+        for mol_id, smiles in zip(mol_ids, smiles_list):
+            molecule = Chem.MolFromSmiles(smiles)
+            if molecule is None:
+                continue
+            molecule.SetProp("_Name", str(mol_id))
+            molecules.append(molecule)
+            ids.append(mol_id)
+            labels.append(label)
+    return molecules, ids, np.array(labels, dtype=bool)
+
+def screen_pharmacophores(pharmacophores, molecules, n_workers=1, chunk_size=32, use_cache=True,
+                          return_embeddings=False):
+    """ Align a set of molecules to several pharmacophores.
+
+        The bounds matrix and the chemical features of each molecule are computed once and
+        shared by all the pharmacophores. When more than one worker is used the molecules are
+        split in chunks that are processed in parallel, and the pharmacophores are sent only
+        once to each worker.
+
+        Parameters
+        ----------
+        pharmacophores: list of openpharmacophore.Pharmacophore
+            The pharmacophores.
+
+        molecules: list of rdkit.Chem.Mol
+            The molecules that will be screened.
+
+        n_workers: int (optional)
+            Number of processes. If None the number of processors of the machine is used.
+            (Default: 1)
+
+        chunk_size: int
+            Number of molecules sent to a worker at a time. (Default: 32)
+
+        use_cache: bool
+            If true the embeddings of the molecules are taken from the default conformer cache.
+            (Default: True)
+
+        return_embeddings: bool
+            If true the aligned molecules are returned as well. (Default: False)
+
+        Returns
+        -------
+        scores: numpy.ndarray of shape (n_pharmacophores, n_molecules)
+            SSD value of the best alignment of each molecule to each pharmacophore. NaN if
+            the molecule doesn't match the pharmacophore.
+
+        embeddings: list of list of rdkit.Chem.Mol
+            Only returned if return_embeddings is true. The aligned molecule for each
+            pharmacophore and molecule, None if it doesn't match.
+    """
+    rdkit_pharmacophores = []
+    for pharmacophore in pharmacophores:
+        rdkit_pharmacophore, radii = pharmacophore.to_rdkit()
+        apply_radii_to_bounds(radii, rdkit_pharmacophore)
+        rdkit_pharmacophores.append(rdkit_pharmacophore)
+
+    if n_workers is None:
+        n_workers = os.cpu_count()
+
+    if n_workers <= 1 or len(molecules) <= chunk_size:
+        _init_worker(rdkit_pharmacophores, use_cache)
+        try:
+            scores, embeddings = _align_chunk(molecules, return_embeddings)
+        finally:
+            _init_worker(None, False)
+    else:
+        chunks = [molecules[i:i + chunk_size] for i in range(0, len(molecules), chunk_size)]
+        with ProcessPoolExecutor(max_workers=n_workers, initializer=_init_worker,
+                                 initargs=(rdkit_pharmacophores, use_cache)) as executor:
+            results = list(executor.map(_align_chunk, chunks, [return_embeddings] * len(chunks)))
+        scores = np.concatenate([chunk_scores for chunk_scores, _ in results], axis=1)
+        embeddings = None
+        if return_embeddings:
+            embeddings = [
+                [embedding for _, chunk_embeddings in results for embedding in chunk_embeddings[i]]
+                for i in range(len(rdkit_pharmacophores))
+            ]
+
+    if return_embeddings:
+        return scores, embeddings
+    return scores
+
+def _init_worker(rdkit_pharmacophores, use_cache):
+    """ Store the pharmacophores in the process that aligns the molecules.
+    """
+    global _worker_pharmacophores, _worker_cache
+    _worker_pharmacophores = rdkit_pharmacophores
+    _worker_cache = get_default_cache() if use_cache else None
+
+def _align_chunk(molecules, return_embeddings=False):
+    """ Align a chunk of molecules to the pharmacophores of the worker.
+
+        Returns
+        -------
+        scores: numpy.ndarray of shape (n_pharmacophores, n_molecules)
+
+        embeddings: list of list of rdkit.Chem.Mol or None
+    """
+    feat_factory = get_feature_factory()
+    scores = np.full((len(_worker_pharmacophores), len(molecules)), np.nan)
+    embeddings = [[None] * len(molecules) for _ in _worker_pharmacophores] if return_embeddings else None
+    for j, molecule in enumerate(molecules):
+        prepared_molecule = PreparedMolecule(molecule, feat_factory)
+        for i, pharmacophore in enumerate(_worker_pharmacophores):
+            ssd, embedding = align_prepared_molecule(prepared_molecule, pharmacophore, cache=_worker_cache)
+            if ssd is None:
+                continue
+            scores[i, j] = ssd
+            if return_embeddings:
+                embeddings[i][j] = embedding
+    return scores, embeddings
+
+def pharmacophore_fingerprint(molecule):
+    """ Get the 2D pharmacophore fingerprint of a molecule with the Gobbi feature definitions.
+
+        Parameters
+        ----------
+        molecule: rdkit.Chem.Mol
+            The molecule.
+
+        Returns
+        -------
+        rdkit.DataStructs.SparseBitVect
+    """
+    return Gen2DFingerprint(molecule, Gobbi_Pharm2D.factory)
+
+def screen_fingerprints(fingerprints, molecules, similarity="tanimoto", n_workers=1, chunk_size=256):
+    """ Compute the similarity of a set of molecules to several pharmacophore fingerprints.
+
+        The fingerprint of each molecule is computed once and compared with all the query
+        fingerprints. When more than one worker is used the molecules are split in chunks
+        that are processed in parallel.
+
+        Parameters
+        ----------
+        fingerprints: list of rdkit.DataStructs.SparseBitVect
+            The query pharmacophore fingerprints.
+
+        molecules: list of rdkit.Chem.Mol
+            The molecules that will be screened.
+
+        similarity: str
+            Similarity measure. Can be "tanimoto" or "dice". (Default: "tanimoto")
+
+        n_workers: int (optional)
+            Number of processes. If None the number of processors of the machine is used.
+            (Default: 1)
+
+        chunk_size: int
+            Number of molecules sent to a worker at a time. (Default: 256)
+
+        Returns
+        -------
+        numpy.ndarray of shape (n_fingerprints, n_molecules)
+            The similarity of each molecule to each query fingerprint.
+    """
+    if similarity not in _similarity_functions:
+        raise NotImplementedError(f"Similarity {similarity} is not supported")
+
+    if n_workers is None:
+        n_workers = os.cpu_count()
+
+    if n_workers <= 1 or len(molecules) <= chunk_size:
+        _init_fingerprint_worker(fingerprints, similarity)
+        try:
+            return _fingerprint_chunk(molecules)
+        finally:
+            _init_fingerprint_worker(None, None)
+    
+    chunks = [molecules[i:i + chunk_size] for i in range(0, len(molecules), chunk_size)]
+    with ProcessPoolExecutor(max_workers=n_workers, initializer=_init_fingerprint_worker,
+                             initargs=(fingerprints, similarity)) as executor:
+        results = list(executor.map(_fingerprint_chunk, chunks))
+    return np.concatenate(results, axis=1)
+
+def _init_fingerprint_worker(fingerprints, similarity):
+    """ Store the query fingerprints in the process that computes the similarities.
+    """
+    global _worker_fingerprints, _worker_similarity
+    _worker_fingerprints = fingerprints
+    _worker_similarity = similarity
+
+def _fingerprint_chunk(molecules):
+    """ Compute the similarity of a chunk of molecules to the query fingerprints of the worker.
+    """
+    similarity_fn = _similarity_functions[_worker_similarity]
+    molecule_fingerprints = [pharmacophore_fingerprint(molecule) for molecule in molecules]
+    similarities = np.zeros((len(_worker_fingerprints), len(molecules)))
+    for i, fingerprint in enumerate(_worker_fingerprints):
+        if len(molecule_fingerprints) > 0:
+            similarities[i] = similarity_fn(fingerprint, molecule_fingerprints)
+    return similarities
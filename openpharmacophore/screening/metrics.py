@@ -0,0 +1,252 @@
+## This file contains the metrics used to validate pharmacophore models with retrospective
+## screening. All of them are computed from an array of scores and an array of labels
+## (True for actives) with a single sort, so they remain fast for millions of molecules.
+
+import numpy as np
+
+class RankedScreen():
+    """ Molecules of a retrospective screen sorted from best to worst score.
+
+        The molecules are sorted once and every metric is computed from cumulative sums over
+        the sorted labels. Molecules without a score, for example because they don't match
+        the pharmacophore, are ranked last. Molecules with the same score are tied, and the
+        actives of a group of tied molecules are spread evenly over its ranks, so the metrics
+        don't depend on the order of the input.
+
+    Parameters
+    ----------
+    scores: array-like of float
+        The score of each molecule. NaN for molecules without a score.
+
+    labels: array-like of bool
+        True for active molecules and False for inactive ones.
+
+    higher_is_better: bool
+        Whether higher scores are better, as with similarity, or worse, as with SSD.
+        (Default: True)
+
+    """
+    def __init__(self, scores, labels, higher_is_better=True):
+        scores = np.asarray(scores, dtype=float)
+        labels = np.asarray(labels, dtype=bool)
+        if scores.shape != labels.shape or scores.ndim != 1:
+            raise ValueError("Scores and labels must be one dimensional arrays of the same length")
+        if not higher_is_better:
+            scores = -scores
+        # Molecules without a score are ranked last
+        scores = np.where(np.isnan(scores), -np.inf, scores)
+        self._order = np.argsort(-scores, kind="stable")
+        self.labels = labels[self._order]
+        # Index of the last molecule of each group of tied scores
+        sorted_scores = scores[self._order]
+        self._group_ends = np.append(np.flatnonzero(sorted_scores[1:] != sorted_scores[:-1]),
+                                     sorted_scores.shape[0] - 1)
+        # Group of tied scores of each molecule
+        self._groups = np.searchsorted(self._group_ends, np.arange(sorted_scores.shape[0]))
+        self.n_molecules = labels.shape[0]
+        self.n_actives = int(np.count_nonzero(labels))
+        self.n_inactives = self.n_molecules - self.n_actives
+
+    def _weights(self, weights):
+        """ Get the weight of each molecule in ranked order. Used for bootstrapping, where
+            the weight is the number of times a molecule is sampled.
+        """
+        if weights is None:
+            return np.ones(self.n_molecules)
+        return np.asarray(weights, dtype=float)[self._order]
+
+    def _tied_labels(self, weights):
+        """ Get the expected fraction of active weight of each molecule in ranked order
+            when the molecules of each group of tied scores are shuffled. It is the fraction
+            of actives of the group the molecule belongs to.
+        """
+        group_actives = np.bincount(self._groups, weights=weights * self.labels)
+        group_weights = np.bincount(self._groups, weights=weights)
+        fraction = np.divide(group_actives, group_weights,
+                             out=np.zeros_like(group_weights), where=group_weights > 0)
+        return fraction[self._groups]
+
+    def roc_curve(self, weights=None):
+        """ Get the receiver operating characteristic curve.
+
+            Parameters
+            ----------
+            weights: array-like of float (optional)
+                Weight of each molecule, in the original order.
+
+            Returns
+            -------
+            fpr: numpy.ndarray
+                False positive rate at each score threshold.
+
+            tpr: numpy.ndarray
+                True positive rate at each score threshold.
+        """
+        weights = self._weights(weights)
+        true_positives = np.concatenate([[0], np.cumsum(weights * self.labels)[self._group_ends]])
+        false_positives = np.concatenate([[0], np.cumsum(weights * ~self.labels)[self._group_ends]])
+        with np.errstate(divide="ignore", invalid="ignore"):
+            tpr = true_positives / true_positives[-1]
+            fpr = false_positives / false_positives[-1]
+        return fpr, tpr
+
+    def auc(self, weights=None):
+        """ Get the area under the ROC curve. Ties count as half a correct ranking.
+
+            Parameters
+            ----------
+            weights: array-like of float (optional)
+                Weight of each molecule, in the original order.
+
+            Returns
+            -------
+            float
+        """
+        fpr, tpr = self.roc_curve(weights)
+        return float(np.sum(np.diff(fpr) * (tpr[1:] + tpr[:-1]) / 2))
+
+    def enrichment_curve(self, weights=None):
+        """ Get the fraction of actives found as a function of the fraction of the
+            database screened.
+
+            Parameters
+            ----------
+            weights: array-like of float (optional)
+                Weight of each molecule, in the original order.
+
+            Returns
+            -------
+            screened: numpy.ndarray
+                Fraction of the database screened.
+
+            found: numpy.ndarray
+                Fraction of the actives found.
+        """
+        weights = self._weights(weights)
+        screened = np.concatenate([[0], np.cumsum(weights)])
+        found = np.concatenate([[0], np.cumsum(weights * self._tied_labels(weights))])
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return screened / screened[-1], found / found[-1]
+
+    def enrichment_factor(self, fractions=0.01, weights=None):
+        """ Get the enrichment factor at one or more fractions of the screened database.
+
+            Parameters
+            ----------
+            fractions: float or array-like of float
+                Fractions of the database, between 0 and 1. (Default: 0.01)
+
+            weights: array-like of float (optional)
+                Weight of each molecule, in the original order.
+
+            Returns
+            -------
+            float or numpy.ndarray
+                The enrichment factor at each fraction.
+        """
+        fractions = np.asarray(fractions, dtype=float)
+        if np.any(fractions <= 0) or np.any(fractions > 1):
+            raise ValueError("Fractions must be numbers between 0 and 1")
+        weights = self._weights(weights)
+        labels = self._tied_labels(weights)
+        screened = np.cumsum(weights)
+        found = np.cumsum(weights * labels)
+        n_molecules, n_actives = screened[-1], found[-1]
+        # Number of molecules of the top fraction of the database
+        n_selected = np.maximum(np.ceil(fractions * n_molecules), 1)
+        # Molecules up to the last one that fits completely in the selection. When weights
+        # are used, only part of the weight of the next molecule may fit.
+        n_complete = np.searchsorted(screened, n_selected, side="right")
+        screened = np.concatenate([[0], screened])
+        found = np.concatenate([[0], found])
+        next_label = np.append(labels, 0)[n_complete]
+        actives_found = found[n_complete] + (n_selected - screened[n_complete]) * next_label
+        with np.errstate(divide="ignore", invalid="ignore"):
+            enrichment = (actives_found / n_actives) / (n_selected / n_molecules)
+        return float(enrichment) if enrichment.ndim == 0 else enrichment
+
+    def bedroc(self, alpha=20.0, weights=None):
+        """ Get the Boltzmann-enhanced discrimination of ROC.
+
+            See: Truchon, Jean-François, and Christopher I. Bayly. "Evaluating virtual screening
+            methods: good and bad metrics for the 'early recognition' problem." Journal of
+            chemical information and modeling 47, no. 2 (2007): 488-508.
+
+            Parameters
+            ----------
+            alpha: float
+                Early recognition parameter. (Default: 20.0)
+
+            weights: array-like of float (optional)
+                Weight of each molecule, in the original order.
+
+            Returns
+            -------
+            float
+        """
+        weights = self._weights(weights)
+        n_molecules = weights.sum()
+        n_actives = (weights * self.labels).sum()
+        if n_actives == 0 or n_actives == n_molecules:
+            return np.nan
+        # A molecule with weight w occupies w consecutive ranks starting at first_rank. The sum
+        # of exp(-alpha * rank / N) over those ranks is a geometric series.
+        first_rank = np.cumsum(weights) - weights + 1
+        step = alpha / n_molecules
+        rank_sums = np.exp(-step * first_rank) * -np.expm1(-step * weights) / -np.expm1(-step)
+        ratio = n_actives / n_molecules
+        # Tied actives are spread over the ranks of their group
+        rie = (np.sum(rank_sums * self._tied_labels(weights)) / n_actives) / (
+            (1 / n_molecules) * -np.expm1(-alpha) / np.expm1(step))
+        return float(
+            rie * ratio * np.sinh(alpha / 2) / (np.cosh(alpha / 2) - np.cosh(alpha / 2 - alpha * ratio))
+            + 1 / (1 - np.exp(alpha * (1 - ratio)))
+        )
+
+    def bootstrap(self, metric, n_bootstrap=1000, confidence=0.95, random_state=None, **kwargs):
+        """ Get a bootstrapped confidence interval of a metric.
+
+            Each bootstrap sample is represented by the number of times each molecule is drawn,
+            so the molecules don't need to be sorted again.
+
+            Parameters
+            ----------
+            metric: str
+                Name of the metric. Can be "auc", "bedroc" or "enrichment_factor".
+
+            n_bootstrap: int
+                Number of bootstrap samples. (Default: 1000)
+
+            confidence: float
+                Confidence level of the interval. (Default: 0.95)
+
+            random_state: int or numpy.random.Generator (optional)
+                Seed of the random number generator.
+
+            kwargs:
+                Extra arguments of the metric, such as alpha or fractions.
+
+            Returns
+            -------
+            low: float or numpy.ndarray
+                Lower bound of the interval.
+
+            high: float or numpy.ndarray
+                Upper bound of the interval.
+        """
+        metrics = {
+            "auc": self.auc,
+            "bedroc": self.bedroc,
+            "enrichment_factor": self.enrichment_factor,
+        }
+        if metric not in metrics:
+            raise ValueError(f"Unknown metric {metric}. Must be one of {list(metrics)}")
+        rng = np.random.default_rng(random_state)
+        probabilities = np.full(self.n_molecules, 1 / self.n_molecules)
+        values = np.array([
+            metrics[metric](weights=rng.multinomial(self.n_molecules, probabilities), **kwargs)
+            for _ in range(n_bootstrap)
+        ])
+        tail = (1 - confidence) / 2 * 100
+        low, high = np.nanpercentile(values, [tail, 100 - tail], axis=0)
+        return low, high
@@ -1,8 +1,12 @@
 from openpharmacophore.databases import chembl, pubchem
-from openpharmacophore.databases.zinc import get_zinc_urls
-from openpharmacophore.io.mol2 import load_mol2_file
+from openpharmacophore.databases.zinc import get_zinc_urls, ZINCMirror
+from openpharmacophore.io.molecules_file import load_molecules_file, load_molecules_files, molecules_file_format
 from openpharmacophore.utils.random_string import random_string
 from openpharmacophore._private_tools.exceptions import OpenPharmacophoreException
+from openpharmacophore.screening.batch_screening import labelled_molecules
+from openpharmacophore.screening.metrics import RankedScreen
+import matplotlib.pyplot as plt
+import numpy as np
 import pandas as pd
 from rdkit import Chem
 from rdkit.Chem import Descriptors
@@ -13,6 +17,7 @@ from queue import Queue
 import requests
 import threading
 import time
+import warnings
 
 class VirtualScreening():
     """ Base class for performing virtual screening for a database of 
@@ -129,7 +134,8 @@ class VirtualScreening():
         else:
             raise NotImplementedError
 
-    def screen_ZINC(self, db="zinc", download_path=None, subset="Lead-Like", mw_range=None, logp_range=None, **kwargs):
+    def screen_ZINC(self, db="zinc", download_path=None, subset="Lead-Like", mw_range=None, logp_range=None, 
+                    mirror=None, n_workers=1, **kwargs):
         """ Screen ZINC database.
             
             Parameters
@@ -141,7 +147,19 @@ class VirtualScreening():
                 Directory where files will be saved. If None, files will be deleted 
                 after processing. Defaults to None
 
+            mirror: str or openpharmacophore.databases.zinc.ZINCMirror (optional)
+                A local mirror of ZINC. Files that are not in the mirror are synchronized first, 
+                and then the molecules are read from the mirror one tranche at a time.
+
+            n_workers: int (optional)
+                Number of processes that parse the files of a tranche of the mirror in parallel. 
+                (Default: 1)
+
         """
+        if mirror is not None:
+            self._screen_ZINC_mirror(mirror, subset, mw_range, logp_range, n_workers)
+            return
+
         if not download_path:
             delete_files = True
             download_path = "./tmp" + random_string(10)
@@ -180,9 +198,10 @@ class VirtualScreening():
         self.db = "ChemBL"
         pass
         
-    def screen_db_from_dir(self, path, file_extensions=None, **kwargs):
+    def screen_db_from_dir(self, path, file_extensions=None, n_workers=1, **kwargs):
         """ Screen a database of molecules contained in one or more files. 
-            Format can be smi, mol2, sdf.
+            Format can be smi, mol2, sdf. Files compressed with gzip, bz2 or xz
+            are decompressed on the fly.
 
             Parmeters
             ---------
@@ -193,6 +212,11 @@ class VirtualScreening():
                 A list of file extensions that will be searched for if a directory is passed.
                 The default behavior is to load all valid file extensions.
 
+            n_workers: int (optional)
+                Number of processes that decompress and parse the files of a directory 
+                in parallel. If None the number of processors of the machine is used. 
+                (Default: 1)
+
             Notes
             --------
             It does not retur anything. The parameters of the VirtualScreening object are updated accordingly. 
@@ -206,12 +230,11 @@ class VirtualScreening():
                 if '.ipynb_checkpoints' in root:
                     continue
                 for file in files:
-                    f_extension = file.split(".")[-1]
+                    f_extension, _ = molecules_file_format(file)
                     if f_extension not in file_extensions:
                         continue
                     files_list.append(os.path.join(root, file))
-            for f in tqdm(files_list):
-                molecules = self._load_molecules_file(f, **kwargs)
+            for _, molecules in tqdm(load_molecules_files(files_list, n_workers, **kwargs), total=len(files_list)):
                 self._screen_fn(molecules)
 
         elif os.path.isfile(path):
@@ -266,6 +289,29 @@ class VirtualScreening():
         """
         pass
     
+    def _screen_ZINC_mirror(self, mirror, subset, mw_range, logp_range, n_workers=1):
+        """ Screen the molecules of a local mirror of ZINC.
+
+            Parameters
+            ----------
+            mirror: str or openpharmacophore.databases.zinc.ZINCMirror
+                The mirror or its directory.
+        """
+        if not isinstance(mirror, ZINCMirror):
+            mirror = ZINCMirror(mirror)
+        self.db = "ZINC"
+        failed = mirror.sync(subset=subset, mw_range=mw_range, logp_range=logp_range)
+        if len(failed) > 0:
+            # Only the tranches in the mirror are screened
+            warnings.warn("{} ZINC files couldn't be downloaded and won't be screened: {}".format(
+                len(failed), ", ".join(failed)))
+
+        print("Processing tranches...")
+        for files in tqdm(mirror.files(subset=subset, mw_range=mw_range, logp_range=logp_range).values()):
+            for _, molecules in load_molecules_files(files, n_workers):
+                self._screen_fn(molecules)
+        print("Finished screening ZINC database")
+
     def _get_report(self):
         """ Get a report of the screening results.
             
@@ -319,7 +365,7 @@ class VirtualScreening():
     def _load_molecules_file(self, file_name, **kwargs):
         """
             Load a file of molecules of any format and return a list of 
-            rdkit molecules.
+            rdkit molecules. Compressed files are decompressed on the fly.
 
             Parameters
             ----------
@@ -330,29 +376,7 @@ class VirtualScreening():
             -------
             A list of rdkit.Chem.mol
         """
-        fextension = file_name.split(".")[-1]
-        
-        if fextension == "smi":
-            if kwargs:
-                if "delimiter" in kwargs and "titleLine" in kwargs:
-                    ligands = Chem.SmilesMolSupplier(file_name, delimiter=kwargs["delimiter"], titleLine=kwargs["titleLine"])
-                elif "delimiter" in kwargs:
-                    ligands = Chem.SmilesMolSupplier(file_name, delimiter=kwargs["delimiter"], titleLine=True)
-                elif "titleLine" in kwargs:
-                    ligands = Chem.SmilesMolSupplier(file_name, delimiter=' ', titleLine=kwargs["titleLine"])
-            else:    
-                ligands = Chem.SmilesMolSupplier(file_name, delimiter=' ', titleLine=True)
-        elif fextension == "mol2":
-            ligands = load_mol2_file(file_name)
-        elif fextension == "sdf":
-            ligands = Chem.SDMolSupplier(file_name)
-        else:
-            raise NotImplementedError
-        
-        # For some strange reason list(ligands) doesn't work if len(ligands) is not called before
-        len(ligands)
-        ligands = list(ligands)
-        ligands = [lig for lig in ligands if lig is not None]
+        ligands = load_molecules_file(file_name, **kwargs)
         if len(ligands) == 0:
             raise Exception("Molecules couldn´t be loaded")
         
@@ -391,17 +415,30 @@ class RetrospectiveScreening():
     """ Base class for performing retrospective virtual screening. This
         class expects molecules classified as actives and inactives. 
 
-        With this class pharmacophore models can be validated.
+        With this class pharmacophore models can be validated. Every molecule is given a 
+        score, so besides the metrics of the hit list, metrics that depend on the ranking 
+        of the molecules such as ROC AUC, BEDROC or enrichment factors can be computed.
 
     Parameters
     ----------
+    pharmacophore: openpharmacophore.Pharmacophore
+        The pharmacophore that will be validated.
 
     Attributes
     ----------
+    scores: numpy.ndarray of float
+        The score of each molecule. NaN for molecules that don't match the pharmacophore.
+
+    labels: numpy.ndarray of bool
+        True for active molecules and False for inactive ones.
+
+    ids: list
+        The id of each molecule.
 
     """
     def __init__(self, pharmacophore):
         self.pharmacophore = pharmacophore
+        self.db = ""
         self.n_molecules = 0
         self.n_actives = 0
         self.n_inactives = 0
@@ -411,8 +448,15 @@ class RetrospectiveScreening():
         self.n_false_inactives = 0 # False negatives
         self.mismatched_actives = []
         self.mismatched_inactives = []
+        self.scores = np.zeros(0)
+        self.labels = np.zeros(0, dtype=bool)
+        self.ids = []
         self.scoring_metric = ""
+        # Whether a higher score means a better match
+        self._higher_is_better = True
+        # Function that takes a list of molecules and returns an array with their scores
         self._screen_fn = None
+        self._ranked_screen = None
 
     def from_chembl_target_id(self, target_id, pIC50_threshold=6.3):
         """Retrospective screening from bioactivity data fetched 
@@ -427,9 +471,9 @@ class RetrospectiveScreening():
                 The cuttoff value from which a molecule is considered active.
            
            """
-        actives, inactives = chembl.get_training_data(target_id, pIC50_threshold)
+        actives, inactives = chembl.get_actives_and_inactives(target_id, pIC50_threshold)
         
-        self.db = "PubChem"
+        self.db = "ChemBL"
         self.from_training_data(actives, inactives)
 
     def from_training_data(self, actives, inactives):
@@ -445,30 +489,47 @@ class RetrospectiveScreening():
                 The first element is a list of the inactive compounds ids, and
                 the second elment is a list of smiles for the inactive compounds
 
-            Returns
-            -------
-        
+            Notes
+            -----
+            Does not return anything. Smiles that can't be parsed are skipped.
         """
-        actives_ids, actives_smiles = actives
-        inactives_ids, inactives_smiles = inactives
+        molecules, ids, labels = labelled_molecules(actives, inactives)
+        # Actives and inactives are scored in a single pass
+        scores = np.asarray(self._screen_fn(molecules), dtype=float)
+        self.from_scores(scores, labels, ids)
 
-        self.n_actives = len(actives_ids)
-        self.n_inactives = len(inactives_ids)
-        self.n_molecules = self.n_actives + self.n_inactives
+    def from_scores(self, scores, labels, ids=None):
+        """ Set the results of the retrospective screening from the scores of the molecules.
 
-        # TODO: Add ids to molecule object
-        mols_actives = [Chem.MolFromSmiles(smi) for smi in actives_smiles]
-        mols_inactives = [Chem.MolFromSmiles(smi) for smi in inactives_smiles]
-        
-        # Active molecules that were found to be active by the pharmacophore
-        matched_actives, self.mismatched_actives = self._screen_fn(mols_actives)
-        # Inactive molecules that were found to be active by the pharmacophore
-        matched_inactives, self.mismatched_inactives = self._screen_fn(mols_inactives)
-
-        self.n_true_actives = len(matched_actives)
-        self.n_true_inactives = len(self.mismatched_inactives)
-        self.n_false_actives = len(self.mismatched_actives)
-        self.n_false_inactives = len(matched_inactives)
+            Parameters
+            ----------
+            scores: array-like of float
+                The score of each molecule. NaN for molecules that don't match the pharmacophore.
+
+            labels: array-like of bool
+                True for active molecules and False for inactive ones.
+
+            ids: list (optional)
+                The id of each molecule.
+        """
+        self.scores = np.asarray(scores, dtype=float)
+        self.labels = np.asarray(labels, dtype=bool)
+        if self.scores.shape != self.labels.shape:
+            raise ValueError("Scores and labels must have the same length")
+        self.ids = list(range(self.labels.shape[0])) if ids is None else list(ids)
+        self._ranked_screen = None
+
+        matched = self._matched(self.scores)
+        self.n_molecules = self.labels.shape[0]
+        self.n_actives = int(np.count_nonzero(self.labels))
+        self.n_inactives = self.n_molecules - self.n_actives
+        self.n_true_actives = int(np.count_nonzero(matched & self.labels))
+        self.n_false_inactives = self.n_actives - self.n_true_actives
+        self.n_false_actives = int(np.count_nonzero(matched & ~self.labels))
+        self.n_true_inactives = self.n_inactives - self.n_false_actives
+        # Actives that were not matched and inactives that were
+        self.mismatched_actives = [self.ids[i] for i in np.flatnonzero(~matched & self.labels)]
+        self.mismatched_inactives = [self.ids[i] for i in np.flatnonzero(matched & ~self.labels)]
     
     def from_pubchem_bioassay_id(self, bioassay_id):
         """ Retrospective screening from a pubchem bioassay.
@@ -479,38 +540,123 @@ class RetrospectiveScreening():
                 PubChem bioassay id. 
         """
         pubchem_client = pubchem.PubChem()
-        actives, inactives = pubchem_client.get_assay_training_data(bioassay_id)
+        actives, inactives = pubchem_client.get_assay_actives_and_inactives(bioassay_id)
         self.db = "Pubchem"
         self.from_training_data(actives, inactives)
 
     def from_file(self, file_name):
         pass
 
-    def enrichment_plot(self):
-        # To compute enrichment plot and factor we need a list of sorted molecules by a scoring
-        # metric i.e SSD values, tanimoto similiarity, etc. We also need to know which molecules
-        # are actives and which ones inactives.
+    def enrichment_plot(self, ax=None):
+        """ Plot of the fraction of actives found vs the fraction of the database screened.
 
-        # All molecules need to be assigned a scoring metric else it will not be possible to sort
-        # them, which is essential for enrichment calculations.
+            Parameters
+            ----------
+            ax: matplotlib.axes._subplots.AxesSubplot, optional (Default = None)
+                An axes object where the plot will be drawn.
+        """
+        if ax is None:
+            fig, ax = plt.subplots(figsize=(10, 7))
+        screened, found = self._get_ranked_screen().enrichment_curve()
+        ax.plot(screened * 100, found * 100, label="Pharmacophore")
+        ax.plot([0, 100], [0, 100], linestyle="--", color="grey", label="Random")
+        ax.legend()
+        ax.set_xlabel("% Database screened")
+        ax.set_ylabel("% Actives found")
+        plt.show()
 
-        # For the ROC plot we need an array with the labels of the molecules, 0 being an inactive
-        # molecule and 1 an active one. Moreover, we need an array with the scores. Thats why we
-        # need to assign scores to every molecule.
+        return ax
 
-        pass
+    def ROC_plot(self, ax=None):
+        """ Plot of the receiver operating characteristic curve.
 
-    def ROC_plot(self):
-        pass
+            Parameters
+            ----------
+            ax: matplotlib.axes._subplots.AxesSubplot, optional (Default = None)
+                An axes object where the plot will be drawn.
+        """
+        if ax is None:
+            fig, ax = plt.subplots(figsize=(10, 7))
+        fpr, tpr = self._get_ranked_screen().roc_curve()
+        ax.plot(fpr, tpr, label=f"AUC = {round(self.AUC(), 2)}")
+        ax.plot([0, 1], [0, 1], linestyle="--", color="grey")
+        ax.legend()
+        ax.set_xlabel("False positive rate")
+        ax.set_ylabel("True positive rate")
+        plt.show()
+
+        return ax
 
     def AUC(self):
-        pass
+        """ Get the area under the ROC curve.
+
+            Returns
+            -------
+            float
+        """
+        return self._get_ranked_screen().auc()
+
+    def BEDROC(self, alpha=20.0):
+        """ Get the Boltzmann-enhanced discrimination of ROC.
+
+            Parameters
+            ----------
+            alpha: float
+                Early recognition parameter. (Default: 20.0)
+
+            Returns
+            -------
+            float
+        """
+        return self._get_ranked_screen().bedroc(alpha)
+
+    def confidence_interval(self, metric="auc", n_bootstrap=1000, confidence=0.95, random_state=None, **kwargs):
+        """ Get a bootstrapped confidence interval of a metric.
+
+            Parameters
+            ----------
+            metric: str
+                Name of the metric. Can be "auc", "bedroc" or "enrichment_factor". (Default: "auc")
+
+            n_bootstrap: int
+                Number of bootstrap samples. (Default: 1000)
 
-    def enrichment_factor(self):
-        n = self.n_true_positives + self.n_true_inactives
+            confidence: float
+                Confidence level of the interval. (Default: 0.95)
+
+            random_state: int (optional)
+                Seed of the random number generator.
+
+            kwargs:
+                Extra arguments of the metric, such as alpha or fractions.
+
+            Returns
+            -------
+            2-tuple
+                Lower and upper bounds of the interval.
+        """
+        return self._get_ranked_screen().bootstrap(metric, n_bootstrap, confidence, random_state, **kwargs)
+
+    def enrichment_factor(self, fractions=None):
+        """ Get the enrichment factor. 
+
+            Parameters
+            ----------
+            fractions: float or list of float (optional)
+                Fractions of the ranked database at which the enrichment factor is computed.
+                If None the enrichment factor of the molecules matched to the pharmacophore
+                is returned.
+
+            Returns
+            -------
+            float or numpy.ndarray
+        """
+        if fractions is not None:
+            return self._get_ranked_screen().enrichment_factor(fractions)
+        n = self.n_true_actives + self.n_false_actives
         TP = self.n_true_actives
         A = self.n_actives
-        N = self.n_inactives
+        N = self.n_molecules
         return (TP / n) / (A / N)
 
     def sensitivity(self):
@@ -524,12 +670,27 @@ class RetrospectiveScreening():
         return  TN / (TN + FP)
 
     def yield_of_actives(self):
-        n = self.n_true_positives + self.n_true_inactives
+        n = self.n_true_actives + self.n_false_actives
         TP = self.n_true_actives
         return TP / n
 
     def accuracy(self):
         TP = self.n_true_actives
         TN = self.n_true_inactives
-        N = self.n_inactives
-        return (TP + TN) / N
\ No newline at end of file
+        N = self.n_molecules
+        return (TP + TN) / N
+
+    def _matched(self, scores):
+        """ Get which molecules are matched by the pharmacophore. By default every molecule
+            with a score is a match.
+        """
+        return ~np.isnan(scores)
+
+    def _get_ranked_screen(self):
+        """ Get the molecules sorted by score. They are sorted once for all the metrics.
+        """
+        if self.n_molecules == 0:
+            raise OpenPharmacophoreException("No molecules have been screened")
+        if self._ranked_screen is None:
+            self._ranked_screen = RankedScreen(self.scores, self.labels, self._higher_is_better)
+        return self._ranked_screen
@@ -1,8 +1,5 @@
 from openpharmacophore.screening.screening import VirtualScreening, RetrospectiveScreening
-from rdkit import DataStructs
-from rdkit.Chem.Pharm2D import Gobbi_Pharm2D
-from rdkit.Chem.Pharm2D.Generate import Gen2DFingerprint
-import numpy as np
+from openpharmacophore.screening.batch_screening import pharmacophore_fingerprint, screen_fingerprints
 import bisect
 
 class VirtualScreening2D(VirtualScreening):
@@ -39,21 +36,21 @@ class VirtualScreening2D(VirtualScreening):
     In the future this should be updated to create fingerprints for a consensus pharmacophore. 
 
     """
-    def __init__(self, molecule, similarity="tanimoto", sim_cutoff=0.6):
+    def __init__(self, molecule, similarity="tanimoto", sim_cutoff=0.6, n_workers=1):
         super().__init__(pharmacophore=self._get_pharmacophore_fingerprint(molecule))
         
         if similarity != "tanimoto" and similarity != "dice":
             raise NotImplementedError
         
-        if sim_cutoff < 0 and sim_cutoff > 1:
+        if sim_cutoff < 0 or sim_cutoff > 1:
             raise ValueError("Similarity cutoff value must lie between 0 and 1")
 
         self.scoring_metric = "Similarity"
         self.similarity_cutoff = sim_cutoff
-        self.similiarity_fn = similarity
+        self.similarity_fn = similarity
         self.similar_mols = self.matches
+        self.n_workers = n_workers
 
-        self._factory = Gobbi_Pharm2D.factory
         self._screen_fn = self._fingerprint_similarity
     
     def _get_pharmacophore_fingerprint(self, molecule):
@@ -67,9 +64,7 @@ class VirtualScreening2D(VirtualScreening):
             -------
             fingerprint: rdkit.DataStructs.SparseBitVect
         """
-        factory = Gobbi_Pharm2D.factory
-        fingerprint = Gen2DFingerprint(molecule, factory)
-        return fingerprint
+        return pharmacophore_fingerprint(molecule)
     
     def _fingerprint_similarity(self, molecules):
         """ Compute fingerprints and similarity values for a list
@@ -86,16 +81,10 @@ class VirtualScreening2D(VirtualScreening):
         Does not return anything. Attributes are updated accordingly.
 
         """
-        for mol in molecules:
+        similarities = screen_fingerprints([self.pharmacophore], molecules, self.similarity_fn, 
+                                           n_workers=self.n_workers)[0]
+        for mol, similarity in zip(molecules, similarities.tolist()):
             self.n_molecules += 1
-            fingerprint = Gen2DFingerprint(mol, self._factory)
-            if self.similiarity_fn == "tanimoto":
-                similarity = DataStructs.TanimotoSimilarity(self.pharmacophore, fingerprint)
-            elif self.similiarity_fn == "dice":
-                similarity = DataStructs.DiceSimilarity(self.pharmacophore, fingerprint)
-            else:
-                raise NotImplementedError
-            
             if similarity >= self.similarity_cutoff:
                 try:
                     mol_id = mol.GetProp("_Name")
@@ -116,27 +105,52 @@ class VirtualScreening2D(VirtualScreening):
 
 
 class RetrospectiveScreening2D(RetrospectiveScreening):
-    """ Class for performing retrospective virtual screening by 
-        3D alignment of the molecules to the pharmacophore.
+    """ Class for performing retrospective virtual screening with 
+        pharmacophore fingerprints.
+
+        Inherits from RetrospectiveScreening class.
 
     Parameters
     ----------
+    query_mol: rdkit.Chem.mol
+        The molecule whose pharmacophoric fingerprint will be used as query.
+
+    similarity: str (optional)
+        Similarity measure that will be used to compare fingerprints. Can be tanimoto
+        or dice. Defaults to tanimoto.
+
+    sim_cutoff: float between 0 and 1
+        Cutoff value from which a molecule is considered a match. (Default: 0.6)
+
+    n_workers: int (optional)
+        Number of processes used to compute the fingerprints. If None the number of 
+        processors of the machine is used. (Default: 1)
 
     Attributes
     ----------
+    similarity_cutoff: float
+        Cutoff value from which a molecule is considered a match.
+
+    similarity_fn: str
+        The similarity function that will be used to compare fingerprints.
 
     """
-    def __init__(self, query_mol, similarity="tanimoto"):
+    def __init__(self, query_mol, similarity="tanimoto", sim_cutoff=0.6, n_workers=1):
         if similarity != "tanimoto" and similarity != "dice":
             raise NotImplementedError
+        if sim_cutoff < 0 or sim_cutoff > 1:
+            raise ValueError("Similarity cutoff value must lie between 0 and 1")
 
-        self._factory = Gobbi_Pharm2D.factory
-        fingerprint = Gen2DFingerprint(query_mol, self._factory)
-        super().__init__(pharmacophore=fingerprint)
+        super().__init__(pharmacophore=pharmacophore_fingerprint(query_mol))
+        self.scoring_metric = "Similarity"
+        self.similarity_cutoff = sim_cutoff
+        self.similarity_fn = similarity
+        self.n_workers = n_workers
+        self._screen_fn = self._fingerprint_similarity
 
-    def _fingerprint_similarity(self, molecules, bioactivity):
-        """ Compute fingerprints and similarity values for a list
-            of molecules. 
+    def _fingerprint_similarity(self, molecules):
+        """ Compute the similarity of a list of molecules to the pharmacophore 
+            fingerprint. 
 
         Parameters
         ----------
@@ -144,41 +158,16 @@ class RetrospectiveScreening2D(RetrospectiveScreening):
             List of molecules whose similarity to the pharmacophore 
             fingerprint will be calculated.
         
-        Notes
+        Returns
         -------
-        Does not return anything. Attributes are updated accordingly.
+        numpy.ndarray
+            The similarity of each molecule. 
 
         """
-        self.n_molecules = len(molecules)
-        self.n_actives = np.sum(bioactivity)
-        self.n_inactives = bioactivity.shape[0] - self.n_actives
-
-        for mol in molecules:
-            fingerprint = Gen2DFingerprint(mol, self._factory)
-            if self.similiarity_fn == "tanimoto":
-                similarity = DataStructs.TanimotoSimilarity(self.pharmacophore, fingerprint)
-            elif self.similiarity_fn == "dice":
-                similarity = DataStructs.DiceSimilarity(self.pharmacophore, fingerprint)
-            else:
-                raise NotImplementedError
-            
-            if similarity >= self.similarity_cutoff:
-                try:
-                    mol_id = mol.GetProp("_Name")
-                except:
-                    mol_id = None
-                matched_mol = (similarity, mol_id, mol)
-                # Append to list in ordered manner
-                try:
-                    bisect.insort(self.similar_mols, matched_mol)
-                    self.n_matches += 1
-                except:
-                    # Case when a molecule is repeated. It will throw an error since bisect
-                    # cannot compare molecules.
-                    self.n_molecules -= 1
-                    continue
-            else:
-                self.n_fails += 1 
-    
+        return screen_fingerprints([self.pharmacophore], molecules, self.similarity_fn, 
+                                   n_workers=self.n_workers)[0]
 
-         
\ No newline at end of file
+    def _matched(self, scores):
+        """ Molecules with a similarity equal or higher than the cutoff are matches.
+        """
+        return scores >= self.similarity_cutoff
@@ -1,11 +1,9 @@
 from openpharmacophore.screening.screening import RetrospectiveScreening, VirtualScreening
-from openpharmacophore.screening.alignment import apply_radii_to_bounds, transform_embeddings
-from rdkit import RDConfig, Chem, RDLogger
-from rdkit.Chem import ChemicalFeatures, rdDistGeom
-from rdkit.Chem.Pharm3D import EmbedLib
+from openpharmacophore.screening.batch_screening import labelled_molecules, screen_pharmacophores
+import numpy as np
+import pandas as pd
+from rdkit import RDLogger
 import bisect
-from operator import itemgetter
-import os
 
 RDLogger.DisableLog('rdApp.*') # Disable rdkit warnings
 
@@ -23,6 +21,10 @@ class VirtualScreening3D(VirtualScreening):
     pharmacophore: openpharmacophore.Pharmacophore
         The pharmacophore that will be used to screen the database.
 
+    use_cache: bool
+        If true embeddings of the molecules are taken from the default conformer cache when 
+        they have already been computed for the same pharmacophore. (Default: True)
+
     Attributes
     ----------
 
@@ -32,11 +34,13 @@ class VirtualScreening3D(VirtualScreening):
 
     """
 
-    def __init__(self, pharmacophore):
+    def __init__(self, pharmacophore, use_cache=True, n_workers=1):
         super().__init__(pharmacophore)
         self.aligned_mols = self.matches 
         self.scoring_metric = "SSD"
+        self.n_workers = n_workers
         self._screen_fn = self._align_molecules
+        self._use_cache = use_cache
         
     def _align_molecules(self, molecules, verbose=0):
         """ Align a list of molecules to a given pharmacophore.
@@ -57,59 +61,25 @@ class VirtualScreening3D(VirtualScreening):
         """
         self.n_molecules += len(molecules)
 
-        rdkit_pharmacophore, radii = self.pharmacophore.to_rdkit()
-        apply_radii_to_bounds(radii, rdkit_pharmacophore)
-
-        fdef = os.path.join(RDConfig.RDDataDir,'BaseFeatures.fdef')
-        featFactory = ChemicalFeatures.BuildFeatureFactory(fdef)
+        scores, embeddings = screen_pharmacophores([self.pharmacophore], molecules, n_workers=self.n_workers,
+                                                   use_cache=self._use_cache, return_embeddings=True)
 
-        for i, mol in enumerate(molecules):
+        for i, (mol, ssd, embedding) in enumerate(zip(molecules, scores[0].tolist(), embeddings[0])):
 
             if verbose == 1 and i % 100 == 0 and i != 0:
                 print(f"Screened {i} molecules. Number of matches: {self.n_matches}; Number of fails: {self.n_fails}")
 
-            bounds_matrix = rdDistGeom.GetMoleculeBoundsMatrix(mol)
-            # Check if the molecule features can match with the pharmacophore.
-            # TODO: replace this function with a custom one that can take other feature definitions
-            can_match, all_matches = EmbedLib.MatchPharmacophoreToMol(mol, featFactory, rdkit_pharmacophore)
-            # all_matches is a list of tuples where each tuple contains the chemical features
-            if can_match:
-                # Match the molecule to the pharmacophore without aligning it
-                failed, bounds_matrix_matched, matched_mols, match_details = EmbedLib.MatchPharmacophore(all_matches, 
-                                                                                                bounds_matrix,
-                                                                                                rdkit_pharmacophore, 
-                                                                                                useDownsampling=True)
-                if failed:
-                    if verbose == 2:
-                        print(f"Couldn't embed molecule {i}")
-                    self.n_fails += 1
-                    continue
-            else:
+            if embedding is None:
                 if verbose == 2:
-                    print(f"Couldn't match molecule {i}")
+                    print(f"Couldn't align molecule {i}")
                 self.n_fails += 1
                 continue
-            atom_match = [list(x.GetAtomIds()) for x in matched_mols]
-            try:
-                mol_H = Chem.AddHs(mol)
-                # Embed molecule onto the pharmacophore
-                # embeddings is a list of molecules with a single conformer
-                b_matrix, embeddings, num_fail = EmbedLib.EmbedPharmacophore(mol_H, atom_match, rdkit_pharmacophore, count=10)
-            except Exception as e:
-                if verbose == 2:
-                    print(e)
-                    print (f"Bounds smoothing failed for molecule {i}")
-                self.n_fails += 1
-                continue
-            # Align embeddings to the pharmacophore 
-            SSDs = transform_embeddings(rdkit_pharmacophore, embeddings, atom_match) 
-            best_fit_index = min(enumerate(SSDs), key=itemgetter(1))[0]
             
             try:
                 mol_id = mol.GetProp("_Name")
             except:
                 mol_id = None
-            matched_mol = (SSDs[best_fit_index], mol_id, embeddings[best_fit_index])
+            matched_mol = (ssd, mol_id, embedding)
             # Append to list in ordered manner
             try:
                 bisect.insort(self.aligned_mols, matched_mol) 
@@ -124,12 +94,129 @@ class RetrospectiveScreening3D(RetrospectiveScreening):
     """ Class for performing retrospective virtual screening by 
         3D alignment of the molecules to the pharmacophore.
 
+        Inherits from RetrospectiveScreening class.
+
     Parameters
     ----------
+    pharmacophore: openpharmacophore.Pharmacophore
+        The pharmacophore that will be validated.
+
+    use_cache: bool
+        If true embeddings of the molecules are taken from the default conformer cache when 
+        they have already been computed for the same pharmacophore. (Default: True)
+
+    n_workers: int (optional)
+        Number of processes used to align the molecules. If None the number of processors 
+        of the machine is used. (Default: 1)
 
     Attributes
     ----------
+    scores: numpy.ndarray of float
+        The SSD value of the alignment of each molecule. NaN for molecules that 
+        can't be aligned to the pharmacophore.
 
     """
-    def __init__(self, pharmacophore):
+    def __init__(self, pharmacophore, use_cache=True, n_workers=1):
         super().__init__(pharmacophore)
+        self.scoring_metric = "SSD"
+        self.n_workers = n_workers
+        self._use_cache = use_cache
+        # Lower SSD values are better alignments
+        self._higher_is_better = False
+        self._screen_fn = self._align_molecules
+
+    @classmethod
+    def validation_matrix(cls, pharmacophores, actives, inactives, n_workers=1, use_cache=True, 
+                          alpha=20.0, fractions=(0.01, 0.05)):
+        """ Validate several pharmacophores with the same set of active and inactive molecules.
+
+            The molecules are parsed and their features and bounds matrices are computed a 
+            single time for all the pharmacophores. The dataset is split in chunks that are
+            aligned to every pharmacophore in parallel.
+
+            Parameters
+            ----------
+            pharmacophores: list of openpharmacophore.Pharmacophore
+                The pharmacophores that will be validated.
+
+            actives: 2-tuple
+                The first element is a list of the active compounds ids, and
+                the second elment is a list of smiles for the active compounds.
+
+            inactives: 2-tuple
+                The first element is a list of the inactive compounds ids, and
+                the second elment is a list of smiles for the inactive compounds.
+
+            n_workers: int (optional)
+                Number of processes. If None the number of processors of the machine is used.
+                (Default: 1)
+
+            use_cache: bool
+                If true embeddings of the molecules are taken from the default conformer cache.
+                (Default: True)
+
+            alpha: float
+                Early recognition parameter of the BEDROC. (Default: 20.0)
+
+            fractions: tuple of float
+                Fractions of the ranked database at which the enrichment factor is computed.
+                (Default: (0.01, 0.05))
+
+            Returns
+            -------
+            metrics: pandas.DataFrame
+                A row for each pharmacophore, in the same order, and a column for each metric.
+
+            screeners: list of RetrospectiveScreening3D
+                The retrospective screening of each pharmacophore.
+        """
+        molecules, ids, labels = labelled_molecules(actives, inactives)
+        scores = screen_pharmacophores(pharmacophores, molecules, n_workers=n_workers, use_cache=use_cache)
+
+        screeners = []
+        rows = []
+        for pharmacophore, model_scores in zip(pharmacophores, scores):
+            screener = cls(pharmacophore, use_cache=use_cache, n_workers=n_workers)
+            screener.from_scores(model_scores, labels, ids)
+            screeners.append(screener)
+
+            row = {
+                "True Actives": screener.n_true_actives,
+                "False Actives": screener.n_false_actives,
+                "Sensitivity": _metric_or_nan(screener.sensitivity),
+                "Specificity": _metric_or_nan(screener.specificity),
+                "Yield of Actives": _metric_or_nan(screener.yield_of_actives),
+                "Enrichment Factor": _metric_or_nan(screener.enrichment_factor),
+                "AUC": screener.AUC(),
+                f"BEDROC ({alpha:g})": screener.BEDROC(alpha),
+            }
+            for fraction, enrichment in zip(fractions, np.atleast_1d(screener.enrichment_factor(fractions))):
+                row[f"EF {fraction * 100:g}%"] = enrichment
+            rows.append(row)
+
+        return pd.DataFrame(rows, index=pd.RangeIndex(len(rows), name="Pharmacophore")), screeners
+
+    def _align_molecules(self, molecules):
+        """ Align a list of molecules to the pharmacophore.
+
+        Parameters
+        ----------
+        molecules: list of rdkit.Chem.mol
+            List of molecules to align.
+
+        Returns
+        -------
+        numpy.ndarray
+            The SSD value of each molecule, NaN if it can't be aligned.
+
+        """
+        return screen_pharmacophores([self.pharmacophore], molecules, n_workers=self.n_workers, 
+                                     use_cache=self._use_cache)[0]
+
+def _metric_or_nan(metric):
+    """ Compute a metric, or return NaN if it is undefined because one of the counts is zero.
+    """
+    try:
+        return metric()
+    except ZeroDivisionError:
+        return np.nan
@@ -1,22 +1,29 @@
-from openpharmacophore._private_tools.exceptions import FetchError, InvalidFileFormat
-from openpharmacophore import Pharmacophore, pharmacophore
+from openpharmacophore._private_tools.exceptions import FetchError, InvalidFileFormat, OpenPharmacophoreException
+from openpharmacophore import Pharmacophore
 from openpharmacophore.io.pharmer import from_pharmer, _pharmer_dict
 from openpharmacophore.color_palettes import get_color_from_palette_for_feature
 from openpharmacophore.pharmacophoric_point import PharmacophoricPoint
 from openpharmacophore.utils import ligand_features
+from openpharmacophore.utils.interaction_cache import get_default_interaction_cache, get_default_pdb_cache
 from MDAnalysis.lib.util import NamedStream
 import numpy as np
 import nglview as nv
 from plip.structure.preparation import PDBComplex
+from scipy.spatial import cKDTree
 import pyunitwizard as puw
 from rdkit import Chem, RDLogger
 from rdkit.Chem.Draw import rdMolDraw2D
+from tqdm.auto import tqdm
 from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import copy
 from io import StringIO, BytesIO
 import json
+import os
+import pandas as pd
 import requests
 import re
+import time
 import warnings
 
 RDLogger.DisableLog('rdApp.*') # Disable rdkit warnings
@@ -59,7 +66,8 @@ class StructuredBasedPharmacophore(Pharmacophore):
         self.ligand = ligand
     
     @classmethod
-    def from_pdb(cls, pdb, radius=1.0, ligand_id=None, hydrophobics="rdkit", load_mol_system=True, load_ligand=True):
+    def from_pdb(cls, pdb, radius=1.0, ligand_id=None, hydrophobics="rdkit", load_mol_system=True, load_ligand=True,
+                 use_cache=True):
         """ Class method to obtain a pharmacophore from a pdb file containing
             a protein-ligand complex. 
             
@@ -79,41 +87,31 @@ class StructuredBasedPharmacophore(Pharmacophore):
         
         ligand_id: str (optional)
             Id of the ligand for which the pharmacophore will be computed.
+
+        use_cache: bool
+            If true the interactions computed by plip and the pdb files downloaded from the
+            Protein Data Bank are cached and reused. (Default: True)
         
         Returns
         -------
         An openpharmacophore.StructuredBasedPharmacophore with the elements 
 
         """
-        if isinstance(pdb, str):
-            pdb_name = pdb
-            pattern= re.compile('[0-9][a-zA-Z_0-9]{3}') #PDB id pattern
-            # Check if an ID was passed or a file
-            if pdb.endswith(".pdb"):
-                as_string = False
-            elif pattern.match(pdb):
-                pdb = StructuredBasedPharmacophore._fetch_pdb(pdb)
-                as_string = True
-            else:
-                raise Exception("Invalid file or PDB id")
-        elif isinstance(pdb, NamedStream):
-            as_string = True
-            pdb = pdb.getvalue()
-        else:
-            raise TypeError("pdb must be of type str or MDAnalysis.lib.util.NamedStream")
+        pdb_name = pdb
+        pdb, as_string = StructuredBasedPharmacophore._parse_pdb_input(pdb, use_cache=use_cache)
 
         # pdb_string is the "corrected" pdb that plip generates
-        all_interactions, pdb_string, ligands = StructuredBasedPharmacophore._protein_ligand_interactions(pdb, as_string=as_string)
+        cache = get_default_interaction_cache() if use_cache else None
+        all_interactions, pdb_string, ligands = StructuredBasedPharmacophore._analyze_complex(
+            pdb, as_string=as_string, cache=cache)
         if ligand_id:
             interactions = all_interactions[ligand_id]
-            # Extract the ligand and convert to sdf to get its 3D coordinates
-            ligand_sdf_str = ligands[ligand_id].write("sdf")
-            
+            # The ligand as an sdf string with its 3D coordinates
+            ligand_sdf_str = ligands[ligand_id]
         
         elif len(all_interactions) == 1:
             interactions = list(all_interactions.values())[0]
-            ligand_pybel = list(ligands.values())[0]
-            ligand_sdf_str = ligand_pybel.write("sdf")
+            ligand_sdf_str = list(ligands.values())[0]
         
         else:
             # If there is more than one ligand and is not specified, prompt the user for the ligand name
@@ -123,8 +121,38 @@ class StructuredBasedPharmacophore(Pharmacophore):
             print("\nPlease enter for which one the pharmacophore should be computed ")
             ligand_id = input()
             interactions = all_interactions[ligand_id]
-            ligand_sdf_str = ligands[ligand_id].write("sdf")
+            ligand_sdf_str = ligands[ligand_id]
+        
+        return cls._from_interactions(interactions, ligand_sdf_str, pdb_string, radius=radius, 
+                                      hydrophobics=hydrophobics, load_mol_system=load_mol_system, 
+                                      load_ligand=load_ligand)
+
+    @classmethod
+    def _from_interactions(cls, interactions, ligand_sdf_str, pdb_string, radius=1.0, hydrophobics="rdkit", 
+                           load_mol_system=True, load_ligand=True):
+        """ Class method to obtain a pharmacophore from the interactions of a single ligand
+            of a protein-ligand complex.
+
+        Parameters
+        ----------
+        interactions: list of dict or plip.structure.preparation.PLInteraction
+            The serialized interactions of the ligand with the protein, or the plip object
+            containing all interaction data for the ligand and the protein.
+
+        ligand_sdf_str: str
+            The ligand as an sdf string.
+
+        pdb_string: str
+            The corrected pdb of the protein-ligand complex.
         
+        radius: float
+            Radius of the spheres of the pharmacophoric points. (Default: 1.0)
+
+        Returns
+        -------
+        An openpharmacophore.StructuredBasedPharmacophore with the elements 
+
+        """
         if load_ligand:
             ligand_sio = StringIO(ligand_sdf_str)
             ligand_bio = BytesIO(ligand_sio.read().encode("utf8"))
@@ -154,6 +182,74 @@ class StructuredBasedPharmacophore(Pharmacophore):
 
         return cls(elements=pharmacophoric_points, molecular_system=molecular_system, ligand=ligand)
     
+    @classmethod
+    def from_pdb_batch(cls, pdbs, output_dir, radius=1.0, hydrophobics="rdkit", save_mol_system=False, n_workers=None,
+                       use_cache=True):
+        """ Class method to obtain pharmacophores for every ligand of many protein-ligand
+            complexes. 
+
+            Complexes are analyzed in a pool of processes. A pharmacophore is computed for every
+            ligand of every complex without prompting and saved as a pharmer file named after the
+            complex and the ligand id. A log with the time taken to process each complex and the 
+            errors that occurred is written to log.csv.
+
+        Parameters
+        ----------
+        pdbs: str or list of str
+            A directory containing pdb files, or a list of pdb files or PDB ids.
+
+        output_dir: str
+            Directory where the pharmacophores and the log will be written.
+        
+        radius: float
+            Radius of the spheres of the pharmacophoric points. (Default: 1.0)
+
+        hydrophobics: str
+            Can be "plip" or "rdkit". Method used to obtain the hydrophobic points. (Default: "rdkit")
+
+        save_mol_system: bool
+            If true the receptor and ligand are saved in the pharmacophore files. (Default: False)
+
+        n_workers: int (optional)
+            Number of processes. If None the number of processors of the machine is used.
+
+        use_cache: bool
+            If true the interactions computed by plip and the pdb files downloaded from the
+            Protein Data Bank are cached and reused. (Default: True)
+
+        Returns
+        -------
+        log: pandas.DataFrame
+            Dataframe with the columns pdb, ligand_id, n_points, file_name, time and error. There
+            is one row per ligand, or a single row if the complex failed.
+
+        """
+        if isinstance(pdbs, str):
+            if not os.path.isdir(pdbs):
+                raise IOError(f"{pdbs} is not a valid directory")
+            pdbs = sorted(os.path.join(pdbs, f) for f in os.listdir(pdbs) if f.endswith(".pdb"))
+        
+        os.makedirs(output_dir, exist_ok=True)
+
+        records = []
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            futures = [
+                executor.submit(_pharmacophores_from_pdb, pdb, output_dir, radius, hydrophobics, save_mol_system, use_cache)
+                for pdb in pdbs
+            ]
+            for future in tqdm(as_completed(futures), total=len(futures)):
+                records.extend(future.result())
+        
+        log = pd.DataFrame(records, columns=["pdb", "ligand_id", "n_points", "file_name", "time", "error"])
+        # Keep the order of the input
+        log["pdb"] = pd.Categorical(log["pdb"], categories=list(dict.fromkeys(pdbs)), ordered=True)
+        log.sort_values(by=["pdb"], kind="stable", inplace=True)
+        log["pdb"] = log["pdb"].astype(str)
+        log.reset_index(drop=True, inplace=True)
+        log.to_csv(os.path.join(output_dir, "log.csv"), index=False)
+        
+        return log
+
     @classmethod
     def from_file(cls, file_name, load_mol_sys=True):
         """
@@ -174,19 +270,69 @@ class StructuredBasedPharmacophore(Pharmacophore):
         return cls(points, receptor, ligand)    
 
     @staticmethod
-    def _fetch_pdb(pdb_id):
+    def _parse_pdb_input(pdb, use_cache=True):
+        """ Check whether a pdb file, a PDB id or a stream was passed and get a
+            pdb that plip can load.
+
+            Parameters
+            ----------
+            pdb: str or MDAnalysis.lib.util.NamedStream
+                PDB id, path to the pdb file or stream containing the protein-ligand complex.
+
+            use_cache: bool
+                If true PDB ids are looked up in the cache of downloaded pdb files
+                before fetching them. (Default: True)
+
+            Returns
+            -------
+            pdb: str
+                The pdb file name or the pdb as a string.
+
+            as_string: bool
+                Whether the returned pdb is a string or a file.
+        """
+        if isinstance(pdb, str):
+            pattern= re.compile('[0-9][a-zA-Z_0-9]{3}') #PDB id pattern
+            # Check if an ID was passed or a file
+            if pdb.endswith(".pdb"):
+                as_string = False
+            elif pattern.match(pdb):
+                cache = get_default_pdb_cache() if use_cache else None
+                pdb = StructuredBasedPharmacophore._fetch_pdb(pdb, cache=cache)
+                as_string = True
+            else:
+                raise Exception("Invalid file or PDB id")
+        elif isinstance(pdb, NamedStream):
+            as_string = True
+            pdb = pdb.getvalue()
+        else:
+            raise TypeError("pdb must be of type str or MDAnalysis.lib.util.NamedStream")
+        
+        return pdb, as_string
+
+    @staticmethod
+    def _fetch_pdb(pdb_id, cache=None):
         """ Fetch a protein estructure from PDB.
             
             Parameters
             ----------
             pdb_id: str of len 4
                 The id of the protein structure.
+
+            cache: openpharmacophore.utils.interaction_cache.PDBFileCache (optional)
+                If passed the pdb is looked up in the cache before downloading it and
+                stored in it after.
             
             Returns
             -------
             pdb_str: str
                 The pdb as a string.
         """
+        if cache is not None:
+            pdb_str = cache.get(pdb_id)
+            if pdb_str is not None:
+                return pdb_str
+
         url = 'http://files.rcsb.org/download/{}.pdb'.format(pdb_id)
         res = requests.get(url, allow_redirects=True)
      
@@ -194,6 +340,8 @@ class StructuredBasedPharmacophore(Pharmacophore):
             raise FetchError("Could not fetch pdb from {}".format(url)) 
         
         pdb_str = res.content.decode()
+        if cache is not None:
+            cache.put(pdb_id, pdb_str)
 
         return pdb_str
         
@@ -245,6 +393,118 @@ class StructuredBasedPharmacophore(Pharmacophore):
             ligands[ligand_id] = ligand.mol
         
         return all_interactions, pdb_string, ligands
+
+    @staticmethod
+    def _analyze_complex(pdb, as_string, cache=None):
+        """ Calculate the protein-ligand interactions for each ligand in the pdb file
+            in a serializable form, reusing a previous analysis of the same complex
+            if it is in the cache.
+
+        Parameters
+        ----------
+        pdb: str
+            File or string containing the protein-ligand complex.
+
+        as_string: bool
+            Variable to know if the pdb passed is a string or a file.
+
+        cache: openpharmacophore.utils.interaction_cache.InteractionCache (optional)
+            Cache where the analysis is looked up and stored.
+
+        Returns
+        -------
+        all_interactions: dict
+            Dictionary which keys are ligand Ids and values are lists with the serialized
+            interactions of that ligand.
+        
+        pdb_string: str
+            The corrected pdb stucture as a string.
+
+        ligands: dict
+             Dictionary which keys are ligand Ids and values are the ligands as sdf strings.
+        """
+        if cache is not None:
+            key = cache.key(pdb, as_string)
+            entry = cache.get(key)
+            if entry is not None:
+                return entry["interactions"], entry["pdb_string"], entry["ligands"]
+
+        plip_interactions, pdb_string, pybel_ligands = StructuredBasedPharmacophore._protein_ligand_interactions(
+            pdb, as_string=as_string)
+        all_interactions = {
+            ligand_id: StructuredBasedPharmacophore._serialize_interactions(interactions)
+            for ligand_id, interactions in plip_interactions.items()
+        }
+        ligands = {ligand_id: ligand.write("sdf") for ligand_id, ligand in pybel_ligands.items()}
+
+        if cache is not None:
+            cache.put(key, {"interactions": all_interactions, "pdb_string": pdb_string, "ligands": ligands})
+
+        return all_interactions, pdb_string, ligands
+
+    @staticmethod
+    def _serialize_interactions(interactions):
+        """ Convert the interactions computed by plip for a ligand into a list of plain records
+            with the data needed to obtain its pharmacophoric points.
+
+        Parameters
+        ----------
+        interactions: plip.structure.preparation.PLInteraction
+            Object containing all interaction data for a single ligand and a protein.
+
+        Returns
+        -------
+        records: list of dict
+            A record for each pistack, hydrophobic, saltbridge and hbond interaction. Each record
+            has the keys "type", "ligand_center" and "ligand_atoms", and depending on the type
+            "protein_center", "protein_is_positive" or "protein_is_donor".
+        """
+        def coords(array):
+            return [float(x) for x in array]
+
+        records = []
+        for interaction in interactions.all_itypes:
+            interaction_name = type(interaction).__name__
+
+            if interaction_name == "pistack":
+                records.append({
+                    "type": interaction_name,
+                    "ligand_center": coords(interaction.ligandring.center),
+                    "protein_center": coords(interaction.proteinring.center),
+                    "ligand_atoms": [atom.idx for atom in interaction.ligandring.atoms],
+                })
+            
+            elif interaction_name == "hydroph_interaction":
+                records.append({
+                    "type": interaction_name,
+                    "ligand_center": coords(interaction.ligatom.coords),
+                    "ligand_atoms": [interaction.ligatom.idx],
+                })
+            
+            elif interaction_name == "saltbridge":
+                # The charged group of the ligand has the opposite charge of the protein group
+                group = interaction.negative if interaction.protispos else interaction.positive
+                records.append({
+                    "type": interaction_name,
+                    "protein_is_positive": bool(interaction.protispos),
+                    "ligand_center": coords(group.center),
+                    "ligand_atoms": [atom.idx for atom in group.atoms],
+                })
+            
+            elif interaction_name == "hbond":
+                if interaction.protisdon:
+                    ligand_atom, protein_atom = interaction.a, interaction.d
+                else:
+                    ligand_atom, protein_atom = interaction.d, interaction.a
+                records.append({
+                    "type": interaction_name,
+                    "protein_is_donor": bool(interaction.protisdon),
+                    "ligand_center": coords(ligand_atom.coords),
+                    "protein_center": coords(protein_atom.coords),
+                    "ligand_atoms": [ligand_atom.idx],
+                })
+        
+        return records
     
     @staticmethod
     def _sb_pharmacophore_points(interactions, radius, ligand, hydrophobics="rdkit"):
@@ -253,8 +513,9 @@ class StructuredBasedPharmacophore(Pharmacophore):
 
         Parameters
         ----------
-        interacions: plip.srtucture.preparation.PLInteraction
-            object containing all interacion data for a single ligand and a protein.
+        interacions: list of dict or plip.srtucture.preparation.PLInteraction
+            The serialized interactions of a single ligand with a protein, or the plip
+            object containing all interacion data for them.
         
         radius: float 
             Radius of the spheres of the pharmacophoric points.
@@ -275,20 +536,20 @@ class StructuredBasedPharmacophore(Pharmacophore):
         """   
         radius = puw.quantity(radius, "angstroms")
 
-        # List with all interactions
-        interactions = interactions.all_itypes
+        if not isinstance(interactions, list):
+            interactions = StructuredBasedPharmacophore._serialize_interactions(interactions)
         # list of pharmacophoric_elements
         points = []
         # list oh hydrophobic points
         hydrophobic_points = [] 
         for interaction in interactions:
-            interaction_name = type(interaction).__name__
+            interaction_name = interaction["type"]
+            ligand_center = np.array(interaction["ligand_center"])
+            atom_indices = interaction["ligand_atoms"]
             
             if interaction_name == "pistack":
-                ligand_center = np.array(interaction.ligandring.center)
-                protein_center = np.array(interaction.proteinring.center)
+                protein_center = np.array(interaction["protein_center"])
                 direction = protein_center - ligand_center
-                atom_indices = [atom.idx for atom in interaction.ligandring.atoms]
                 aromatic = PharmacophoricPoint(
                     feat_type="aromatic ring",
                     center=puw.quantity(ligand_center, "angstroms"),
@@ -301,69 +562,48 @@ class StructuredBasedPharmacophore(Pharmacophore):
             elif interaction_name == "hydroph_interaction":
                 if hydrophobics != "plip":
                     continue
-                center = puw.quantity(interaction.ligatom.coords, "angstroms")
-                atom_inx = [interaction.ligatom.idx]
                 hydrophobic = PharmacophoricPoint(
                     feat_type="hydrophobicity",
-                    center=center,
+                    center=puw.quantity(ligand_center, "angstroms"),
                     radius=radius,
                     direction=None,
-                    atoms_inxs=atom_inx
+                    atoms_inxs=atom_indices
                 )
                 hydrophobic_points.append(hydrophobic)
             
             elif interaction_name == "saltbridge":
-                if interaction.protispos:
+                if interaction["protein_is_positive"]:
                     # The ligand has a negative charge
-                    center = puw.quantity(interaction.negative.center, "angstroms")
-                    atom_indices = [atom.idx for atom in interaction.negative.atoms]
-                    charge_sphere = PharmacophoricPoint(
-                        feat_type="negative charge",
-                        center=center,
-                        radius=radius,
-                        atoms_inxs=atom_indices
-                    ) 
+                    feat_type = "negative charge"
                 else:
                     # The ligand has a positive charge
-                    center = puw.quantity(interaction.positive.center, "angstroms")
-                    atom_indices = [atom.idx for atom in interaction.positive.atoms]
-                    charge_sphere = PharmacophoricPoint(
-                        feat_type="positive charge",
-                        center=center,
-                        radius=radius,
-                        atoms_inxs=atom_indices
-                    ) 
+                    feat_type = "positive charge"
+                charge_sphere = PharmacophoricPoint(
+                    feat_type=feat_type,
+                    center=puw.quantity(ligand_center, "angstroms"),
+                    radius=radius,
+                    atoms_inxs=atom_indices
+                ) 
                 points.append(charge_sphere)
             
             elif interaction_name == "hbond":
-                if interaction.protisdon:
+                protein_center = np.array(interaction["protein_center"])
+                if interaction["protein_is_donor"]:
                     # The ligand has an acceptor atom
-                    ligand_acceptor_center = np.array(interaction.a.coords)
-                    ligand_acceptor_inx = [interaction.a.idx]
-                    protein_donor_center = np.array(interaction.d.coords)
-                    direction = ligand_acceptor_center - protein_donor_center 
-                    acceptor = PharmacophoricPoint(
-                        feat_type="hb acceptor",
-                        center=puw.quantity(ligand_acceptor_center, "angstroms"),
-                        radius=radius,
-                        direction=direction,
-                        atoms_inxs=ligand_acceptor_inx
-                    )
-                    points.append(acceptor)
+                    feat_type = "hb acceptor"
+                    direction = ligand_center - protein_center 
                 else:
                     # The ligand has a donor atom
-                    ligand_donor_center = np.array(interaction.d.coords)
-                    ligand_donor_inx = [interaction.d.idx]
-                    protein_acceptor_center = np.array(interaction.a.coords)
-                    direction = protein_acceptor_center - ligand_donor_center
-                    donor = PharmacophoricPoint(
-                        feat_type="hb donor",
-                        center=puw.quantity(ligand_donor_center, "angstroms"),
-                        radius=radius,
-                        direction=direction,
-                        atoms_inxs=ligand_donor_inx
-                    )
-                    points.append(donor)
+                    feat_type = "hb donor"
+                    direction = protein_center - ligand_center
+                hbond_point = PharmacophoricPoint(
+                    feat_type=feat_type,
+                    center=puw.quantity(ligand_center, "angstroms"),
+                    radius=radius,
+                    direction=direction,
+                    atoms_inxs=atom_indices
+                )
+                points.append(hbond_point)
             else:
                 # TODO: Incorporate other features such as halogenbonds, waterbridges and metal complexes
                 continue
@@ -385,48 +625,67 @@ class StructuredBasedPharmacophore(Pharmacophore):
         return points_filtered + hydrophobic_points
 
     @staticmethod
-    def _plip_hydrophobics(hydrophobics, radius):
+    def _plip_hydrophobics(hydrophobics, radius, max_distance=2.5):
         """ Groups plip hydrophobic points that are to close into a single
             point.
 
+            Points are taken in order as seeds. Each seed is grouped with the points
+            within max_distance of it that aren't in a group yet, and the group is replaced
+            by a single point located at its centroid and associated with all the atoms of
+            the group. Repeated points are counted only once.
+
             Parameters
             ----------
             hydrophobics: list of openpharmacophore.pharmacophoric_point.PharmacophoricPoint
                 List with the hydrophobic points.
 
+            radius: Quantity
+                Radius of the grouped points.
+
+            max_distance: float
+                Maximum distance in angstroms between a seed and the points of its group.
+                (Default: 2.5)
+
             Returns
             -------
             grouped_points: list of openpharmacophore.pharmacophoric_point.PharmacophoricPoint
                 List with the grouped points.
         """
-        grouped_points = []
-        skip = []
-        for inx, hyd1 in enumerate(hydrophobics):
-            if hyd1 in skip:
+        coords = np.array([puw.get_value(hyd.center, "angstroms") for hyd in hydrophobics])
+        # Remove repeated points, keeping the order of first appearance
+        _, first_inx, inverse = np.unique(np.around(coords, 4), axis=0, return_index=True, return_inverse=True)
+        order = np.argsort(first_inx)
+        unique_inx = np.empty_like(order)
+        unique_inx[order] = np.arange(order.shape[0])
+        unique_coords = coords[first_inx[order]]
+        n_points = unique_coords.shape[0]
+
+        # Each point that isn't grouped yet is the seed of a group with the points within
+        # max_distance of it that aren't grouped yet
+        neighbours = cKDTree(unique_coords).query_ball_point(unique_coords, max_distance)
+        labels = np.full(n_points, -1)
+        n_groups = 0
+        for seed in range(n_points):
+            if labels[seed] >= 0:
                 continue
-            centroid = hyd1.center
-            indices = hyd1.atoms_inxs
-            count = 0
-            hyd1_center = puw.get_value(hyd1.center, "angstroms")
-
-            for hyd2 in hydrophobics[inx + 1:]:
-                if hyd1 == hyd2:
-                    skip.append(hyd2)
-                    continue
-                hyd2_center = puw.get_value(hyd2.center, "angstroms")
-                distance = np.linalg.norm(hyd1_center - hyd2_center)
-
-                if distance <= 2.5:
-                    centroid += hyd2.center
-                    indices.union(hyd2.atoms_inxs)
-                    count += 1
-                    skip.append(hyd2)
-            if count > 0:
-                centroid /= (count + 1)
-            
+            members = [inx for inx in neighbours[seed] if labels[inx] < 0]
+            labels[members] = n_groups
+            n_groups += 1
+
+        group_coords = np.zeros((n_groups, 3))
+        np.add.at(group_coords, labels, unique_coords)
+        group_coords /= np.bincount(labels, minlength=n_groups)[:, np.newaxis]
+
+        group_indices = [set() for _ in range(n_groups)]
+        point_labels = labels[unique_inx[inverse.ravel()]]
+        for label, hyd in zip(point_labels, hydrophobics):
+            group_indices[label].update(hyd.atoms_inxs)
+
+        grouped_points = []
+        for centroid, indices in zip(group_coords, group_indices):
             grouped_points.append(PharmacophoricPoint(
                 feat_type="hydrophobicity", 
-                center=centroid, 
+                center=puw.quantity(centroid, "angstroms"), 
                 radius=radius,
                 direction=None,
                 atoms_inxs=indices))
@@ -597,12 +856,55 @@ class StructuredBasedPharmacophore(Pharmacophore):
 
         if save_mol_system:
             if self.molecular_system is not None:
-                receptor = Chem.MolToPDBBlock(pharmacophore.molecular_system)
+                receptor = Chem.MolToPDBBlock(self.molecular_system)
                 pharmacophore_dict["receptor"] = receptor
 
             if self.ligand is not None:
-                ligand = Chem.MolToPDBBlock(pharmacophore.ligand)
+                ligand = Chem.MolToPDBBlock(self.ligand)
                 pharmacophore_dict["ligand"] = ligand
 
         with open(file_name, "w") as outfile:
-            json.dump(pharmacophore_dict, outfile)
\ No newline at end of file
+            json.dump(pharmacophore_dict, outfile)
+
+def _pharmacophores_from_pdb(pdb, output_dir, radius, hydrophobics, save_mol_system, use_cache):
+    """ Compute and save the pharmacophores of every ligand of a protein-ligand complex.
+        Used as the task of the worker processes of StructuredBasedPharmacophore.from_pdb_batch.
+
+        Returns
+        -------
+        records: list of dict
+            A log record for each ligand, or a single record if the complex failed.
+    """
+    start = time.perf_counter()
+    pdb_name = os.path.splitext(os.path.basename(pdb))[0]
+    records = []
+    try:
+        pdb_input, as_string = StructuredBasedPharmacophore._parse_pdb_input(pdb, use_cache=use_cache)
+        cache = get_default_interaction_cache() if use_cache else None
+        all_interactions, pdb_string, ligands = StructuredBasedPharmacophore._analyze_complex(
+            pdb_input, as_string=as_string, cache=cache)
+        if len(all_interactions) == 0:
+            raise OpenPharmacophoreException("No ligands were found in the complex")
+
+        for ligand_id, interactions in all_interactions.items():
+            record = {"pdb": pdb, "ligand_id": ligand_id, "n_points": 0, "file_name": None, "error": None}
+            try:
+                pharmacophore = StructuredBasedPharmacophore._from_interactions(
+                    interactions, ligands[ligand_id], pdb_string, radius=radius, 
+                    hydrophobics=hydrophobics, load_mol_system=save_mol_system)
+                file_name = os.path.join(output_dir, pdb_name + "_" + ligand_id.replace(":", "_") + ".json")
+                pharmacophore.to_pharmer(file_name, save_mol_system=save_mol_system)
+                record["n_points"] = pharmacophore.n_elements
+                record["file_name"] = file_name
+            except Exception as e:
+                record["error"] = f"{type(e).__name__}: {e}"
+            records.append(record)
+    except Exception as e:
+        records.append({"pdb": pdb, "ligand_id": None, "n_points": 0, "file_name": None, 
+                        "error": f"{type(e).__name__}: {e}"})
+    
+    # Time taken to process the whole complex
+    elapsed_time = time.perf_counter() - start
+    for record in records:
+        record["time"] = elapsed_time
+    return records
@@ -0,0 +1,19 @@
+from openpharmacophore.utils import conformer_cache, interaction_cache
+import os
+import pytest
+
+@pytest.fixture(autouse=True)
+def cache_dir(tmp_path, monkeypatch):
+    """ Persist the caches of each test in a temporary directory, so tests don't read
+        or write the cache of the user.
+    """
+    cache_dir = str(tmp_path / "cache")
+    monkeypatch.setenv("OPENPHARMACOPHORE_CACHE_DIR", cache_dir)
+    # The default caches are created when their modules are imported
+    monkeypatch.setattr(conformer_cache, "_default_cache",
+                        conformer_cache.ConformerCache(cache_dir=os.path.join(cache_dir, "conformers")))
+    monkeypatch.setattr(interaction_cache, "_default_interaction_cache",
+                        interaction_cache.InteractionCache(cache_dir=os.path.join(cache_dir, "interactions")))
+    monkeypatch.setattr(interaction_cache, "_default_pdb_cache",
+                        interaction_cache.PDBFileCache(cache_dir=os.path.join(cache_dir, "pdb")))
+    return cache_dir
@@ -0,0 +1,168 @@
+from openpharmacophore.databases import chembl
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+import json
+import sqlite3
+import threading
+import numpy as np
+import pytest
+
+class MockChEMBLHandler(BaseHTTPRequestHandler):
+    """ Serves the activity and molecule endpoints of the ChEMBL API. """
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+        with self.server.lock:
+            self.server.requests.append((url.path, query))
+
+        if url.path == "/activity.json":
+            activities = [a for a in self.server.activities if a["target_chembl_id"] == query["target_chembl_id"]
+                          and a["activity_id"] > int(query.get("activity_id__gt", -1))]
+            offset, limit = int(query["offset"]), int(query["limit"])
+            content = {
+                "activities": activities[offset:offset + limit],
+                "page_meta": {"total_count": len(activities), "limit": limit, "offset": offset},
+            }
+        elif url.path == "/molecule.json":
+            ids = query["molecule_chembl_id__in"].split(",")
+            content = {"molecules": [
+                {"molecule_chembl_id": chembl_id, "molecule_structures":
+                 None if self.server.smiles[chembl_id] is None else {"canonical_smiles": self.server.smiles[chembl_id]}}
+                for chembl_id in ids
+            ]}
+        else:
+            self.send_response(404)
+            self.end_headers()
+            return
+
+        data = json.dumps(content).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+def activity(activity_id, target, molecule, value, units="nM"):
+    return {"activity_id": activity_id, "target_chembl_id": target, "molecule_chembl_id": molecule,
+            "standard_value": str(value), "standard_units": units}
+
+@pytest.fixture
+def server(tmp_path, monkeypatch):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), MockChEMBLHandler)
+    server.lock = threading.Lock()
+    server.requests = []
+    server.activities = [
+        activity(1, "T1", "M1", 100),
+        activity(2, "T1", "M2", 1000),
+        activity(3, "T1", "M1", 300),
+        activity(4, "T1", "M3", 10, units="ug.mL-1"),
+        activity(5, "T1", "M4", 10),
+        activity(6, "T2", "M2", 10),
+    ]
+    server.smiles = {"M1": "CCN", "M2": "CCO", "M3": "CCC", "M4": None, "M5": "CCCl"}
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    monkeypatch.setenv("OPENPHARMACOPHORE_CACHE_DIR", str(tmp_path))
+    monkeypatch.delenv("OPENPHARMACOPHORE_CHEMBL_DUMP", raising=False)
+    monkeypatch.setattr(chembl, "CHEMBL_API_URL", "http://127.0.0.1:{}".format(server.server_address[1]))
+    monkeypatch.setattr(chembl, "_PAGE_SIZE", 2)
+    yield server
+    server.shutdown()
+    server.server_close()
+
+def test_get_bioactivity_dataframe(server):
+    df = chembl.get_bioactivity_dataframe("T1")
+    assert list(df.columns) == ["ChemblID", "Smiles", "pIC50"]
+    assert df["ChemblID"].tolist() == ["M1", "M2"]
+    assert df["Smiles"].tolist() == ["CCN", "CCO"]
+    assert np.allclose(df["pIC50"], [9 - np.log10(200), 6])
+    # Five activities in pages of two
+    assert [path for path, _ in server.requests].count("/activity.json") == 3
+
+    # The target is read from the cache
+    n_requests = len(server.requests)
+    assert chembl.get_bioactivity_dataframe("T1").equals(df)
+    assert len(server.requests) == n_requests
+
+    # Refreshing only downloads new activities and molecules
+    server.activities.append(activity(7, "T1", "M5", 10))
+    df = chembl.get_bioactivity_dataframe("T1", max_age=0)
+    assert df["ChemblID"].tolist() == ["M1", "M2", "M5"]
+    path, query = server.requests[n_requests]
+    assert path == "/activity.json" and query["activity_id__gt"] == "5"
+    assert server.requests[-1] == ("/molecule.json",
+                                   {"molecule_chembl_id__in": "M5", "only": "molecule_chembl_id,molecule_structures",
+                                    "limit": "2"})
+
+    no_cache = chembl.get_bioactivity_dataframe("T1", use_cache=False)
+    assert no_cache.equals(df)
+
+def test_get_bioactivity_dataframes(server):
+    dataframes = chembl.get_bioactivity_dataframes(["T1", "T2", "T1"])
+    assert list(dataframes) == ["T1", "T2"]
+    assert dataframes["T2"]["ChemblID"].tolist() == ["M2"]
+
+    actives, inactives = chembl.get_actives_and_inactives("T1", pIC50_threshold=6.5)
+    assert actives == (["M1"], ["CCN"])
+    assert inactives == (["M2"], ["CCO"])
+
+@pytest.fixture
+def chembl_dump(tmp_path):
+    """ A tiny ChEMBL SQLite dump with the tables used by the bioactivity queries. """
+    file_name = str(tmp_path / "chembl.db")
+    connection = sqlite3.connect(file_name)
+    connection.executescript("""
+        CREATE TABLE target_dictionary (tid INTEGER PRIMARY KEY, chembl_id TEXT);
+        CREATE TABLE assays (assay_id INTEGER PRIMARY KEY, tid INTEGER, assay_type TEXT);
+        CREATE TABLE molecule_dictionary (molregno INTEGER PRIMARY KEY, chembl_id TEXT);
+        CREATE TABLE compound_structures (molregno INTEGER PRIMARY KEY, canonical_smiles TEXT);
+        CREATE TABLE activities (activity_id INTEGER PRIMARY KEY, assay_id INTEGER, molregno INTEGER,
+            type TEXT, relation TEXT, standard_value NUMERIC, standard_units TEXT);
+        INSERT INTO target_dictionary VALUES (1, 'T1'), (2, 'T2');
+        -- Assay 3 is functional, so its activities are ignored
+        INSERT INTO assays VALUES (1, 1, 'B'), (2, 2, 'B'), (3, 1, 'F');
+        INSERT INTO molecule_dictionary VALUES (1, 'M1'), (2, 'M2'), (3, 'M3'), (4, 'M4');
+        INSERT INTO compound_structures VALUES (1, 'CCN'), (2, 'CCO'), (3, 'CCC');
+        INSERT INTO activities VALUES
+            (1, 1, 1, 'IC50', '=', 100, 'nM'),
+            (2, 1, 2, 'IC50', '=', 1000, 'nM'),
+            (3, 1, 1, 'IC50', '=', 300, 'nM'),
+            (4, 1, 3, 'IC50', '=', 10, 'ug.mL-1'),
+            (5, 1, 4, 'IC50', '=', 10, 'nM'),
+            (6, 2, 2, 'IC50', '=', 10, 'nM'),
+            (7, 1, 3, 'IC50', '>', 10, 'nM'),
+            (8, 1, 3, 'Ki', '=', 10, 'nM'),
+            (9, 3, 3, 'IC50', '=', 10, 'nM');
+    """)
+    connection.commit()
+    connection.close()
+    return file_name
+
+def test_chembl_dump(chembl_dump, server, monkeypatch):
+    dump = chembl.ChEMBLDump(chembl_dump)
+    dump.create_indices()
+    # Same results as the web API with the same data
+    assert dump.get_bioactivity_dataframe("T1").equals(chembl.get_bioactivity_dataframe("T1", use_cache=False))
+    dataframes = dump.get_bioactivity_dataframes(["T2", "T3"])
+    assert dataframes["T2"]["ChemblID"].tolist() == ["M2"]
+    assert dataframes["T3"].empty
+
+    n_requests = len(server.requests)
+    monkeypatch.setenv("OPENPHARMACOPHORE_CHEMBL_DUMP", chembl_dump)
+    actives, inactives = chembl.get_actives_and_inactives("T1", pIC50_threshold=6.5)
+    assert actives == (["M1"], ["CCN"])
+    assert inactives == (["M2"], ["CCO"])
+    assert len(server.requests) == n_requests
+
+def test_client_pool_size(monkeypatch):
+    monkeypatch.setattr(chembl, "_client", None)
+    client = chembl._get_client(2)
+    assert client.session.get_adapter("https://www.ebi.ac.uk").poolmanager.connection_pool_kw["maxsize"] == 2
+    # The shared client holds a connection for each worker
+    assert chembl._get_client(8) is client
+    assert client.max_workers == 8
+    assert client.session.get_adapter("https://www.ebi.ac.uk").poolmanager.connection_pool_kw["maxsize"] == 8
@@ -0,0 +1,207 @@
+from openpharmacophore.dynophore import Dynophore
+from openpharmacophore.pharmacophoric_point import PharmacophoricPoint
+from openpharmacophore.structured_based import StructuredBasedPharmacophore
+from openpharmacophore._private_tools.exceptions import MissingParameters
+import mdtraj as mdt
+import numpy as np
+import pytest
+import pyunitwizard as puw
+from rdkit import Chem
+
+@pytest.fixture
+def trajectory():
+    """Returns a trajectory with three frames of the 2hz1 complex"""
+    traj = mdt.load("./openpharmacophore/data/pdb/2hz1.pdb")
+    xyz = np.stack([traj.xyz[0], traj.xyz[0] + 0.01, traj.xyz[0] - 0.01])
+    return mdt.Trajectory(xyz, traj.topology)
+
+@pytest.fixture
+def dynophore(trajectory):
+    return Dynophore(trajectory)
+
+def test_pharmacophores_from_frames_parallel(dynophore):
+    dynophore.pharmacophores_from_frames([2, 0, 1], load_ligand=False)
+    serial = dynophore.pharmacophores
+
+    dynophore.pharmacophores_from_frames([2, 0, 1], load_ligand=False, n_workers=2)
+    assert dynophore.pharmacophore_indices == [2, 0, 1]
+    assert dynophore.n_pharmacophores == 3
+    for serial_pharmacophore, pharmacophore in zip(serial, dynophore.pharmacophores):
+        assert len(pharmacophore.elements) == len(serial_pharmacophore.elements)
+        for point, serial_point in zip(pharmacophore.elements, serial_pharmacophore.elements):
+            assert point == serial_point
+            assert point.atoms_inxs == serial_point.atoms_inxs
+
+def test_pharmacophores_from_trajectory_file(trajectory, tmp_path):
+    dcd_file = str(tmp_path / "traj.dcd")
+    topology_file = str(tmp_path / "top.pdb")
+    trajectory.save_dcd(dcd_file)
+    trajectory[0].save_pdb(topology_file)
+
+    with pytest.raises(MissingParameters):
+        Dynophore(dcd_file)
+
+    dynophore = Dynophore(dcd_file, topology=topology_file)
+    assert dynophore._n_frames == 3
+    dynophore.pharmacophores_from_trajectory(stride=2, load_ligand=False, chunk=1)
+    assert dynophore.pharmacophore_indices == [0, 2]
+    assert dynophore.n_pharmacophores == 2
+
+    in_memory = Dynophore(trajectory)
+    in_memory.pharmacophores_from_frames([0, 2], load_ligand=False)
+    for pharmacophore, expected in zip(dynophore.pharmacophores, in_memory.pharmacophores):
+        assert len(pharmacophore.elements) == len(expected.elements)
+
+def point(feat_type, center, atoms):
+    return PharmacophoricPoint(feat_type, puw.quantity(center, "angstroms"), 
+                               puw.quantity(1.0, "angstroms"), atoms_inxs=atoms)
+
+def test_get_unique_pharmacophoric_points(dynophore):
+    dynophore.pharmacophores = [
+        StructuredBasedPharmacophore([point("hb donor", [0, 0, 0], [1]), point("aromatic ring", [1, 1, 1], [2, 3, 4])]),
+        StructuredBasedPharmacophore([point("hb donor", [2, 0, 0], [1]), point("hb donor", [5, 5, 5], [7])]),
+        StructuredBasedPharmacophore([point("aromatic ring", [3, 3, 3], [4, 3, 2])]),
+    ]
+    dynophore.pharmacophore_indices = [0, 1, 2]
+    dynophore.n_pharmacophores = 3
+    dynophore._get_unique_pharmacophoric_points(avg_coordinates=True)
+
+    unique_points = dynophore.unique_pharmacophoric_points
+    assert [p.feature_name for p in unique_points] == ["hb donor 1", "aromatic ring 1", "hb donor 2"]
+    assert [p.count for p in unique_points] == [2, 2, 1]
+    assert [p.timesteps for p in unique_points] == [[0, 1], [0, 2], [1]]
+    assert np.allclose([p.frequency for p in unique_points], [2 / 3, 2 / 3, 1 / 3])
+    assert np.allclose(puw.get_value(unique_points[0].center, "angstroms"), [1, 0, 0])
+    assert np.allclose(puw.get_value(unique_points[1].center, "angstroms"), [2, 2, 2])
+    # The points of the pharmacophores are not modified
+    assert np.allclose(puw.get_value(dynophore.pharmacophores[0].elements[0].center, "angstroms"), [0, 0, 0])
+
+def test_representative_pharmacophore_indices(dynophore):
+    donor = point("hb donor", [0, 0, 0], [1])
+    ring = point("aromatic ring", [1, 1, 1], [2, 3, 4])
+    models = [[donor, ring], [donor], [donor, ring], [ring], [donor, ring], [donor], [donor]]
+    dynophore.pharmacophores = [StructuredBasedPharmacophore(elements) for elements in models]
+    dynophore.pharmacophore_indices = list(range(len(models)))
+    dynophore.n_pharmacophores = len(models)
+    dynophore._get_unique_pharmacophoric_points(avg_coordinates=False)
+
+    assert dynophore._representative_pharmacophore_indices() == [[0, 2, 4], [1, 5, 6]]
+    assert dynophore._representative_pharmacophore_indices(min_count=1) == [[0, 2, 4], [1, 5, 6], [3]]
+
+def test_add_frames_updates_unique_points(dynophore):
+    dynophore.pharmacophores_from_frames([0, 1, 2], load_ligand=False)
+    dynophore._get_unique_pharmacophoric_points(avg_coordinates=True)
+    expected = [(p.feature_name, p.count, p.timesteps) for p in dynophore.unique_pharmacophoric_points]
+    expected_groups = dynophore._representative_pharmacophore_indices(min_count=1)
+
+    dynophore.pharmacophores_from_frames([0], load_ligand=False)
+    dynophore._get_unique_pharmacophoric_points(avg_coordinates=True)
+    dynophore.add_frames([1, 2], load_ligand=False)
+    assert dynophore.pharmacophore_indices == [0, 1, 2]
+    assert dynophore.n_pharmacophores == 3
+    assert [(p.feature_name, p.count, p.timesteps) for p in dynophore.unique_pharmacophoric_points] == expected
+    assert all(p.frequency == p.count / 3 for p in dynophore.unique_pharmacophoric_points)
+    assert dynophore._representative_pharmacophore_indices(min_count=1) == expected_groups
+
+def test_update_adds_new_frames(trajectory):
+    dynophore = Dynophore(trajectory[:2])
+    dynophore.pharmacophores_from_trajectory(load_ligand=False)
+    assert dynophore.update(load_ligand=False) == 0
+
+    assert dynophore.update(trajectory, load_ligand=False) == 1
+    assert dynophore.pharmacophore_indices == [0, 1, 2]
+    assert len(dynophore.unique_pharmacophoric_points) > 0
+    assert all(p.count <= 3 for p in dynophore.unique_pharmacophoric_points)
+
+def test_save_and_load(dynophore, trajectory, tmp_path):
+    file_name = str(tmp_path / "dynophore.npz")
+    dynophore.pharmacophores_from_frames([0, 2], load_ligand=False)
+    dynophore._get_unique_pharmacophoric_points(avg_coordinates=True)
+    dynophore.save(file_name)
+
+    loaded = Dynophore.load(file_name, trajectory)
+    assert loaded.pharmacophore_indices == [0, 2]
+    assert loaded._averaged_coords
+    for pharmacophore, expected in zip(loaded.pharmacophores, dynophore.pharmacophores):
+        assert len(pharmacophore.elements) == len(expected.elements)
+        for point, expected_point in zip(pharmacophore.elements, expected.elements):
+            assert point == expected_point
+            assert point.atoms_inxs == expected_point.atoms_inxs
+    assert ([(p.feature_name, p.count, p.timesteps) for p in loaded.unique_pharmacophoric_points] == 
+            [(p.feature_name, p.count, p.timesteps) for p in dynophore.unique_pharmacophoric_points])
+    
+    loaded.add_frames([1], load_ligand=False)
+    assert loaded.n_pharmacophores == 3
+
+def test_load_without_trajectory(dynophore, tmp_path):
+    file_name = str(tmp_path / "dynophore.npz")
+    dynophore.pharmacophores_from_frames([0, 1, 2], load_ligand=True)
+    dynophore._get_unique_pharmacophoric_points(avg_coordinates=False)
+    dynophore.save(file_name)
+
+    loaded = Dynophore.load(file_name)
+    assert loaded._n_frames == 3
+    assert loaded._representative_pharmacophore_indices(min_count=1) == \
+        dynophore._representative_pharmacophore_indices(min_count=1)
+    for pharmacophore, expected in zip(loaded.pharmacophores, dynophore.pharmacophores):
+        assert np.allclose(pharmacophore.ligand.GetConformer().GetPositions(), 
+                           expected.ligand.GetConformer().GetPositions())
+    
+    expected = dynophore.pharmacophore_by_frequency(0.5)
+    pharmacophore = loaded.pharmacophore_by_frequency(0.5)
+    assert [p.feature_name for p in pharmacophore.elements] == [p.feature_name for p in expected.elements]
+    assert len(loaded.representative_pharmacophore_models()) == len(dynophore.representative_pharmacophore_models())
+
+    with pytest.raises(MissingParameters):
+        loaded.update()
+
+@pytest.fixture
+def synthetic_dynophore(dynophore):
+    donor = point("hb donor", [0, 0, 0], [1])
+    ring = point("aromatic ring", [1, 1, 1], [2, 3, 4])
+    models = [[donor, ring], [donor], [ring], [donor, ring]]
+    dynophore.pharmacophores = [StructuredBasedPharmacophore(elements) for elements in models]
+    dynophore.pharmacophore_indices = [0, 1, 2, 3]
+    dynophore.n_pharmacophores = 4
+    return dynophore
+
+def test_occupancy_matrix(synthetic_dynophore):
+    occupancy = synthetic_dynophore.occupancy_matrix()
+    assert occupancy.dtype == bool
+    assert np.all(occupancy == np.array([[1, 1, 0, 1], [1, 0, 1, 1]], dtype=bool))
+
+    cooccurrence = synthetic_dynophore.point_cooccurrence()
+    assert list(cooccurrence.columns) == ["hb donor 1", "aromatic ring 1"]
+    assert np.allclose(cooccurrence.values, [[0.75, 0.5], [0.5, 0.75]])
+
+    moving_average = synthetic_dynophore.point_occupancy_moving_average(window=2)
+    assert list(moving_average.index) == [1, 2, 3]
+    assert np.allclose(moving_average["hb donor 1"], [1, 0.5, 0.5])
+    assert np.allclose(moving_average["aromatic ring 1"], [0.5, 0.5, 1])
+    with pytest.raises(ValueError):
+        synthetic_dynophore.point_occupancy_moving_average(window=5)
+
+def test_point_frequency_plot(synthetic_dynophore):
+    synthetic_dynophore._n_frames = 4
+    ax = synthetic_dynophore.point_frequency_plot(n_bins=2)
+    counts = {line.get_label(): line.get_ydata().tolist() for line in ax.lines}
+    # Bins are [0, 2, 4], frames 0, 1 fall in the first bin and 2, 3 in the second
+    assert counts == {"hb donor 1": [0, 2, 1], "aromatic ring 1": [0, 1, 2]}
+
+def test_common_hits_approach(dynophore):
+    dynophore.pharmacophores_from_frames([0, 1, 2], load_ligand=True)
+    ligand_smiles = Chem.MolToSmiles(dynophore.pharmacophores[0].ligand)
+    actives = (["active"], [ligand_smiles])
+    inactives = (["methane", "benzene"], ["C", "c1ccccc1"])
+
+    models, molecules = dynophore.common_hits_approach(actives, inactives)
+    assert list(models.columns) == ["Pharmacophore", "Frame", "Actives Hit", "Inactives Hit", 
+                                    "Sensitivity", "Specificity", "Enrichment Factor"]
+    assert len(models) == len(dynophore.representative_pharmacophore_models())
+    assert set(models["Frame"]).issubset({0, 1, 2})
+    assert list(molecules.columns) == ["ID", "Active", "N Hits", "Hit Pattern", "Mean SSD"]
+    assert sorted(molecules["ID"]) == ["active", "benzene", "methane"]
+    assert molecules["N Hits"].is_monotonic_decreasing
+    assert all(len(pattern) == len(models) for pattern in molecules["Hit Pattern"])
+    methane = molecules[molecules["ID"] == "methane"].iloc[0]
+    assert methane["N Hits"] == 0
@@ -1,4 +1,5 @@
 from openpharmacophore.io.mol2 import load_mol2_file
+from openpharmacophore.io.molecules_file import load_molecules_file, load_molecules_files, molecules_file_format
 from openpharmacophore.io.moe import from_moe, _moe_ph4_string
 from openpharmacophore.io.ligandscout import from_ligandscout, _ligandscout_xml_tree
 from openpharmacophore.io.pharmagist import read_pharmagist, _pharmagist_file_info
@@ -9,7 +10,12 @@ from openpharmacophore.structured_based import StructuredBasedPharmacophore
 import numpy as np
 import pyunitwizard as puw
 import pytest
+from rdkit import Chem
+import bz2
 import datetime
+import gzip
+import io
+import lzma
 import os
 import xml.etree.ElementTree as ET
 
@@ -289,3 +295,45 @@ def test_to_moe(three_element_pharmacophore):
 
     assert pharmacophore_str == expected_str
 
+
+@pytest.mark.parametrize("compression", [None, "gz", "bz2", "xz"])
+def test_load_compressed_molecules_files(compression, tmp_path):
+    openers = {None: open, "gz": gzip.open, "bz2": bz2.open, "xz": lzma.open}
+    smiles_file = "./openpharmacophore/data/ligands/mols.smi"
+    mol2_file = "./openpharmacophore/data/ligands/ace.mol2"
+    smiles = [Chem.MolToSmiles(mol) for mol in Chem.SmilesMolSupplier(smiles_file, titleLine=False)]
+
+    def copy(file_name, content):
+        name = str(tmp_path / file_name)
+        if compression is not None:
+            name += "." + compression
+        with openers[compression](name, "wb") as f:
+            f.write(content)
+        return name
+
+    with open(smiles_file, "rb") as f:
+        # Add a header and names to the molecules
+        lines = f.read().decode("utf-8").split("\n")
+        content = "smiles name\n" + "\n".join(f"{line} mol{i}" for i, line in enumerate(lines) if line)
+    compressed_smiles = copy("mols.smi", content.encode("utf-8"))
+    with open(mol2_file, "rb") as f:
+        compressed_mol2 = copy("ace.mol2", f.read())
+    sdf = io.StringIO()
+    writer = Chem.SDWriter(sdf)
+    for mol in Chem.SmilesMolSupplier(smiles_file, titleLine=False):
+        writer.write(mol)
+    writer.close()
+    compressed_sdf = copy("mols.sdf", sdf.getvalue().encode("utf-8"))
+
+    assert molecules_file_format(compressed_smiles) == ("smi", compression)
+    molecules = load_molecules_file(compressed_smiles, chunk_size=2)
+    assert [Chem.MolToSmiles(mol) for mol in molecules] == smiles
+    assert [mol.GetProp("_Name") for mol in molecules] == [f"mol{i}" for i in range(len(smiles))]
+    assert [mol.GetNumAtoms() for mol in load_molecules_file(compressed_mol2)] == [14, 25, 29]
+    assert [Chem.MolToSmiles(mol) for mol in load_molecules_file(compressed_sdf)] == smiles
+
+    files = [compressed_smiles, compressed_sdf, compressed_mol2]
+    loaded = list(load_molecules_files(files, n_workers=2))
+    assert [file_name for file_name, _ in loaded] == files
+    assert [len(molecules) for _, molecules in loaded] == [5, 5, 3]
+    assert loaded[0][1][0].GetProp("_Name") == "mol0"
@@ -1,7 +1,32 @@
 from openpharmacophore.ligand_based import LigandBasedPharmacophore
+from rdkit import Chem
+import pytest
 
 def test_from_ligand_list():
     pass
 
 def test_from_ligand_file():
     pass
+
+def test_parameter_sweep():
+    file_name = "./openpharmacophore/data/ligands/clique_detection.smi"
+    ligands = [mol for mol in Chem.SmilesMolSupplier(file_name, delimiter='\t', titleLine=False)]
+
+    sweep = LigandBasedPharmacophore.parameter_sweep(
+        ligands, 
+        eps=[1.5, 2], 
+        min_samples=[0.6, 0.8], 
+        radius=[1.0],
+        feat_lists=[["Aromatic", "Donor"], None],
+        scoring_fn=lambda pharmacophore: pharmacophore.n_elements,
+        n_workers=1)
+
+    assert len(sweep) == 8
+    assert list(sweep.columns) == ["eps", "min_samples", "radius", "feat_list", "pharmacophore", "score"]
+    assert sweep["score"].is_monotonic_decreasing
+    for _, row in sweep.iterrows():
+        pharmacophore = row["pharmacophore"]
+        assert isinstance(pharmacophore, LigandBasedPharmacophore)
+        assert len(pharmacophore.ligands) == 5
+        for point in pharmacophore.elements:
+            assert point.get_radius() == pytest.approx(1.0)
@@ -0,0 +1,136 @@
+from openpharmacophore.databases.pubchem import PubChem
+from openpharmacophore.databases.rest_client import RestClient, TokenBucket
+from openpharmacophore.utils.response_cache import ResponseCache
+from openpharmacophore._private_tools.exceptions import FetchError
+from openpharmacophore.screening.batch_screening import labelled_molecules
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+import threading
+import pytest
+
+class MockPubChemHandler(BaseHTTPRequestHandler):
+    """ Serves a small bioassay. The first request to /busy fails with a 503. """
+
+    smiles = {1: "CCN", 2: "CCC", 3: "CCO", 4: "c1ccccc1"}
+
+    responses = {
+        "/assay/aid/1/CSV": "PUBCHEM_CID,PUBCHEM_ACTIVITY_OUTCOME\n1,Active\n2,Inactive\n3,Inactive\n",
+        # Compound 5 is left out of the property responses, as deprecated compounds are
+        "/assay/aid/2/CSV": "PUBCHEM_CID,PUBCHEM_ACTIVITY_OUTCOME\n5,Active\n1,Active\n2,Inactive\n",
+        "/busy": "ok",
+    }
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.paths.append(self.path)
+            busy = self.path == "/busy" and server.paths.count("/busy") == 1
+        if busy:
+            self.send_response(503)
+            self.end_headers()
+            return
+        if self.path not in self.responses:
+            self.send_response(404)
+            self.end_headers()
+            return
+        content = self.responses[self.path].encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers["Content-Length"])).decode("utf-8")
+        cids = [int(cid) for cid in parse_qs(body)["cid"][0].split(",")]
+        with self.server.lock:
+            self.server.paths.append(self.path)
+            self.server.posted.append(cids)
+        if self.path != "/compound/cid/property/CanonicalSMILES/CSV":
+            self.send_response(404)
+            self.end_headers()
+            return
+        # PubChem may return a property under another name
+        rows = ['"CID","ConnectivitySMILES"'] + [f'{cid},"{self.smiles[cid]}"' for cid in cids if cid in self.smiles]
+        content = "\n".join(rows).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        pass
+
+@pytest.fixture
+def server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), MockPubChemHandler)
+    server.lock = threading.Lock()
+    server.paths = []
+    server.posted = []
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+@pytest.fixture
+def pubchem(server, tmp_path, monkeypatch):
+    monkeypatch.setenv("OPENPHARMACOPHORE_CACHE_DIR", str(tmp_path))
+    base_url = "http://127.0.0.1:{}".format(server.server_address[1])
+    return PubChem(base_url=base_url)
+
+def test_token_bucket():
+    now = [0.0]
+    waits = []
+    def sleep(seconds):
+        waits.append(seconds)
+        now[0] += seconds
+    bucket = TokenBucket(rate=2, capacity=2, clock=lambda: now[0], sleep=sleep)
+    assert [bucket.acquire() for _ in range(4)] == [0, 0, 0.5, 0.5]
+    now[0] += 10
+    # The bucket doesn't hold more tokens than its capacity
+    assert [bucket.acquire() for _ in range(3)] == [0, 0, 0.5]
+
+def test_get_assay_actives_and_inactives(pubchem, server):
+    actives, inactives = pubchem.get_assay_actives_and_inactives(1)
+    assert actives == ([1], ["CCN"])
+    assert inactives == ([2, 3], ["CCC", "CCO"])
+    n_requests = len(server.paths)
+    assert n_requests == 3
+
+    # Responses are cached on disk, so a new client doesn't send any request
+    cached = PubChem(base_url=pubchem.base_url)
+    assert cached.get_assay_actives_and_inactives(1) == (actives, inactives)
+    assert len(server.paths) == n_requests
+
+def test_get_assay_actives_and_inactives_missing_compound(pubchem):
+    actives, inactives = pubchem.get_assay_actives_and_inactives(2)
+    # Compounds without smiles are dropped, keeping ids and smiles aligned
+    assert actives == ([1], ["CCN"])
+    assert inactives == ([2], ["CCC"])
+    molecules, ids, labels = labelled_molecules(actives, inactives)
+    assert ids == [1, 2]
+
+def test_rest_client_retries(server, tmp_path):
+    base_url = "http://127.0.0.1:{}".format(server.server_address[1])
+    client = RestClient(cache=ResponseCache(cache_dir=str(tmp_path), ttl=0), backoff_factor=0)
+    assert client.get(base_url + "/busy") == b"ok"
+    assert server.paths == ["/busy", "/busy"]
+    # Entries with zero time to live are always downloaded again
+    client.get(base_url + "/busy")
+    assert len(server.paths) == 3
+
+    # Not found errors are not retried
+    with pytest.raises(FetchError):
+        client.get(base_url + "/missing")
+    assert server.paths.count("/missing") == 1
+
+def test_get_compounds_smiles(pubchem, server):
+    smiles = pubchem.get_compounds_smiles([4, 1, 99, 1, 2], chunk_size=2)
+    assert smiles == ["c1ccccc1", "CCN", None, "CCN", "CCC"]
+    # Duplicated ids are requested once
+    assert sorted(server.posted) == [[4, 1], [99, 2]]
+
+    df = pubchem.get_compounds_properties([3, 2])
+    assert list(df.columns) == ["CID", "CanonicalSMILES"]
+    assert df["CID"].tolist() == [3, 2]
+    assert df["CanonicalSMILES"].tolist() == ["CCO", "CCC"]
@@ -1,6 +1,8 @@
 from openpharmacophore.pharmacophore import Pharmacophore
 from openpharmacophore.pharmacophoric_point import PharmacophoricPoint
 from openpharmacophore.screening import screening, screening2D, screening3D
+from openpharmacophore.screening.batch_screening import labelled_molecules, screen_pharmacophores
+from openpharmacophore.screening.metrics import RankedScreen
 import numpy as np
 import pytest
 import pyunitwizard as puw
@@ -145,6 +147,41 @@ def test_screen_db_from_dir_3D():
         assert id is None
         assert isinstance(mol, Chem.Mol)
 
+@pytest.fixture
+def pharmacophores():
+    """ Returns a list with a pharmacophore of four points, one with its first two points
+        and one with a single point that doesn't match any of the molecules of mols.smi.
+    """
+    elements = [
+        PharmacophoricPoint("hb acceptor", puw.quantity([3.877, 7.014, 1.448], "angstroms"), puw.quantity(1.0, "angstroms")),
+        PharmacophoricPoint("hb acceptor", puw.quantity([7.22, 11.077, 5.625], "angstroms"), puw.quantity(1.0, "angstroms")),
+        PharmacophoricPoint("hb donor", puw.quantity([4.778, 8.432, 7.805], "angstroms"), puw.quantity(1.0, "angstroms")),
+        PharmacophoricPoint("aromatic ring", puw.quantity([1.564, 7.064, 3.135], "angstroms"), puw.quantity(1.0, "angstroms")),
+    ]
+    return [Pharmacophore(elements), Pharmacophore(elements[:2]),
+            Pharmacophore([PharmacophoricPoint("negative charge", puw.quantity([0, 0, 0], "angstroms"),
+                                               puw.quantity(1.0, "angstroms"))])]
+
+def test_screen_pharmacophores(pharmacophores):
+    with open("./openpharmacophore/data/ligands/mols.smi") as f:
+        smiles = [line.split()[0] for line in f if line.strip()]
+    molecules, ids, labels = labelled_molecules((["a1", "a2", "a3"], smiles[:2] + ["not a smiles"]), 
+                                                (["i1", "i2", "i3"], smiles[2:]))
+    # Smiles that can't be parsed are skipped
+    assert ids == ["a1", "a2", "i1", "i2", "i3"]
+    assert labels.tolist() == [True, True, False, False, False]
+    assert molecules[0].GetProp("_Name") == "a1"
+
+    scores, embeddings = screen_pharmacophores(pharmacophores, molecules, use_cache=False, return_embeddings=True)
+    assert scores.shape == (3, 5)
+    assert np.count_nonzero(~np.isnan(scores[0])) == 4
+    assert np.all(np.isnan(scores[2]))
+    for score, embedding in zip(scores[0], embeddings[0]):
+        assert np.isnan(score) == (embedding is None)
+
+    parallel_scores = screen_pharmacophores(pharmacophores, molecules, n_workers=2, chunk_size=2, use_cache=False)
+    assert np.all(np.isnan(parallel_scores) == np.isnan(scores))
+
 ### Tests for VirtrualScreening2D class ###
 def test_screen_db_from_dir_2D():
     file_path = "./openpharmacophore/data/ligands/mols.smi"
@@ -159,3 +196,145 @@ def test_screen_db_from_dir_2D():
     assert screener.matches[0][0] == 1.0
     assert screener.matches[0][1] is None
     assert isinstance(screener.matches[0][2], Chem.Mol)
+
+### Tests for RetrospectiveScreening class ###
+def test_ranked_screen_metrics():
+    # Actives are ranked 1st, 3rd and 6th, the last two molecules have no score
+    scores = np.array([0.9, 0.8, 0.7, 0.6, 0.5, 0.4, np.nan, np.nan])
+    labels = np.array([1, 0, 1, 0, 0, 1, 0, 0], dtype=bool)
+    ranked = RankedScreen(scores, labels)
+
+    assert ranked.auc() == pytest.approx(11 / 15)
+    fpr, tpr = ranked.roc_curve()
+    assert fpr[0] == 0 and tpr[0] == 0 and fpr[-1] == 1 and tpr[-1] == 1
+    assert np.allclose(ranked.enrichment_factor([0.125, 0.25, 1.0]), [8 / 3, 4 / 3, 1.0])
+    screened, found = ranked.enrichment_curve()
+    assert np.allclose(found[[1, 3, 6]], [1 / 3, 2 / 3, 1])
+    assert 0 < ranked.bedroc(alpha=20) <= 1
+
+    # Lower scores are better for SSD
+    assert RankedScreen(-scores, labels, higher_is_better=False).auc() == pytest.approx(11 / 15)
+    # Ties count as half a correct ranking
+    assert RankedScreen(np.ones(4), [1, 0, 1, 0]).auc() == pytest.approx(0.5)
+    # Weights are equivalent to repeating the molecules
+    weights = np.array([2, 0, 1, 1, 3, 1, 0, 2])
+    repeated = np.repeat(np.arange(8), weights)
+    expected = RankedScreen(scores[repeated], labels[repeated])
+    assert ranked.auc(weights=weights) == pytest.approx(expected.auc())
+    assert ranked.bedroc(weights=weights) == pytest.approx(expected.bedroc())
+    assert np.allclose(ranked.enrichment_factor([0.1, 0.5], weights=weights), 
+                       expected.enrichment_factor([0.1, 0.5]))
+
+    low, high = ranked.bootstrap("auc", n_bootstrap=200, random_state=0)
+    assert 0 <= low <= high <= 1
+    with pytest.raises(ValueError):
+        ranked.bootstrap("precision")
+
+def test_ranked_screen_ties():
+    # Molecules without a score are tied, so the order of the labels doesn't matter
+    labels = np.zeros(1000, dtype=bool)
+    labels[:50] = True
+    no_scores = np.full(1000, np.nan)
+    first, last = RankedScreen(no_scores, labels), RankedScreen(no_scores, labels[::-1])
+    assert first.enrichment_factor(0.01) == pytest.approx(1.0)
+    assert last.enrichment_factor(0.01) == pytest.approx(1.0)
+    assert first.bedroc() == pytest.approx(last.bedroc())
+    assert first.bedroc() < 0.2
+    assert np.allclose(first.enrichment_curve()[1], last.enrichment_curve()[1])
+
+    # Only ties are shuffled, the actives with the best score are still found first
+    scores = np.array([0.9, 0.9, 0.5, 0.5, np.nan, np.nan, np.nan, np.nan])
+    labels = np.array([1, 0, 1, 0, 1, 0, 0, 0], dtype=bool)
+    order = np.array([7, 6, 5, 4, 3, 2, 1, 0])
+    ranked, reversed_ = RankedScreen(scores, labels), RankedScreen(scores[order], labels[order])
+    assert np.allclose(ranked.enrichment_factor([0.125, 0.25, 0.5]), [4 / 3, 4 / 3, 4 / 3])
+    assert np.allclose(reversed_.enrichment_factor([0.125, 0.25, 0.5]), [4 / 3, 4 / 3, 4 / 3])
+    assert ranked.bedroc() == pytest.approx(reversed_.bedroc())
+
+def test_retrospective_screening_from_training_data():
+    screener = screening.RetrospectiveScreening(Pharmacophore())
+    # Fake screening function that only matches molecules with nitrogen atoms. The 
+    # score is the number of nitrogens
+    screener._screen_fn = lambda molecules: [
+        sum(atom.GetSymbol() == "N" for atom in mol.GetAtoms()) or np.nan for mol in molecules
+    ]
+    actives = (["a1", "a2", "a3"], ["CCN", "NCCN", "CCO"])
+    inactives = (["i1", "i2", "i3", "i4"], ["CCC", "CN", "c1ccccc1", "not a smiles"])
+    screener.from_training_data(actives, inactives)
+
+    assert screener.n_molecules == 6
+    assert screener.n_actives == 3
+    assert screener.n_inactives == 3
+    assert screener.n_true_actives == 2
+    assert screener.n_false_inactives == 1
+    assert screener.n_false_actives == 1
+    assert screener.n_true_inactives == 2
+    assert screener.mismatched_actives == ["a3"]
+    assert screener.mismatched_inactives == ["i2"]
+    assert screener.sensitivity() == pytest.approx(2 / 3)
+    assert screener.specificity() == pytest.approx(2 / 3)
+    assert screener.yield_of_actives() == pytest.approx(2 / 3)
+    assert screener.accuracy() == pytest.approx(4 / 6)
+    assert screener.enrichment_factor() == pytest.approx((2 / 3) / (3 / 6))
+    # a2 ranks first, a1 and i2 are tied
+    assert screener.AUC() == pytest.approx((1 + 2.5 / 3 + 1 / 3) / 3)
+    assert screener.enrichment_factor(fractions=1 / 6) == pytest.approx(2.0)
+
+def mols_file_training_data():
+    with open("./openpharmacophore/data/ligands/mols.smi") as f:
+        smiles = [line.split()[0] for line in f if line.strip()]
+    return (["a1", "a2"], smiles[:2]), (["i1", "i2", "i3"], smiles[2:])
+
+def test_retrospective_screening_2D():
+    actives, inactives = mols_file_training_data()
+    query = Chem.MolFromSmiles(actives[1][0])
+    screener = screening2D.RetrospectiveScreening2D(query, similarity="dice", sim_cutoff=0.6)
+    screener.from_training_data(actives, inactives)
+
+    assert screener.n_molecules == 5
+    assert screener.scores.shape == (5,)
+    assert screener.scores[0] == pytest.approx(1.0)
+    assert np.all((screener.scores >= 0) & (screener.scores <= 1))
+    assert screener.n_true_actives + screener.n_false_actives == np.count_nonzero(screener.scores >= 0.6)
+    assert "a1" not in screener.mismatched_actives
+    assert 0 <= screener.AUC() <= 1
+
+    with pytest.raises(ValueError):
+        screening2D.RetrospectiveScreening2D(query, sim_cutoff=1.5)
+
+def test_retrospective_screening_3D(pharmacophores):
+    actives, inactives = mols_file_training_data()
+    screener = screening3D.RetrospectiveScreening3D(pharmacophores[0], use_cache=False)
+    screener.from_training_data(actives, inactives)
+
+    expected = screen_pharmacophores(pharmacophores[:1], 
+                                     labelled_molecules(actives, inactives)[0], use_cache=False)[0]
+    assert np.all(np.isnan(screener.scores) == np.isnan(expected))
+    assert screener.n_molecules == 5
+    assert screener.n_true_actives + screener.n_false_actives == np.count_nonzero(~np.isnan(expected))
+    assert screener.n_true_actives + screener.n_false_inactives == 2
+
+def test_validation_matrix(pharmacophores):
+    actives, inactives = mols_file_training_data()
+    metrics, screeners = screening3D.RetrospectiveScreening3D.validation_matrix(
+        pharmacophores, actives, inactives, use_cache=False, fractions=(0.2, 0.5))
+    
+    assert list(metrics.columns) == ["True Actives", "False Actives", "Sensitivity", "Specificity", 
+                                     "Yield of Actives", "Enrichment Factor", "AUC", "BEDROC (20)", 
+                                     "EF 20%", "EF 50%"]
+    assert metrics.shape[0] == 3
+    assert len(screeners) == 3
+    
+    single = screening3D.RetrospectiveScreening3D(pharmacophores[0], use_cache=False)
+    single.from_training_data(actives, inactives)
+    assert metrics.loc[0, "True Actives"] == single.n_true_actives
+    assert metrics.loc[0, "AUC"] == pytest.approx(single.AUC())
+    # The last pharmacophore doesn't match any molecule
+    assert metrics.loc[2, "True Actives"] == 0 and metrics.loc[2, "False Actives"] == 0
+    assert np.isnan(metrics.loc[2, "Yield of Actives"])
+    assert metrics.loc[2, "AUC"] == pytest.approx(0.5)
+    # Unmatched molecules are tied, so there is no enrichment whatever the order of the labels
+    assert metrics.loc[2, "EF 20%"] == pytest.approx(1.0)
+    assert metrics.loc[2, "EF 50%"] == pytest.approx(1.0)
+    reversed_labels = np.array([False] * 3 + [True] * 2)
+    assert metrics.loc[2, "BEDROC (20)"] == pytest.approx(RankedScreen(np.full(5, np.nan), reversed_labels).bedroc())
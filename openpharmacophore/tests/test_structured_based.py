@@ -1,6 +1,7 @@
 from openpharmacophore.pharmacophoric_point import PharmacophoricPoint
 from openpharmacophore.structured_based import StructuredBasedPharmacophore as SBP
 from openpharmacophore.utils.conformers import generate_conformers
+from openpharmacophore.utils.interaction_cache import InteractionCache
 import numpy as np
 import pytest
 import pyunitwizard as puw
@@ -34,7 +35,7 @@ def test_from_pdb(file_name, ligand_id, hydrophobics):
         assert ring == pharmacophore.elements[0]
         hyd_1 = PharmacophoricPoint(
             feat_type="hydrophobicity",
-            center=puw.quantity((42.4462, -1.1092, 122.6226), "angstroms"),
+            center=puw.quantity((42.6643, -1.2303, 122.5733), "angstroms"),
             radius=puw.quantity(1.0, "angstroms")
         )
         assert hyd_1 == pharmacophore.elements[1]
@@ -191,6 +192,25 @@ def test_from_pdb(file_name, ligand_id, hydrophobics):
         assert hyd == pharmacophore.elements[5]
 
        
+def test_from_pdb_batch(tmp_path):
+    pdbs_path = "./openpharmacophore/data/pdb/"
+    output_dir = str(tmp_path)
+    log = SBP.from_pdb_batch(pdbs_path, output_dir, radius=1.0, hydrophobics="plip", n_workers=2)
+
+    assert list(log.columns) == ["pdb", "ligand_id", "n_points", "file_name", "time", "error"]
+    assert os.path.isfile(os.path.join(output_dir, "log.csv"))
+    assert log["error"].isna().all()
+    assert (log["time"] > 0).all()
+    for file_name in log["file_name"]:
+        assert os.path.isfile(file_name)
+
+    ncr_log = log[log["pdb"] == os.path.join(pdbs_path, "1ncr.pdb")]
+    assert ncr_log["ligand_id"].tolist() == ["W11:A:7001", "MYR:D:4000"]
+    assert ncr_log["n_points"].tolist()[0] == 5
+
+    pharmacophore = SBP.from_file(ncr_log["file_name"].tolist()[0])
+    assert len(pharmacophore.elements) == 5
+
 @pytest.mark.parametrize("file_name", [
     ("1ncr"),
     ("2hz1"),
@@ -219,6 +239,25 @@ def test_protein_ligand_interactions(file_name):
         assert ligands[0] == "JIN:A:600"
         assert ligands[1] == "JIN:B:600"
 
+def test_analyze_complex_with_cache(tmp_path):
+    file_path = "./openpharmacophore/data/pdb/1ncr.pdb"
+    cache = InteractionCache(cache_dir=str(tmp_path))
+
+    interactions, pdb_str, ligands = SBP._analyze_complex(file_path, as_string=False, cache=cache)
+    assert list(interactions.keys()) == ["W11:A:7001", "MYR:D:4000"]
+    assert list(ligands.keys()) == ["W11:A:7001", "MYR:D:4000"]
+    assert cache.misses == 1
+
+    # The same complex passed as a string is retrieved from disk by a new cache
+    cache = InteractionCache(cache_dir=str(tmp_path))
+    with open(file_path) as f:
+        cached = SBP._analyze_complex(f.read(), as_string=True, cache=cache)
+    assert cache.hits == 1
+    assert cached == (interactions, pdb_str, ligands)
+
+    points = SBP._sb_pharmacophore_points(cached[0]["W11:A:7001"], radius=1.0, ligand=None, hydrophobics="plip")
+    assert len(points) == 5
+
 @pytest.mark.parametrize("file_name", [
     ("1ncr"),
     ("2hz1"),
@@ -273,16 +312,44 @@ def test_sb_pharmacophore_points(file_name):
                 n_hydrophobics += 1
         assert n_hydrophobics == 3
     
+def test_plip_hydrophobics():
+    radius = puw.quantity(1.0, "angstroms")
+    centers = [
+        (0.0, 0.0, 0.0),
+        (10.0, 0.0, 0.0),
+        (2.0, 0.0, 0.0),
+        (0.0, 0.0, 0.0), # Repeated point
+        (4.0, 0.0, 0.0), # Too far from the seed at x=0, so it starts its own group
+    ]
+    hydrophobics = [
+        PharmacophoricPoint(
+            feat_type="hydrophobicity",
+            center=puw.quantity(center, "angstroms"),
+            radius=radius,
+            atoms_inxs=[inx]
+        ) for inx, center in enumerate(centers)
+    ]
+
+    grouped = SBP._plip_hydrophobics(hydrophobics, radius)
+    assert len(grouped) == 3
+    assert np.allclose(grouped[0].get_center(), (1.0, 0.0, 0.0))
+    assert grouped[0].atoms_inxs == {0, 2, 3}
+    assert np.allclose(grouped[1].get_center(), (10.0, 0.0, 0.0))
+    assert grouped[1].atoms_inxs == {1}
+    assert np.allclose(grouped[2].get_center(), (4.0, 0.0, 0.0))
+    assert grouped[2].atoms_inxs == {4}
+
 def test_rdkit_hydrophobics():
     
     ligand = Chem.MolFromSmiles("CC1=CC(=CC(=C1OCCCC2=CC(=NO2)C)C)C3=NOC(=N3)C(F)(F)F")
     ligand = generate_conformers(ligand, 1, random_seed=1)
     hydrophobics = SBP()._rdkit_hydrophobics(ligand, 1.0)
 
-    assert len(hydrophobics) == 2
+    # Three methyl groups and the propyl linker
+    assert len(hydrophobics) == 4
     
     hyd_1 = hydrophobics[0]
-    hyd_2 = hydrophobics[1]
+    hyd_2 = hydrophobics[3]
     hyd_2_center = puw.get_value(hyd_2.center, "angstroms")
     hyd_2_radius = puw.get_value(hyd_2.radius, "angstroms")
     assert hyd_1 == PharmacophoricPoint(
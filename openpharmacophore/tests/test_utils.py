@@ -1,11 +1,17 @@
 from openpharmacophore.pharmacophoric_point import PharmacophoricPoint
 from openpharmacophore.utils.direction_vector import aromatic_direction_vector, donor_acceptor_direction_vector
 from openpharmacophore.utils.load_custom_feats import load_smarts_fdef
+from openpharmacophore.utils.cache import Cache
+from openpharmacophore.utils.conformer_cache import ConformerCache
+from openpharmacophore.utils.frame_writer import PDBFrameWriter
 from openpharmacophore import utils
-from openpharmacophore.utils.ligand_features import ligands_pharmacophoric_points, rdkit_to_point
+from openpharmacophore.utils.ligand_features import (ligands_pharmacophoric_points, rdkit_to_point,
+    compile_feature_patterns, feature_sites)
 from rdkit import Chem
+import mdtraj as mdt
 import pyunitwizard as puw
 import numpy as np
+import os
 import pytest
 
 @pytest.fixture
@@ -17,6 +23,51 @@ def test_generate_conformers(sample_molecule):
     mol = utils.conformers.generate_conformers(molecule=sample_molecule, n_conformers=2)
     assert mol.GetNumConformers() == 2
 
+def test_generate_conformers_with_cache(sample_molecule, tmp_path):
+    cache = ConformerCache(max_size=1, cache_dir=str(tmp_path))
+    mol = utils.conformers.generate_conformers(sample_molecule, n_conformers=2, random_seed=1, cache=cache)
+    assert mol.GetNumConformers() == 2
+    assert cache.misses == 1
+    assert len(cache) == 1
+
+    # Same molecule with a different atom order must reuse the cached ensemble
+    n_atoms = sample_molecule.GetNumAtoms()
+    new_order = list(reversed(range(n_atoms)))
+    reordered = Chem.RenumberAtoms(sample_molecule, new_order)
+    reordered_mol = utils.conformers.generate_conformers(reordered, n_conformers=2, random_seed=1, cache=cache)
+    assert reordered_mol.GetNumConformers() == 2
+    assert cache.hits == 1
+
+    # Symmetric atoms may be permuted, so compare the sets of coordinates
+    positions = sorted(map(tuple, np.around(mol.GetConformer(1).GetPositions(), 4)))
+    reordered_positions = sorted(map(tuple, np.around(reordered_mol.GetConformer(1).GetPositions(), 4)))
+    assert positions == reordered_positions
+
+    # A new cache reads the ensemble from disk
+    disk_cache = ConformerCache(cache_dir=str(tmp_path))
+    utils.conformers.generate_conformers(sample_molecule, n_conformers=2, random_seed=1, cache=disk_cache)
+    assert disk_cache.hits == 1
+    assert disk_cache.misses == 0
+
+    # Conformers with a random seed are not cached
+    mol = utils.conformers.generate_conformers(sample_molecule, n_conformers=2, cache=disk_cache)
+    assert mol.GetNumConformers() == 2
+    assert disk_cache.hits == 1 and disk_cache.misses == 0
+    assert len(os.listdir(tmp_path)) == 1
+
+def test_cache_max_disk_size(tmp_path):
+    cache = Cache(max_size=1, cache_dir=str(tmp_path), max_disk_size=25)
+    for time, key in enumerate(["a", "b", "c"], 1):
+        cache.put_bytes(key, b"0123456789")
+        # Entries are written at increasing times
+        os.utime(tmp_path / (key + ".bin"), (time, time))
+    # The least recently used entry is deleted
+    assert sorted(os.listdir(tmp_path)) == ["b.bin", "c.bin"]
+    assert cache.get_bytes("b") == b"0123456789"
+
+    cache.put_bytes("d", b"0123456789")
+    assert sorted(os.listdir(tmp_path)) == ["b.bin", "d.bin"]
+
 def test_feature_centroid(sample_molecule):
     mol = utils.conformers.generate_conformers(molecule=sample_molecule, n_conformers=1, random_seed=1)
 
@@ -74,11 +125,25 @@ def test_ligands_pharmacophoric_points(radius, feat_def,):
         assert negative.radius == points[3].radius
     
     elif feat_def == "custom":
-        assert len(points) == 3
+        assert len(points) == 4
         assert acceptor.feature_name == points[0].feature_name
         assert np.all(acceptor.center == points[0].center)
         assert acceptor.radius == points[0].radius
 
+def test_feature_sites():
+    # Diethylenetriamine has three donor nitrogens
+    molecule = Chem.MolFromSmiles("NCCNCCN")
+    feat_def = load_smarts_fdef(fname="openpharmacophore/data/smarts_features.txt")
+    patterns = compile_feature_patterns(feat_def, feat_list=["Donor"])
+
+    sites = feature_sites(molecule, patterns)
+    donors = [atom_idxs for feat_name, atom_idxs in sites if feat_name == "Donor"]
+    assert len(sites) == 3
+    assert sorted(donors) == [(0,), (3,), (6,)]
+
+    sites = feature_sites(molecule, patterns, max_matches=1)
+    assert len(sites) == 1
+
 def test_rdkit_to_point():
     aromatic_sphere = rdkit_to_point("Aromatic", [0.0, 1.0, 1.0], radius=1.0)  
     assert isinstance(aromatic_sphere, PharmacophoricPoint)
@@ -128,4 +193,35 @@ def test_donor_acceptor_direction_vector(benzoic_acid):
     assert donor_vector.shape[0] == 3
     assert acceptor_vector.shape[0] == 3
     assert np.all(np.around(np.array([0.7275082, 0.87517266, 0.7830512]), 2) == np.around(donor_vector, 2))
-    assert np.all(np.around(np.array([-0.62292014, 0.7957192 , 0.73807555]), 2) == np.around(acceptor_vector, 2))
\ No newline at end of file
+    assert np.all(np.around(np.array([-0.62292014, 0.7957192 , 0.73807555]), 2) == np.around(acceptor_vector, 2))
+
+def test_pdb_frame_writer(tmp_path):
+    traj = mdt.load("./openpharmacophore/data/pdb/2hzi.pdb")
+    traj = mdt.Trajectory(np.stack([traj.xyz[0], traj.xyz[0] + 0.1]), traj.topology)
+    writer = PDBFrameWriter.from_mdtraj(traj)
+    assert writer.n_atoms == traj.n_atoms
+
+    file_name = str(tmp_path / "frame.pdb")
+    traj[1].save_pdb(file_name)
+    with open(file_name) as f:
+        expected = "".join(line for line in f if not line.startswith("MODEL"))
+    assert writer.write(traj.xyz[1] * 10) == expected
+
+    with pytest.raises(ValueError):
+        writer.write(traj.xyz[1][:10])
+
+def test_conformers_energies(sample_molecule):
+    mol = utils.conformers.generate_conformers(sample_molecule, n_conformers=2, random_seed=1)
+    molecules = []
+    for conformer in mol.GetConformers():
+        molecule = Chem.Mol(mol)
+        molecule.RemoveAllConformers()
+        molecule.AddConformer(Chem.Conformer(conformer), assignId=True)
+        molecules.append(molecule)
+    # Repeated geometries are evaluated once
+    molecules.append(molecules[0])
+
+    expected = [utils.conformers.conformer_energy(molecule) for molecule in molecules]
+    energies = utils.conformers.conformers_energies(molecules)
+    assert np.allclose(energies, expected)
+    assert energies[0] == energies[2]
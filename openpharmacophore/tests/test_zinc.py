@@ -1,4 +1,8 @@
+from openpharmacophore.databases import zinc
 from openpharmacophore.databases.zinc import get_zinc_urls, discretize_values
+from openpharmacophore.screening.screening import VirtualScreening
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import threading
 import pytest
 
 @pytest.mark.parametrize("subset,mol_weight,logp,format", [
@@ -59,4 +63,80 @@ def test_discretize_values(value, lower):
     elif value == 484:
         assert new_value == 500
     else:
-        assert new_value == 550
\ No newline at end of file
+        assert new_value == 550
+
+class MockZINCHandler(BaseHTTPRequestHandler):
+    """ Serves ZINC 2D smiles files. Files of the EB subtranche don't exist. """
+
+    def do_GET(self):
+        with self.server.lock:
+            self.server.paths.append(self.path)
+        if self.path.endswith("EB.smi"):
+            self.send_response(404)
+            self.end_headers()
+            return
+        zinc_id = self.path.split("/")[-1][:-4]
+        content = "smiles zinc_id\nCCO ZINC{}1\nCCN ZINC{}2\n".format(zinc_id, zinc_id).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        pass
+
+@pytest.fixture
+def zinc_server(monkeypatch):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), MockZINCHandler)
+    server.lock = threading.Lock()
+    server.paths = []
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    monkeypatch.setattr(zinc, "ZINC_FILES_URL", "http://127.0.0.1:{}/".format(server.server_address[1]))
+    yield server
+    server.shutdown()
+    server.server_close()
+
+def test_zinc_mirror(zinc_server, tmp_path):
+    selection = {"subset": None, "mw_range": (250, 300), "logp_range": (-1, 0)}
+    mirror = zinc.ZINCMirror(str(tmp_path))
+    failed = mirror.sync(**selection)
+    # Tranches BA, BB, CA and CB with 8 files each, 1 of them missing
+    assert len(zinc_server.paths) == 32
+    assert len(failed) == 4
+    assert len(mirror.index) == 28
+    assert mirror.index["2D/BA/BAAA.smi"]["n_molecules"] == 2
+
+    files = mirror.files(**selection)
+    assert sorted(files) == ["BA", "BB", "CA", "CB"]
+    assert all(len(tranche_files) == 7 for tranche_files in files.values())
+    summary = mirror.summary()
+    assert summary["Molecules"].tolist() == [14, 14, 14, 14]
+
+    # The index is persisted and files already in the mirror are not downloaded again
+    mirror = zinc.ZINCMirror(str(tmp_path))
+    mirror.sync(**selection)
+    assert len(zinc_server.paths) == 32 + 4
+    assert mirror.verify() == []
+
+    with open(files["BA"][0], "w") as f:
+        f.write("smiles zinc_id\nCCC ZINC0\nCCC ZINC9\n")
+    assert mirror.verify() == ["2D/BA/BAAA.smi"]
+
+def test_screen_ZINC_from_mirror(zinc_server, tmp_path):
+    screener = VirtualScreening(pharmacophore=None)
+    screened = []
+    screener._screen_fn = lambda molecules: screened.extend(molecules)
+    # The files of the EB subtranche can't be downloaded
+    with pytest.warns(UserWarning, match="4 ZINC files couldn't be downloaded"):
+        screener.screen_ZINC(subset=None, mw_range=(250, 300), logp_range=(-1, 0), mirror=str(tmp_path))
+    assert len(screened) == 56
+    assert screener.db == "ZINC"
+
+    n_requests = len(zinc_server.paths)
+    with pytest.warns(UserWarning, match="EB.smi"):
+        screener.screen_ZINC(subset=None, mw_range=(250, 300), logp_range=(-1, 0),
+                             mirror=zinc.ZINCMirror(str(tmp_path)))
+    assert len(screened) == 112
+    # Only the files that don't exist are requested again
+    assert len(zinc_server.paths) == n_requests + 4
@@ -2,10 +2,14 @@ from rdkit import Chem
 from rdkit.Chem import rdMolDescriptors
 from rdkit.Chem import rdMolAlign
 from openpharmacophore.utils.conformers import generate_conformers
+from openpharmacophore.utils.conformer_cache import get_default_cache
 import numpy as np
 import copy
 
-def align_set_of_ligands(ligands):
+# Random seed of the conformers that are cached
+_CONFORMERS_SEED = 42
+
+def align_set_of_ligands(ligands, use_cache=True):
     """
         Align a set of ligands to each other
 
@@ -13,6 +17,11 @@ def align_set_of_ligands(ligands):
         ----------
         ligands: :obj: list of rdkit.Chem.rdchem.Mol rdkit.Chem.SmilesMolSupplier or rdkit.Chem.SDMolSupplier
             List of ligands
+
+        use_cache: bool
+            If true conformers are generated with a fixed random seed, so they are taken from
+            the default conformer cache when the ligands have already been embedded. Otherwise
+            a random seed is used. (Default: True)
         
         Returns
         ----------
@@ -28,7 +37,11 @@ def align_set_of_ligands(ligands):
         ligands = list(ligands)
 
     molecules = copy.deepcopy(ligands)
-    molecules = [generate_conformers(mol, 100) for mol in molecules]
+    if use_cache:
+        molecules = [generate_conformers(mol, 100, random_seed=_CONFORMERS_SEED, cache=get_default_cache()) 
+                     for mol in molecules]
+    else:
+        molecules = [generate_conformers(mol, 100) for mol in molecules]
 
     crippen_contribs = [rdMolDescriptors._CalcCrippenContribs(mol) for mol in molecules]
     crippen_ref_contrib = crippen_contribs[0]
@@ -0,0 +1,193 @@
+from collections import OrderedDict
+import os
+import tempfile
+
+def cache_root_dir():
+    """ Get the directory where openpharmacophore persists cached data.
+
+        The directory is given by the environment variable OPENPHARMACOPHORE_CACHE_DIR
+        or defaults to ~/.cache/openpharmacophore. It can be deleted safely to clear all
+        the caches, or a single cache can be cleared with its clear(disk=True) method.
+
+        Returns
+        -------
+        str
+            The directory path.
+    """
+    default_dir = os.path.join(os.path.expanduser("~"), ".cache", "openpharmacophore")
+    return os.environ.get("OPENPHARMACOPHORE_CACHE_DIR", default_dir)
+
+# Maximum size in bytes of the on-disk tier of the default caches
+DEFAULT_MAX_DISK_SIZE = 2 ** 30
+
+
+class Cache():
+    """ Base class for caches of binary data with an in-memory tier with least recently
+        used eviction and an optional on-disk tier.
+
+    Parameters
+    ----------
+    max_size: int
+        Maximum number of entries kept in memory. (Default: 128)
+
+    cache_dir: str (optional)
+        Directory where entries are persisted. If None only the in-memory tier is used.
+
+    max_disk_size: int (optional)
+        Maximum size in bytes of the on-disk tier. When it's exceeded the least recently
+        used entries are deleted. If None the size is not limited.
+
+    Attributes
+    ----------
+    hits: int
+        Number of lookups that found an entry in the cache.
+
+    misses: int
+        Number of lookups that didn't find an entry in the cache.
+
+    """
+    extension = ".bin"
+
+    def __init__(self, max_size=128, cache_dir=None, max_disk_size=None):
+        if max_size < 1:
+            raise ValueError("max_size must be greater than 0")
+        self.max_size = max_size
+        self.cache_dir = cache_dir
+        self.max_disk_size = max_disk_size
+        # Estimated size of the on-disk tier. Other processes may write to the same
+        # directory, so it is measured again before deleting entries.
+        self._disk_size = None
+        self.hits = 0
+        self.misses = 0
+        self._memory = OrderedDict()
+
+    def get_bytes(self, key):
+        """ Get the data of an entry.
+
+            Parameters
+            ----------
+            key: str
+                The key of the entry.
+
+            Returns
+            -------
+            bytes or None
+                The data. None if the entry is not in the cache.
+        """
+        if key in self._memory:
+            self._memory.move_to_end(key)
+            self.hits += 1
+            return self._memory[key]
+
+        file_name = self._file_name(key)
+        if file_name is not None and os.path.isfile(file_name):
+            with open(file_name, "rb") as f:
+                data = f.read()
+            if self.max_disk_size is not None:
+                # The modification time orders entries from least to most recently used
+                try:
+                    os.utime(file_name)
+                except OSError:
+                    pass
+            self._store_in_memory(key, data)
+            self.hits += 1
+            return data
+
+        self.misses += 1
+        return None
+
+    def put_bytes(self, key, data):
+        """ Store the data of an entry.
+
+            Parameters
+            ----------
+            key: str
+                The key of the entry.
+
+            data: bytes
+                The data.
+        """
+        self._store_in_memory(key, data)
+
+        file_name = self._file_name(key)
+        if file_name is not None:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            # Write to a temporary file first so concurrent readers never see a partial file
+            fd, temp_name = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(temp_name, file_name)
+            if self.max_disk_size is not None:
+                if self._disk_size is None:
+                    self._disk_size = sum(size for _, _, size in self._disk_entries())
+                else:
+                    self._disk_size += len(data)
+                if self._disk_size > self.max_disk_size:
+                    self._evict_from_disk()
+
+    def clear(self, disk=False):
+        """ Remove all the entries from the cache.
+
+            Parameters
+            ----------
+            disk: bool
+                If true the entries stored on disk are deleted as well. (Default: False)
+        """
+        self._memory.clear()
+        if disk and self.cache_dir is not None and os.path.isdir(self.cache_dir):
+            for file_name in os.listdir(self.cache_dir):
+                if file_name.endswith(self.extension):
+                    os.remove(os.path.join(self.cache_dir, file_name))
+            self._disk_size = 0
+
+    def _disk_entries(self):
+        """ Get the modification time, name and size of the files of the on-disk tier.
+        """
+        entries = []
+        for file_name in os.listdir(self.cache_dir):
+            if not file_name.endswith(self.extension):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.cache_dir, file_name))
+            except OSError:
+                # Deleted by another process
+                continue
+            entries.append((stat.st_mtime, file_name, stat.st_size))
+        return entries
+
+    def _evict_from_disk(self):
+        """ Delete the least recently used files of the on-disk tier until its size is
+            below the limit.
+        """
+        entries = sorted(self._disk_entries())
+        self._disk_size = sum(size for _, _, size in entries)
+        for _, file_name, size in entries:
+            if self._disk_size <= self.max_disk_size:
+                break
+            try:
+                os.remove(os.path.join(self.cache_dir, file_name))
+            except OSError:
+                pass
+            self._disk_size -= size
+
+    def _store_in_memory(self, key, data):
+        """ Store the data of an entry in the memory tier, evicting the least
+            recently used entry if the cache is full.
+        """
+        self._memory[key] = data
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_size:
+            self._memory.popitem(last=False)
+
+    def _file_name(self, key):
+        """ Get the name of the file of an entry in the disk tier.
+        """
+        if self.cache_dir is None:
+            return None
+        return os.path.join(self.cache_dir, key + self.extension)
+
+    def __len__(self):
+        return len(self._memory)
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}(n_entries: {len(self)}; hits: {self.hits}; misses: {self.misses})"
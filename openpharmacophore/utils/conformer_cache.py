@@ -0,0 +1,183 @@
+from openpharmacophore.utils.cache import Cache, cache_root_dir, DEFAULT_MAX_DISK_SIZE
+from rdkit import Chem, Geometry
+import hashlib
+import json
+import os
+
+class ConformerCache(Cache):
+    """ Content-addressed cache of conformer ensembles.
+
+        Ensembles are keyed by the canonical smiles of the molecule plus the parameters
+        used to embed it. They are stored with the atoms in canonical order, so the same
+        molecule read with a different atom order shares the cached ensemble.
+
+        The cache has an in-memory tier with least recently used eviction and an optional
+        on-disk tier, so conformers can be reused across sessions.
+
+        Inherits from Cache.
+
+    Parameters
+    ----------
+    max_size: int
+        Maximum number of ensembles kept in memory. (Default: 128)
+
+    cache_dir: str (optional)
+        Directory where ensembles are persisted. If None only the in-memory tier is used.
+
+    max_disk_size: int (optional)
+        Maximum size in bytes of the on-disk tier. When it's exceeded the least recently
+        used ensembles are deleted. If None the size is not limited.
+
+    """
+    extension = ".rdmol"
+
+    @staticmethod
+    def canonical_ranks(molecule):
+        """ Get the canonical rank of each atom of a molecule.
+
+            Parameters
+            ----------
+            molecule: rdkit.Chem.Mol
+                A molecule with explicit hydrogens.
+
+            Returns
+            -------
+            list of int
+                The canonical position of each atom.
+        """
+        return list(Chem.CanonicalRankAtoms(molecule, breakTies=True))
+
+    @staticmethod
+    def key(molecule, **params):
+        """ Get the key of the ensemble of a molecule embedded with the given parameters.
+
+            Parameters
+            ----------
+            molecule: rdkit.Chem.Mol
+                The molecule.
+
+            params:
+                Parameters used to embed the molecule. Values must be serializable to json.
+
+            Returns
+            -------
+            str
+                Hexadecimal digest that identifies the ensemble.
+        """
+        smiles = Chem.MolToSmiles(Chem.RemoveHs(molecule))
+        content = json.dumps([smiles, params], sort_keys=True)
+        return hashlib.sha1(content.encode("utf8")).hexdigest()
+
+    def get(self, key):
+        """ Get a cached ensemble.
+
+            Parameters
+            ----------
+            key: str
+                The key of the ensemble.
+
+            Returns
+            -------
+            rdkit.Chem.Mol or None
+                Molecule in canonical atom order with the conformers of the ensemble. None if
+                the ensemble is not in the cache.
+        """
+        data = self.get_bytes(key)
+        if data is None:
+            return None
+        return Chem.Mol(data)
+
+    def put(self, key, molecule):
+        """ Store an ensemble in the cache.
+
+            Parameters
+            ----------
+            key: str
+                The key of the ensemble.
+
+            molecule: rdkit.Chem.Mol
+                Molecule in canonical atom order with the conformers of the ensemble.
+        """
+        self.put_bytes(key, molecule.ToBinary())
+
+
+def to_canonical_order(molecule, ranks):
+    """ Renumber the atoms of a molecule to their canonical order.
+
+        Parameters
+        ----------
+        molecule: rdkit.Chem.Mol
+            The molecule.
+
+        ranks: list of int
+            Canonical rank of each atom, as returned by ConformerCache.canonical_ranks.
+
+        Returns
+        -------
+        rdkit.Chem.Mol
+            The renumbered molecule.
+    """
+    order = sorted(range(len(ranks)), key=lambda i: ranks[i])
+    return Chem.RenumberAtoms(molecule, order)
+
+def copy_conformers(canonical_molecule, molecule, ranks):
+    """ Copy the conformers of a molecule in canonical atom order to the same molecule
+        in its original atom order.
+
+        Parameters
+        ----------
+        canonical_molecule: rdkit.Chem.Mol
+            Molecule in canonical atom order with the conformers.
+
+        molecule: rdkit.Chem.Mol
+            Molecule that will receive the conformers. It must have the same atoms as the
+            canonical molecule, hydrogens included.
+
+        ranks: list of int
+            Canonical rank of each atom of molecule.
+
+        Returns
+        -------
+        list of int
+            The ids of the added conformers.
+    """
+    n_atoms = molecule.GetNumAtoms()
+    conformer_ids = []
+    for canonical_conformer in canonical_molecule.GetConformers():
+        positions = canonical_conformer.GetPositions()[ranks]
+        conformer = Chem.Conformer(n_atoms)
+        for ii in range(n_atoms):
+            x, y, z = positions[ii]
+            conformer.SetAtomPosition(ii, Geometry.Point3D(float(x), float(y), float(z)))
+        conformer.Set3D(True)
+        conformer_ids.append(molecule.AddConformer(conformer, assignId=True))
+    return conformer_ids
+
+
+_default_cache = ConformerCache(cache_dir=os.path.join(cache_root_dir(), "conformers"),
+                                max_disk_size=DEFAULT_MAX_DISK_SIZE)
+
+def get_default_cache():
+    """ Get the conformer cache used by default by openpharmacophore.
+
+        The on-disk tier is stored in the conformers subdirectory of the directory given by
+        the environment variable OPENPHARMACOPHORE_CACHE_DIR or of ~/.cache/openpharmacophore,
+        and is limited to 1 GiB. It can be emptied with get_default_cache().clear(disk=True).
+
+        Returns
+        -------
+        ConformerCache or None
+            The default cache. None if caching has been disabled.
+    """
+    return _default_cache
+
+def set_default_cache(cache):
+    """ Set the conformer cache used by default by openpharmacophore.
+
+        Parameters
+        ----------
+        cache: ConformerCache or None
+            The new default cache. Pass None to disable caching.
+    """
+    global _default_cache
+    _default_cache = cache
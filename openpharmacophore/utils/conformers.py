@@ -1,9 +1,13 @@
 from rdkit import Chem
 from rdkit.Chem import AllChem
+import numpy as np
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
 
 from openpharmacophore._private_tools.exceptions import NoConformersError
+from openpharmacophore.utils.conformer_cache import copy_conformers, to_canonical_order
 
-def generate_conformers(molecule, n_conformers, random_seed=-1, alignment=False):
+def generate_conformers(molecule, n_conformers, random_seed=-1, alignment=False, cache=None):
     """Generate conformers for a molecule
     
         Parameters
@@ -15,10 +19,16 @@ def generate_conformers(molecule, n_conformers, random_seed=-1, alignment=False)
             number of conformers to generate
 
         random_seed: float or int 
-            random seed to use
+            random seed to use. If -1 a random seed is used. (Default: -1)
 
         alignment: bool
             If true generated conformers will be aligned (Default: False)
+
+        cache: openpharmacophore.utils.conformer_cache.ConformerCache (optional)
+            If passed, the conformers are taken from the cache when the same molecule has 
+            already been embedded with the same parameters, and stored in it otherwise. 
+            Conformers generated with a random seed are not cached, so that every call 
+            gives a new ensemble.
         
         Returns
         -------
@@ -27,10 +37,26 @@ def generate_conformers(molecule, n_conformers, random_seed=-1, alignment=False)
     
     """
     molecule = Chem.AddHs(molecule) # Add hydrogens to generate realistic geometries
-    cids = AllChem.EmbedMultipleConfs(molecule, numConfs=n_conformers, randomSeed=random_seed)
+    if cache is None or random_seed == -1:
+        cids = AllChem.EmbedMultipleConfs(molecule, numConfs=n_conformers, randomSeed=random_seed)
+        if alignment:
+            AllChem.AlignMolConformers(molecule)
+        return molecule
+
+    key = cache.key(molecule, method="EmbedMultipleConfs", n_conformers=n_conformers, 
+                    random_seed=random_seed, alignment=alignment)
+    ranks = cache.canonical_ranks(molecule)
+    ensemble = cache.get(key)
+    if ensemble is None:
+        # Embed the molecule in canonical atom order, so the ensemble can be shared by 
+        # molecules read with a different atom order.
+        ensemble = to_canonical_order(molecule, ranks)
+        cids = AllChem.EmbedMultipleConfs(ensemble, numConfs=n_conformers, randomSeed=random_seed)
+        if alignment:
+            AllChem.AlignMolConformers(ensemble)
+        cache.put(key, ensemble)
     
-    if alignment:
-        AllChem.AlignMolConformers(molecule)
+    copy_conformers(ensemble, molecule, ranks)
     return molecule
 
 def conformer_energy(molecule, conformer_id=0, forcefield="UFF"):
@@ -53,10 +79,105 @@ def conformer_energy(molecule, conformer_id=0, forcefield="UFF"):
     if molecule.GetNumConformers() == 0:
         raise NoConformersError("Molecule must have at least one conformer")
 
+    ff = _create_forcefield(molecule, forcefield, conformer_id)
+    return ff.CalcEnergy()
+
+def _create_forcefield(molecule, forcefield="UFF", conformer_id=0):
+    """ Create a UFF or MMFF forcefield for a conformer of a molecule.
+    """
     if forcefield == "UFF":
-        ff = AllChem.UFFGetMoleculeForceField(molecule, confId=conformer_id)
+        return AllChem.UFFGetMoleculeForceField(molecule, confId=conformer_id)
     elif forcefield == "MMFF":
         props = AllChem.MMFFGetMoleculeProperties(molecule)
-        ff = AllChem.MMFFGetMoleculeForceField(molecule, props, confId=conformer_id)
+        return AllChem.MMFFGetMoleculeForceField(molecule, props, confId=conformer_id)
+    raise ValueError(f"{forcefield} is not a valid forcefield. Valid forcefields are UFF and MMFF")
+
+def _topology_key(molecule):
+    """ Get a hashable key that is equal for molecules with the same atoms and bonds
+        in the same order.
+    """
+    atoms = tuple(atom.GetAtomicNum() for atom in molecule.GetAtoms())
+    bonds = tuple(
+        (bond.GetBeginAtomIdx(), bond.GetEndAtomIdx(), bond.GetBondTypeAsDouble()) 
+        for bond in molecule.GetBonds()
+    )
+    return atoms, bonds
+
+def _forcefield_energies(molecule, coordinates, forcefield="UFF"):
+    """ Get the energies of a set of geometries of a molecule. The forcefield is set up 
+        once and only the coordinates are updated for each geometry.
 
-    return ff.CalcEnergy()
\ No newline at end of file
+        Returns
+        -------
+        list of float
+    """
+    ff = _create_forcefield(molecule, forcefield)
+    return [ff.CalcEnergy(positions.ravel().tolist()) for positions in coordinates]
+
+def conformers_energies(molecules, forcefield="UFF", n_workers=1, chunk_size=256):
+    """ Get the energy of the first conformer of each molecule in a list. 
+    
+        Molecules with the same topology, such as the ligand in different frames of a
+        trajectory, share a single forcefield set up, and identical geometries are 
+        evaluated only once. 
+
+        Parameters
+        ----------
+        molecules: list of rdkit.Chem.Mol
+            The molecules.
+
+        forcefield: str, optional, default "UFF".
+            The forcefield that will be used. Can be "UFF" or "MMFF".
+
+        n_workers: int, optional, default 1
+            Number of processes used to compute the energies. If None the number of 
+            processors of the machine is used.
+
+        chunk_size: int, optional, default 256
+            Maximum number of geometries evaluated by each task.
+
+        Returns
+        -------
+        numpy.ndarray
+            The energy of each molecule.
+    """
+    groups = defaultdict(list)
+    for ii, molecule in enumerate(molecules):
+        if molecule.GetNumConformers() == 0:
+            raise NoConformersError("Molecule must have at least one conformer")
+        groups[_topology_key(molecule)].append(ii)
+    
+    tasks = []
+    # Indices of the molecules of each group and the unique geometry of each one
+    layouts = []
+    for indices in groups.values():
+        coordinates = np.array([molecules[ii].GetConformer().GetPositions() for ii in indices])
+        rounded = np.round(coordinates, 4).reshape(len(indices), -1)
+        _, unique_rows, inverse = np.unique(rounded, axis=0, return_index=True, return_inverse=True)
+        unique_coordinates = coordinates[unique_rows]
+        template = molecules[indices[0]]
+        for start in range(0, unique_coordinates.shape[0], chunk_size):
+            tasks.append((template, unique_coordinates[start:start + chunk_size]))
+        layouts.append((indices, inverse.reshape(-1)))
+    
+    if n_workers == 1:
+        results = [_forcefield_energies(template, coordinates, forcefield) for template, coordinates in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            futures = [
+                executor.submit(_forcefield_energies, template, coordinates, forcefield) 
+                for template, coordinates in tasks
+            ]
+            results = [future.result() for future in futures]
+    
+    # Tasks were created group by group, so the results are consumed in the same order
+    energies = np.empty(len(molecules))
+    results = iter(results)
+    for indices, inverse in layouts:
+        n_unique = inverse.max() + 1
+        unique_energies = []
+        while len(unique_energies) < n_unique:
+            unique_energies.extend(next(results))
+        energies[indices] = np.array(unique_energies)[inverse]
+    
+    return energies
@@ -0,0 +1,128 @@
+from MDAnalysis.lib.util import NamedStream
+import numpy as np
+from io import StringIO
+import os
+import tempfile
+
+class PDBFrameWriter():
+    """ Write the frames of a trajectory as pdb text in memory.
+
+        The text of every record that doesn't depend on the coordinates (header, atom names,
+        residues, chains, connectivity) is built once from a template, so writing a frame
+        only requires formatting the coordinates of its atoms.
+
+    Parameters
+    ----------
+    template: str
+        A pdb, as a string, of any frame of the trajectory. MODEL records are removed.
+
+    Attributes
+    ----------
+    n_atoms: int
+        Number of atoms of each frame.
+
+    """
+    def __init__(self, template):
+        # Text between consecutive atom records, the atom records without coordinates
+        self._static_text = []
+        self._atom_prefixes = []
+        self._atom_suffixes = []
+
+        text = []
+        for line in template.splitlines(keepends=True):
+            if line.startswith("MODEL"):
+                continue
+            if line.startswith("ATOM") or line.startswith("HETATM"):
+                self._static_text.append("".join(text))
+                text = []
+                # Columns 31-54 hold the x, y and z coordinates
+                self._atom_prefixes.append(line[:30])
+                self._atom_suffixes.append(line[54:])
+            else:
+                text.append(line)
+        self._static_text.append("".join(text))
+        self.n_atoms = len(self._atom_prefixes)
+
+    @classmethod
+    def from_mdtraj(cls, trajectory):
+        """ Create a writer for an mdtraj trajectory.
+
+            Parameters
+            ----------
+            trajectory: mdtraj.Trajectory
+                The trajectory.
+
+            Returns
+            -------
+            PDBFrameWriter
+        """
+        # mdtraj can only write pdbs to files, so the template is written once to a temporary file
+        fd, file_name = tempfile.mkstemp(suffix=".pdb")
+        os.close(fd)
+        try:
+            trajectory[0].save_pdb(file_name)
+            with open(file_name, "r") as f:
+                template = f.read()
+        finally:
+            os.remove(file_name)
+        return cls(template)
+
+    @classmethod
+    def from_mdanalysis(cls, universe):
+        """ Create a writer for an MDAnalysis universe.
+
+            Parameters
+            ----------
+            universe: MDAnalysis.Universe
+                The universe.
+
+            Returns
+            -------
+            PDBFrameWriter
+        """
+        pdb_stream = NamedStream(StringIO(), "template.pdb")
+        universe.atoms.write(pdb_stream, frames=universe.trajectory[[0]])
+        return cls(pdb_stream.getvalue())
+
+    def write(self, coordinates):
+        """ Get the pdb of a frame.
+
+            Parameters
+            ----------
+            coordinates: numpy.ndarray of shape (n_atoms, 3)
+                The coordinates of the atoms in angstroms.
+
+            Returns
+            -------
+            str
+                The pdb as a string.
+        """
+        coordinates = np.asarray(coordinates)
+        if coordinates.shape != (self.n_atoms, 3):
+            raise ValueError(f"Expected coordinates of shape ({self.n_atoms}, 3), got {coordinates.shape}")
+
+        text = []
+        for static_text, prefix, coords, suffix in zip(
+                self._static_text, self._atom_prefixes, coordinates.tolist(), self._atom_suffixes):
+            text.append(static_text)
+            text.append(prefix)
+            text.append("%8.3f%8.3f%8.3f" % tuple(coords))
+            text.append(suffix)
+        text.append(self._static_text[-1])
+        return "".join(text)
+
+    def write_stream(self, coordinates):
+        """ Get the pdb of a frame as a stream that can be passed to
+            StructuredBasedPharmacophore.from_pdb.
+
+            Parameters
+            ----------
+            coordinates: numpy.ndarray of shape (n_atoms, 3)
+                The coordinates of the atoms in angstroms.
+
+            Returns
+            -------
+            MDAnalysis.lib.util.NamedStream
+                Stream containing the pdb.
+        """
+        return NamedStream(StringIO(self.write(coordinates)), "frame.pdb")
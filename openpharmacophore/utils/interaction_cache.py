@@ -0,0 +1,194 @@
+from openpharmacophore.utils.cache import Cache, cache_root_dir, DEFAULT_MAX_DISK_SIZE
+import hashlib
+import json
+import os
+
+class InteractionCache(Cache):
+    """ Content-addressed cache of the protein-ligand interactions computed by plip.
+
+        Entries are keyed by a hash of the content of the pdb, so a complex is analyzed
+        only once regardless of the radius or the hydrophobics method used to obtain
+        its pharmacophores. Each entry stores the corrected pdb, the ligands as sdf strings
+        and the serialized interactions of each ligand.
+
+        Inherits from Cache.
+
+    Parameters
+    ----------
+    max_size: int
+        Maximum number of entries kept in memory. (Default: 32)
+
+    cache_dir: str (optional)
+        Directory where entries are persisted. If None only the in-memory tier is used.
+
+    max_disk_size: int (optional)
+        Maximum size in bytes of the on-disk tier. If None the size is not limited.
+
+    """
+    extension = ".json"
+
+    def __init__(self, max_size=32, cache_dir=None, max_disk_size=None):
+        super().__init__(max_size=max_size, cache_dir=cache_dir, max_disk_size=max_disk_size)
+
+    @staticmethod
+    def key(pdb, as_string):
+        """ Get the key of a protein-ligand complex.
+
+            Parameters
+            ----------
+            pdb: str
+                File or string containing the protein-ligand complex.
+
+            as_string: bool
+                Whether the pdb is a string or a file.
+
+            Returns
+            -------
+            str
+                Hexadecimal digest of the content of the pdb.
+        """
+        if as_string:
+            content = pdb.encode("utf8")
+        else:
+            with open(pdb, "rb") as f:
+                content = f.read()
+        return hashlib.sha1(content).hexdigest()
+
+    def get(self, key):
+        """ Get the cached analysis of a complex.
+
+            Parameters
+            ----------
+            key: str
+                The key of the complex.
+
+            Returns
+            -------
+            dict or None
+                Dictionary with the keys "pdb_string", "ligands" and "interactions". None if
+                the complex is not in the cache.
+        """
+        data = self.get_bytes(key)
+        if data is None:
+            return None
+        return json.loads(data.decode("utf8"))
+
+    def put(self, key, entry):
+        """ Store the analysis of a complex in the cache.
+
+            Parameters
+            ----------
+            key: str
+                The key of the complex.
+
+            entry: dict
+                Dictionary with the keys "pdb_string", "ligands" and "interactions".
+        """
+        self.put_bytes(key, json.dumps(entry).encode("utf8"))
+
+
+class PDBFileCache(Cache):
+    """ Cache of pdb files downloaded from the Protein Data Bank.
+
+        Inherits from Cache.
+
+    Parameters
+    ----------
+    max_size: int
+        Maximum number of files kept in memory. (Default: 8)
+
+    cache_dir: str (optional)
+        Directory where files are persisted. If None only the in-memory tier is used.
+
+    max_disk_size: int (optional)
+        Maximum size in bytes of the on-disk tier. If None the size is not limited.
+
+    """
+    extension = ".pdb"
+
+    def __init__(self, max_size=8, cache_dir=None, max_disk_size=None):
+        super().__init__(max_size=max_size, cache_dir=cache_dir, max_disk_size=max_disk_size)
+
+    def get(self, pdb_id):
+        """ Get a cached pdb.
+
+            Parameters
+            ----------
+            pdb_id: str
+                The id of the protein structure.
+
+            Returns
+            -------
+            str or None
+                The pdb as a string. None if the file is not in the cache.
+        """
+        data = self.get_bytes(pdb_id.upper())
+        if data is None:
+            return None
+        return data.decode()
+
+    def put(self, pdb_id, pdb_str):
+        """ Store a pdb in the cache.
+
+            Parameters
+            ----------
+            pdb_id: str
+                The id of the protein structure.
+
+            pdb_str: str
+                The pdb as a string.
+        """
+        self.put_bytes(pdb_id.upper(), pdb_str.encode())
+
+
+_default_interaction_cache = InteractionCache(cache_dir=os.path.join(cache_root_dir(), "interactions"),
+                                              max_disk_size=DEFAULT_MAX_DISK_SIZE)
+_default_pdb_cache = PDBFileCache(cache_dir=os.path.join(cache_root_dir(), "pdb"), max_disk_size=DEFAULT_MAX_DISK_SIZE)
+
+def get_default_interaction_cache():
+    """ Get the interaction cache used by default by openpharmacophore.
+
+        The on-disk tier is stored in the interactions subdirectory of the directory given by
+        the environment variable OPENPHARMACOPHORE_CACHE_DIR or of ~/.cache/openpharmacophore.
+
+        Returns
+        -------
+        InteractionCache or None
+            The default cache. None if caching has been disabled.
+    """
+    return _default_interaction_cache
+
+def set_default_interaction_cache(cache):
+    """ Set the interaction cache used by default by openpharmacophore.
+
+        Parameters
+        ----------
+        cache: InteractionCache or None
+            The new default cache. Pass None to disable caching.
+    """
+    global _default_interaction_cache
+    _default_interaction_cache = cache
+
+def get_default_pdb_cache():
+    """ Get the cache of downloaded pdb files used by default by openpharmacophore.
+
+        The on-disk tier is stored in the pdb subdirectory of the directory given by
+        the environment variable OPENPHARMACOPHORE_CACHE_DIR or of ~/.cache/openpharmacophore.
+
+        Returns
+        -------
+        PDBFileCache or None
+            The default cache. None if caching has been disabled.
+    """
+    return _default_pdb_cache
+
+def set_default_pdb_cache(cache):
+    """ Set the cache of downloaded pdb files used by default by openpharmacophore.
+
+        Parameters
+        ----------
+        cache: PDBFileCache or None
+            The new default cache. Pass None to disable caching.
+    """
+    global _default_pdb_cache
+    _default_pdb_cache = cache
@@ -95,7 +95,76 @@ def rdkit_points(ligands, radius, feat_list=None, direction_vector=False):
                 
     return points
 
-def custom_definition_points(ligands, radius, feat_list, feat_def, direction_vector=False):
+def compile_feature_patterns(feat_def, feat_list=None):
+    """
+        Compile the SMARTS strings of a custom feature definition into rdkit query molecules,
+        so they can be evaluated against many ligands without being parsed again.
+
+        Parameters
+        ----------
+        feat_def: dict
+            Definitions of the pharmacophoric points. 
+            Dictionary which keys are SMARTS strings and values are feature names.
+
+        feat_list: list of str (optional)
+            List of features that will be kept. If None all the features in the definition
+            are compiled.
+
+        Returns
+        -------
+        patterns: list of 2-tuples (str, rdkit.Chem.rdchem.Mol)
+            The feature name and the query molecule of each SMARTS string. The order of the
+            feature definition is preserved.
+
+    """
+    patterns = []
+    for smarts, feat_name in feat_def.items():
+        if feat_list is not None and feat_name not in feat_list:
+            continue
+        pattern = Chem.MolFromSmarts(smarts)
+        if pattern is None:
+            raise ValueError(f"{smarts} is not a valid SMARTS string")
+        patterns.append((feat_name, pattern))
+    return patterns
+
+def feature_sites(ligand, patterns, max_matches=1000):
+    """
+        Find all the feature sites of a ligand for a set of compiled SMARTS patterns.
+
+        Every pattern is evaluated against the ligand and all of its unique matches are
+        kept. Matches of different patterns that correspond to the same feature type and
+        the same set of atoms are merged into a single site.
+
+        Parameters
+        ----------
+        ligand: :obj: rdkit.Chem.rdchem.Mol
+            The ligand which feature sites will be found.
+
+        patterns: list of 2-tuples (str, rdkit.Chem.rdchem.Mol)
+            Feature names and query molecules, as returned by compile_feature_patterns.
+
+        max_matches: int
+            Maximum number of matches of a single pattern. (Default: 1000)
+
+        Returns
+        -------
+        sites: list of 2-tuples (str, tuple of int)
+            The feature name and the atom indices of each feature site.
+
+    """
+    sites = []
+    seen = set()
+    for feat_name, pattern in patterns:
+        matches = ligand.GetSubstructMatches(pattern, uniquify=True, maxMatches=max_matches)
+        for atom_idxs in matches:
+            key = (feat_name, frozenset(atom_idxs))
+            if key in seen:
+                continue
+            seen.add(key)
+            sites.append((feat_name, atom_idxs))
+    return sites
+
+def custom_definition_points(ligands, radius, feat_list, feat_def, direction_vector=False, max_matches=1000):
     """
         Get pharmacophoric points for a list of ligands using custom smarts feature definition. 
 
@@ -118,6 +187,9 @@ def custom_definition_points(ligands, radius, feat_list, feat_def, direction_vec
         direction_vector: bool
             If true aromatic, donor and acceptors points will have direction.
 
+        max_matches: int
+            Maximum number of matches of a single SMARTS pattern in a ligand. (Default: 1000)
+
         Returns
         -------
         points: dict
@@ -133,7 +205,7 @@ def custom_definition_points(ligands, radius, feat_list, feat_def, direction_vec
             ligand list.
 
     """
-    
+    patterns = compile_feature_patterns(feat_def, feat_list)
     points = {}
 
     for i, ligand in enumerate(ligands):
@@ -144,40 +216,27 @@ def custom_definition_points(ligands, radius, feat_list, feat_def, direction_vec
         ligand_id = "ligand_" + str(i)
         points[ligand_id] = {}
 
-        for feat, feat_name in feat_def.items():
-            if feat_name not in feat_list:
-                continue
-            pattern = Chem.MolFromSmarts(feat)  
-            atom_idxs = ligand.GetSubstructMatch(pattern)
-            if len(atom_idxs) == 0:
-                continue
-            for conformer_idx in range(n_conformers):
-                if len(atom_idxs) > 1: 
-                    # Find the centroid
-                    coords = feature_centroid(ligand, atom_idxs, conformer_idx) # Aromatic, hydrophobic, positive or negative feature
-                    # Find direction vector
-                    if direction_vector:
+        sites = feature_sites(ligand, patterns, max_matches)
+        if len(sites) == 0:
+            continue
+
+        for conformer_idx in range(n_conformers):
+            positions = ligand.GetConformer(conformer_idx).GetPositions()
+            conformer_id = "conformer_" + str(conformer_idx)
+            points[ligand_id][conformer_id] = []
+
+            for feat_name, atom_idxs in sites:
+                # Centroid of the feature. For donors and acceptors this is the atom position
+                coords = positions[list(atom_idxs)].mean(axis=0)
+                if direction_vector:
+                    if len(atom_idxs) > 1:
                         direction = aromatic_direction_vector(ligand, atom_idxs, conformer_idx)
                     else:
-                        direction = None
+                        direction = donor_acceptor_direction_vector(ligand, feat_name, atom_idxs[0], coords, conformer_idx)
                 else:
-                    # Find the centroid
-                    position = ligand.GetConformer(conformer_idx).GetAtomPosition(atom_idxs[0]) # Donor or acceptor feature
-                    coords = np.zeros((3,))
-                    coords[0] = position.x
-                    coords[1] = position.y
-                    coords[2] = position.z
-                    # Find direction vector
-                    if direction_vector:
-                        direction = donor_acceptor_direction_vector(ligand, atom_idxs[0], coords, conformer_idx)
-                    else:
-                        direction = None
+                    direction = None
 
                 point = rdkit_to_point(feat_name, coords, radius=radius, direction=direction, atom_indices=atom_idxs)
-                conformer_id = "conformer_" + str(conformer_idx)
-
-                if conformer_id not in points[ligand_id]:
-                    points[ligand_id][conformer_id] = []
                 points[ligand_id][conformer_id].append(point)
 
     return points
@@ -0,0 +1,103 @@
+from openpharmacophore.utils.cache import Cache
+import hashlib
+import struct
+import threading
+import time
+
+class ResponseCache(Cache):
+    """ Cache of responses of web services with a time to live.
+
+        Each entry stores the time when it was downloaded, entries older than the time
+        to live are ignored and downloaded again.
+
+        Inherits from Cache.
+
+    Parameters
+    ----------
+    max_size: int
+        Maximum number of responses kept in memory. (Default: 128)
+
+    cache_dir: str (optional)
+        Directory where responses are persisted. If None only the in-memory tier is used.
+
+    ttl: float (optional)
+        Time to live of the entries in seconds. If None entries never expire.
+        (Default: one week)
+
+    max_disk_size: int (optional)
+        Maximum size in bytes of the on-disk tier. If None the size is not limited.
+
+    """
+    extension = ".response"
+    _header = struct.Struct("<d")
+
+    def __init__(self, max_size=128, cache_dir=None, ttl=7 * 24 * 3600, max_disk_size=None):
+        super().__init__(max_size, cache_dir, max_disk_size)
+        self.ttl = ttl
+        # Responses may be downloaded by several threads at the same time
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(method, url, data=None):
+        """ Get the key of the response of a request.
+
+            Parameters
+            ----------
+            method: str
+                The HTTP method, such as GET or POST.
+
+            url: str
+                The url of the request.
+
+            data: str or dict (optional)
+                The body of the request.
+
+            Returns
+            -------
+            str
+                Hexadecimal digest that identifies the response.
+        """
+        if isinstance(data, dict):
+            data = "&".join(f"{k}={v}" for k, v in sorted(data.items()))
+        content = "\n".join([method.upper(), url, "" if data is None else str(data)])
+        return hashlib.sha1(content.encode("utf8")).hexdigest()
+
+    def get(self, key):
+        """ Get a cached response.
+
+            Parameters
+            ----------
+            key: str
+                The key of the response.
+
+            Returns
+            -------
+            bytes or None
+                The content of the response. None if it is not in the cache or it has expired.
+        """
+        with self._lock:
+            data = self.get_bytes(key)
+            if data is None:
+                return None
+            stored_at = self._header.unpack_from(data)[0]
+            if self.ttl is not None and time.time() - stored_at > self.ttl:
+                # Expired entries count as misses
+                self._memory.pop(key, None)
+                self.hits -= 1
+                self.misses += 1
+                return None
+            return data[self._header.size:]
+
+    def put(self, key, content):
+        """ Store a response in the cache.
+
+            Parameters
+            ----------
+            key: str
+                The key of the response.
+
+            content: bytes
+                The content of the response.
+        """
+        with self._lock:
+            self.put_bytes(key, self._header.pack(time.time()) + content)
@@ -0,0 +1,142 @@
+from openpharmacophore._private_tools.exceptions import InvalidFileFormat, MissingParameters
+import mdtraj as mdt
+import numpy as np
+
+# Formats that store the topology in the same file as the coordinates
+_FORMATS_WITH_TOPOLOGY = ("h5",)
+_FORMATS_WITHOUT_TOPOLOGY = ("dcd", "xtc", "trr", "nc", "netcdf")
+
+def check_trajectory_file(file_name, topology=None):
+    """ Check that a trajectory file can be read in chunks.
+
+        Parameters
+        ----------
+        file_name: str
+            Name of the file containing the trajectory.
+
+        topology: str (optional)
+            Name of a file with the topology of the trajectory, such as a pdb. Required
+            for formats that don't store the topology (dcd, xtc, trr, netcdf).
+    """
+    extension = file_name.split(".")[-1].lower()
+    if extension in _FORMATS_WITHOUT_TOPOLOGY:
+        if topology is None:
+            raise MissingParameters(f"A topology file is required to read {extension} trajectories")
+    elif extension not in _FORMATS_WITH_TOPOLOGY:
+        raise InvalidFileFormat(f"{file_name} is not a supported trajectory format")
+
+def trajectory_n_frames(file_name):
+    """ Get the number of frames of a trajectory file without loading it.
+
+        Parameters
+        ----------
+        file_name: str
+            Name of the file containing the trajectory.
+
+        Returns
+        -------
+        int
+            The number of frames.
+    """
+    with mdt.open(file_name) as f:
+        return len(f)
+
+def _read_as_traj(trajectory_file, topology, n_frames, stride=1):
+    """ Read frames from the current position of an open trajectory file.
+    """
+    if topology is None:
+        # Formats that store the topology don't take it as an argument
+        return trajectory_file.read_as_traj(n_frames=n_frames, stride=stride)
+    return trajectory_file.read_as_traj(topology, n_frames=n_frames, stride=stride)
+
+def load_trajectory_frames(file_name, frames, topology=None):
+    """ Load some frames of a trajectory file without loading the whole trajectory.
+
+        Parameters
+        ----------
+        file_name: str
+            Name of the file containing the trajectory.
+
+        frames: list of int
+            Indices of the frames. Negative indices count from the end of the trajectory.
+
+        topology: str (optional)
+            Name of a file with the topology of the trajectory.
+
+        Returns
+        -------
+        numpy.ndarray of shape (n_frames, n_atoms, 3)
+            The coordinates in angstroms.
+    """
+    if topology is not None:
+        topology = mdt.load_topology(topology)
+
+    coordinates = []
+    with mdt.open(file_name) as f:
+        n_frames = len(f)
+        for frame in frames:
+            if frame < 0:
+                frame += n_frames
+            if frame < 0 or frame >= n_frames:
+                raise IndexError(f"Frame {frame} is out of range for a trajectory with {n_frames} frames")
+            f.seek(frame)
+            # mdtraj coordinates are in nanometers
+            coordinates.append(_read_as_traj(f, topology, 1).xyz[0] * 10)
+    return np.array(coordinates)
+
+def iterload_coordinates(file_name, topology=None, chunk=100, start=0, stop=None, stride=1):
+    """ Iterate over a trajectory file in chunks of frames, so that only one chunk is
+        kept in memory at a time.
+
+        Parameters
+        ----------
+        file_name: str
+            Name of the file containing the trajectory.
+
+        topology: str (optional)
+            Name of a file with the topology of the trajectory.
+
+        chunk: int
+            Maximum number of frames of each chunk. (Default: 100)
+
+        start: int
+            Index of the first frame. (Default: 0)
+
+        stop: int (optional)
+            The iteration stops before this frame. If None it continues until the end
+            of the trajectory.
+
+        stride: int
+            Read every stride-th frame. (Default: 1)
+
+        Yields
+        ------
+        frames: list of int
+            The indices of the frames of the chunk.
+
+        coordinates: numpy.ndarray of shape (n_frames, n_atoms, 3)
+            The coordinates of the frames of the chunk in angstroms.
+    """
+    if stride < 1:
+        raise ValueError("stride must be a positive integer")
+    if chunk < 1:
+        raise ValueError("chunk must be a positive integer")
+    if topology is not None:
+        topology = mdt.load_topology(topology)
+
+    with mdt.open(file_name) as f:
+        n_frames = len(f)
+        stop = n_frames if stop is None else min(stop, n_frames)
+        frame = start
+        while frame < stop:
+            n_chunk_frames = min(chunk, -(-(stop - frame) // stride))
+            # Seek explicitly before every read, the position after a strided read
+            # is not consistent across formats
+            f.seek(frame)
+            trajectory = _read_as_traj(f, topology, n_chunk_frames, stride)
+            if trajectory.n_frames == 0:
+                break
+            frames = list(range(frame, frame + trajectory.n_frames * stride, stride))
+            # mdtraj coordinates are in nanometers
+            yield frames, trajectory.xyz * 10
+            frame += trajectory.n_frames * stride